@@ -0,0 +1,24 @@
+"""
+Micro-benchmarks. They are not part of the test suite, run them individually:
+
+    python -m benchmarks.bench_money
+"""
+import os
+import timeit
+
+
+def setup_django(database: bool = False) -> None:
+    """ Configure django with the test settings, optionally with a migrated in-memory database. """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+    if database:
+        from django.core.management import call_command
+        call_command('migrate', verbosity=0)
+
+
+def report(name: str, stmt, number: int) -> float:
+    """ Run stmt number times (best of 5) and print the time per call. Returns the seconds per call. """
+    seconds = min(timeit.repeat(stmt, number=number, repeat=5)) / number
+    print('{:<50} {:>10.2f} us/call'.format(name, seconds * 1e6))
+    return seconds
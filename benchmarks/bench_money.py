@@ -0,0 +1,69 @@
+"""
+Compares the Money based arithmetic of the capture and refund paths with the integer minor-unit one.
+
+For a single operation the conversions to and from minor units cost more than the arithmetic they save,
+which is why the state machine stays on Money.
+"""
+from benchmarks import report, setup_django
+
+setup_django()
+
+from moneyed import Money  # noqa: E402
+
+from payment import ChargeStatus  # noqa: E402
+from payment.money import MinorMoney  # noqa: E402
+
+TOTAL = Money('120.50', 'CHF')
+CAPTURED = Money('20.25', 'CHF')
+AMOUNT = Money('50.10', 'CHF')
+
+
+def money_capture():
+    if AMOUNT.amount <= 0 or AMOUNT > TOTAL or AMOUNT > (TOTAL - CAPTURED):
+        raise ValueError()
+    captured = CAPTURED + AMOUNT
+    return captured, ChargeStatus.FULLY_CHARGED if (TOTAL - captured).amount <= 0 else ChargeStatus.PARTIALLY_CHARGED
+
+
+def minor_capture():
+    amount, total, captured = MinorMoney.from_money(AMOUNT), MinorMoney.from_money(TOTAL), \
+        MinorMoney.from_money(CAPTURED)
+    if amount.amount <= 0 or amount > total or amount > (total - captured):
+        raise ValueError()
+    captured += amount
+    return captured.to_money(), \
+        ChargeStatus.FULLY_CHARGED if (total - captured).amount <= 0 else ChargeStatus.PARTIALLY_CHARGED
+
+
+def money_refund():
+    if AMOUNT.amount <= 0 or AMOUNT > TOTAL:
+        raise ValueError()
+    captured = TOTAL - AMOUNT
+    return captured, ChargeStatus.FULLY_REFUNDED if captured.amount <= 0 else ChargeStatus.PARTIALLY_REFUNDED
+
+
+def minor_refund():
+    amount, captured = MinorMoney.from_money(AMOUNT), MinorMoney.from_money(TOTAL)
+    if amount.amount <= 0 or amount > captured:
+        raise ValueError()
+    captured -= amount
+    return captured.to_money(), \
+        ChargeStatus.FULLY_REFUNDED if captured.amount <= 0 else ChargeStatus.PARTIALLY_REFUNDED
+
+
+def minor_arithmetic_only():
+    total, captured, amount = MinorMoney(12050, 'CHF'), MinorMoney(2025, 'CHF'), MinorMoney(5010, 'CHF')
+    return amount > total or amount > (total - captured), captured + amount
+
+
+def main():
+    n = 20000
+    report('capture path, Money', money_capture, n)
+    report('capture path, MinorMoney (with edge conversions)', minor_capture, n)
+    report('refund path, Money', money_refund, n)
+    report('refund path, MinorMoney (with edge conversions)', minor_refund, n)
+    report('MinorMoney arithmetic only', minor_arithmetic_only, n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+End-to-end throughput of gateway_authorize and gateway_capture on netaxept payments: the gateway calls, the HTTP
+requests, the parsing of the responses and the transactions, against the fake netaxept server. Without latency it
+measures the overhead of the payment application, with latency (the real service answers in tens of milliseconds)
+how much of it is left.
+"""
+import copy
+import logging
+
+import structlog
+from moneyed import Money
+
+from benchmarks import report, setup_django
+
+setup_django(database=True)
+
+from django.conf import settings  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from payment.gateways.netaxept import actions  # noqa: E402
+from payment.gateways.netaxept.fake_server import FakeNetaxept  # noqa: E402
+from payment.models import Payment  # noqa: E402
+from payment.utils import gateway_authorize, gateway_capture  # noqa: E402
+
+
+def gateways(server):
+    gateways = copy.deepcopy(settings.PAYMENT_GATEWAYS)
+    gateways[settings.NETAXEPT]['config']['connection_params'].update(
+        base_url=server.url, merchant_id='123456', secret='secret', after_terminal_url='http://localhost')
+    return gateways
+
+
+def registered_payment(server):
+    payment = Payment.objects.create(gateway=settings.NETAXEPT, total=Money(10, 'NOK'),
+                                     captured_amount=Money(0, 'NOK'), customer_email='test@example.com')
+    server.pay(actions.register_payment(payment))
+    return payment
+
+
+def main():
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    n = 100
+    for latency in [0, 0.02]:
+        server = FakeNetaxept().start()
+        try:
+            with override_settings(PAYMENT_GATEWAYS=gateways(server)):
+                payment = registered_payment(server)
+                authorized = []
+                for _ in range(5 * n):
+                    authorized.append(registered_payment(server))
+                    gateway_authorize(authorized[-1], authorized[-1].token)
+                to_capture = iter(authorized)  # timeit calls the statement 5 * n times
+                server.latency = latency
+                name = '{} ms latency'.format(int(latency * 1000))
+                report('gateway_authorize, {}'.format(name), lambda: gateway_authorize(payment, payment.token), n)
+                report('gateway_capture, {}'.format(name), lambda: gateway_capture(next(to_capture)), n)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compares the latency of netaxept calls on the pooled keep-alive session of the config with a new connection per
+call (the bare requests.post), against a local fake of the Netaxept API (so without the TLS handshake, that
+keep-alive also saves in production).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import requests
+import structlog
+from moneyed import Money
+
+from benchmarks import report, setup_django
+
+setup_django()
+
+from payment.gateways.netaxept import netaxept_protocol  # noqa: E402
+from payment.gateways.netaxept.netaxept_protocol import NetaxeptConfig  # noqa: E402
+from payment.gateways.netaxept.fake_server import FakeNetaxept  # noqa: E402
+
+
+def main():
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    server = FakeNetaxept().start()
+    config = NetaxeptConfig(merchant_id='123456', secret='secret', base_url=server.url,
+                            after_terminal_url='http://localhost')
+    transaction_id = netaxept_protocol.register(config, Money(10, 'NOK'), order_number='1').transaction_id
+    n = 200
+    try:
+        for pooled in [False, True]:
+            name = 'pooled session' if pooled else 'new connection per call'
+            with patch.object(netaxept_protocol, 'get_session', netaxept_protocol.get_session if pooled else
+                              lambda config: requests):
+                report('query, {}'.format(name), lambda: netaxept_protocol.query(config, transaction_id), n)
+
+                def burst():
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        list(executor.map(lambda _: netaxept_protocol.query(config, transaction_id), range(32)))
+
+                report('burst of 32 queries on 8 threads, {}'.format(name), burst, 5)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
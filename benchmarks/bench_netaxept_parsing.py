@@ -0,0 +1,79 @@
+"""
+Compares reading the summary of a large netaxept PaymentInfo (a query response, with a long history) with
+parse_fields, and with xmltodict (when it is installed) that builds the whole document as nested dicts.
+"""
+from benchmarks import report, setup_django
+
+setup_django()
+
+from payment.gateways.netaxept.netaxept_protocol import _QUERY_FIELDS  # noqa: E402
+from payment.gateways.netaxept.parsing import etree, parse_fields  # noqa: E402
+
+try:
+    import xmltodict
+except ImportError:  # pragma: no cover
+    xmltodict = None
+
+HISTORY_LINE = """
+    <TransactionLogLine>
+        <DateTime>2019-09-11T16:30:24.81</DateTime>
+        <Description>127.0.0.1: Auto AUTH</Description>
+        <Operation>Capture</Operation>
+        <Amount>100</Amount>
+        <BatchNumber>672</BatchNumber>
+    </TransactionLogLine>"""
+
+PAYMENT_INFO = """<?xml version="1.0" encoding="utf-8"?>
+<PaymentInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <MerchantId>11111111</MerchantId>
+  <QueryFinished>2019-10-14T10:15:07.2677951+02:00</QueryFinished>
+  <TransactionId>1111111111114cf693a1cf86123e0d8f</TransactionId>
+  <OrderInformation>
+    <Amount>700</Amount><Currency>NOK</Currency><OrderNumber>7</OrderNumber><OrderDescription> </OrderDescription>
+    <Fee>0</Fee><RoundingAmount>0</RoundingAmount><Total>700</Total><Timestamp>2019-09-11T16:30:06.967</Timestamp>
+  </OrderInformation>
+  <TerminalInformation>
+    <CustomerEntered>2019-09-11T16:30:08.513</CustomerEntered>
+    <CustomerRedirected>2019-09-11T16:30:24.903</CustomerRedirected>
+    <Browser>Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/77.0 Safari/537.36</Browser>
+  </TerminalInformation>
+  <CustomerInformation>
+    <Email /><IP>85.218.56.162</IP><PhoneNumber /><CustomerNumber /><FirstName /><LastName /><Address1 />
+    <Address2 /><Postcode /><Town /><Country /><SocialSecurityNumber /><CompanyName /><CompanyRegistrationNumber />
+  </CustomerInformation>
+  <Summary>
+    <AmountCaptured>700</AmountCaptured><AmountCredited>0</AmountCredited><Annulled>false</Annulled>
+    <Annuled>false</Annuled><Authorized>true</Authorized><AuthorizationId>169337</AuthorizationId>
+  </Summary>
+  <CardInformation>
+    <Issuer>Visa</Issuer><IssuerCountry>NO</IssuerCountry><MaskedPAN>492500******0004</MaskedPAN>
+    <PaymentMethod>Visa</PaymentMethod><ExpiryDate>2301</ExpiryDate><IssuerId>3</IssuerId>
+  </CardInformation>
+  <History>{history}
+  </History>
+  <ErrorLog />
+  <AuthenticationInformation />
+  <AvtaleGiroInformation />
+  <SecurityInformation>
+    <CustomerIPCountry>CH</CustomerIPCountry><IPCountryMatchesIssuingCountry>false</IPCountryMatchesIssuingCountry>
+  </SecurityInformation>
+</PaymentInfo>"""
+
+
+def with_xmltodict(text):
+    summary = xmltodict.parse(text)['PaymentInfo']['Summary']
+    return summary['Annulled'], summary['Authorized'], summary.get('AuthorizationId')
+
+
+def main():
+    print('parser: {}'.format(etree.__name__))
+    for lines in [2, 50]:
+        text = PAYMENT_INFO.format(history=HISTORY_LINE * lines)
+        name = 'PaymentInfo, {} history lines ({} KB)'.format(lines, len(text) // 1000)
+        if xmltodict is not None:
+            report('xmltodict, {}'.format(name), lambda: with_xmltodict(text), 500)
+        report('parse_fields, {}'.format(name), lambda: parse_fields(text, 'PaymentInfo', _QUERY_FIELDS), 500)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Compares the latency of stripe authorizations on pooled keep-alive connections with a new connection per call,
+against a local fake of the Stripe API (so without the TLS handshake, that keep-alive also saves in production).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from benchmarks import report, setup_django
+
+setup_django()
+
+import stripe  # noqa: E402
+
+from payment.gateways.stripe import authorize  # noqa: E402
+from payment.interface import GatewayConfig, PaymentData  # noqa: E402
+from tests.gateways.fake_stripe import FakeStripe  # noqa: E402
+
+PAYMENT = PaymentData(token='tok_visa', amount=Decimal('12.50'), currency='CHF', billing=None, shipping=None,
+                      order_id=None, customer_ip_address='127.0.0.1', customer_email='a@b.ch', metadata={})
+
+
+def config(**connection_params) -> GatewayConfig:
+    return GatewayConfig(auto_capture=True, template_path='',
+                         connection_params={'secret_key': 'sk_test', **connection_params})
+
+
+def main():
+    server = FakeStripe().start()
+    stripe.api_base = server.url
+    n = 200
+    try:
+        for keep_alive in [False, True]:
+            gateway_config = config(keep_alive=keep_alive)
+            name = 'keep-alive' if keep_alive else 'new connection per call'
+            report('authorize, {}'.format(name), lambda: authorize(PAYMENT, gateway_config), n)
+
+            def burst():
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(executor.map(lambda _: authorize(PAYMENT, gateway_config), range(32)))
+
+            report('burst of 32 authorizations on 8 threads, {}'.format(name), burst, 5)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
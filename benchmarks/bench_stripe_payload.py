@@ -0,0 +1,73 @@
+"""
+The construction of the stripe charge payload, with a shipping address and a Stripe Connect transfer.
+
+The per-charge construction is compared with the previous one, that rebuilt the map of the country names
+and read and validated the STRIPE_CONNECT setting for each charge, and with a routing by seller.
+"""
+import logging
+from dataclasses import replace
+from decimal import Decimal
+
+import structlog
+
+from benchmarks import report, setup_django
+
+setup_django(database=True)
+
+from django.conf import settings  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django_countries import countries  # noqa: E402
+
+from payment.gateways.stripe import _get_stripe_charge_payload, connect  # noqa: E402
+from payment.interface import AddressData, PaymentData  # noqa: E402
+from payment.models import StripeConnectRoute  # noqa: E402
+
+SHIPPING = AddressData(first_name='Ada', last_name='Lovelace', company_name='', street_address_1='Bahnhofstrasse 1',
+                       street_address_2='', city='Zürich', city_area='', postal_code='8001', country='CH',
+                       country_area='ZH', phone='')
+PAYMENT = PaymentData(token='tok_visa', amount=Decimal('12.50'), currency='CHF', billing=None, shipping=SHIPPING,
+                      order_id=None, customer_ip_address='127.0.0.1', customer_email='a@b.ch',
+                      metadata={'order': '42'})
+
+
+def previous_payload():
+    payload = _get_stripe_charge_payload(PAYMENT, should_capture=False)
+    payload['shipping']['address']['country'] = dict(countries).get(SHIPPING.country, '')
+    connect_settings = settings.STRIPE_CONNECT
+    percent = int(connect_settings['transfer_percent'])
+    if percent < 0 or percent > 100:
+        raise Exception()
+    connect.add_transfer_data(payload, connect_settings['transfer_destination'], percent)
+    return payload
+
+
+def payload():
+    payload = _get_stripe_charge_payload(PAYMENT, should_capture=False)
+    connect.maybe_add_transfer_data(payload, PAYMENT)
+    return payload
+
+
+def main():
+    # Without the debug log lines of each transfer
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.INFO))
+    n = 5000
+    with override_settings(STRIPE_CONNECT={'transfer_destination': 'acct_1', 'transfer_percent': 90}):
+        assert payload() == previous_payload()
+        report('charge payload, rebuilt for each charge', previous_payload, n)
+        report('charge payload, static parts computed once', payload, n)
+
+    # Routed by the seller of the payment metadata, from the cached route table
+    StripeConnectRoute.objects.create(seller='seller-1', destination='acct_2', percent=80)
+    seller_payment = replace(PAYMENT, metadata={'seller': 'seller-1'})
+
+    def routed_payload():
+        payload = _get_stripe_charge_payload(seller_payment, should_capture=False)
+        connect.maybe_add_transfer_data(payload, seller_payment)
+        return payload
+
+    assert routed_payload()['transfer_data'] == {'destination': 'acct_2', 'amount': 1000}
+    report('charge payload, routed by seller (cached route)', routed_payload, n)
+
+
+if __name__ == '__main__':
+    main()
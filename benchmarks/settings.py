@@ -0,0 +1,10 @@
+# flake8: noqa
+
+from tests.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:'
+    },
+}
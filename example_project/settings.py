@@ -129,6 +129,7 @@ PAYMENT_GATEWAYS = {
             'connection_params': {
                 'public_key': os.environ.get('STRIPE_PUBLIC_KEY'),
                 'secret_key': os.environ.get('STRIPE_SECRET_KEY'),
+                'webhook_secret': os.environ.get('STRIPE_WEBHOOK_SECRET'),
                 'store_name': os.environ.get('STRIPE_STORE_NAME', 'skioo shop'),
                 'store_image': os.environ.get('STRIPE_STORE_IMAGE', None),
                 'prefill': os.environ.get('STRIPE_PREFILL', True),
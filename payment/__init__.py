@@ -1,8 +1,11 @@
 import importlib
 from enum import Enum
+from functools import lru_cache
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.translation import pgettext_lazy
 
 from .interface import GatewayConfig
@@ -113,6 +116,12 @@ GATEWAYS_ENUM = Enum(  # type:ignore
 def get_payment_gateway(gateway_name):
     if gateway_name not in settings.CHECKOUT_PAYMENT_GATEWAYS:
         raise ValueError("%s is not allowed gateway" % gateway_name)
+    return _load_payment_gateway(gateway_name)
+
+
+@lru_cache(maxsize=None)
+def _load_payment_gateway(gateway_name):
+    """The gateway settings are only read once, until they are changed (for instance by a test)."""
     if gateway_name not in settings.PAYMENT_GATEWAYS:
         raise ImproperlyConfigured(
             "Payment gateway %s is not configured." % gateway_name
@@ -135,3 +144,9 @@ def get_payment_gateway(gateway_name):
     )
 
     return gateway_module, config
+
+
+@receiver(setting_changed)
+def _clear_payment_gateway_cache(setting, **kwargs):
+    if setting == "PAYMENT_GATEWAYS":
+        _load_payment_gateway.cache_clear()
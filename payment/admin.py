@@ -1,10 +1,16 @@
+from functools import lru_cache
+
 from django.conf.urls import url
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
 from django.forms import forms
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.html import format_html
+from django.utils.http import urlencode
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from djmoney.forms import MoneyField
@@ -12,8 +18,12 @@ from import_export.admin import ExportMixin
 from import_export.formats import base_formats
 from moneyed.localization import format_money
 
-from .export import PaymentResource
-from .models import Payment, Transaction
+from .bulk import CAPTURE, REFUND, VOID, get_bulk_job, start_bulk_operation
+from .export import PAYMENT_EXPORT_FIELDS, TRANSACTION_EXPORT_FIELDS, PaymentResource, TransactionResource, \
+    export_rows, streaming_export_response
+from .models import Payment, StripeConnectRoute, Transaction
+from .pagination import CreatedRangeFilter, LargeTableAdminMixin, LargeTableChangeList, format_cursor, older_than
+from .search import payment_search_filter, transaction_search_filter
 from .utils import gateway_refund, gateway_void, gateway_capture
 
 
@@ -21,8 +31,14 @@ from .utils import gateway_refund, gateway_void, gateway_capture
 # Shared utilities
 
 
+@lru_cache(maxsize=1024)
+def cached_format_money(money):
+    """Changelists display the same few amounts over and over, formatting them is comparatively slow."""
+    return format_money(money)
+
+
 def amount(obj):
-    return format_money(obj.amount)
+    return cached_format_money(obj.amount)
 
 
 amount.admin_order_field = 'amount'  # type: ignore
@@ -45,36 +61,104 @@ modified_on.admin_order_field = 'modified'  # type: ignore
 modified_on.short_description = _('modified')  # type: ignore
 
 
+@lru_cache(maxsize=None)
+def _queryset_only(changelist_class):
+    """ The changelist class, without the count and the page of results that it fetches when it is created. """
+    return type('QuerysetOnly' + changelist_class.__name__, (changelist_class,),
+                {'get_results': lambda self, request: None})
+
+
+class StreamingExportMixin:
+    """
+    Export the rows of the changelist (with its filters and search) as CSV or JSON lines,
+    streamed from the database in constant memory.
+    """
+    export_fields = None  # The names of the columns, and the database columns they are read from.
+    export_filename = None
+
+    def get_streaming_export_queryset(self, request):
+        """ The queryset of the changelist (its filters and search), without fetching a page of results. """
+        list_display = self.get_list_display(request)
+        cl = _queryset_only(self.get_changelist(request))(
+            request, self.model, list_display, self.get_list_display_links(request, list_display),
+            self.get_list_filter(request), self.date_hierarchy, self.get_search_fields(request),
+            self.get_list_select_related(request), self.list_per_page, self.list_max_show_all, self.list_editable,
+            self, self.get_sortable_by(request))
+        # The plain queryset of the model, the annotations of the changelist are not needed for the export.
+        cl.root_queryset = self.model._default_manager.all()
+        return cl.get_queryset(request).order_by('pk')
+
+    def stream_export(self, request, file_format):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        rows = export_rows(self.get_streaming_export_queryset(request), self.export_fields)
+        return streaming_export_response(self.export_fields, rows, file_format, self.export_filename)
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        my_urls = [
+            url(r'^export/stream/(?P<file_format>csv|jsonl)/$',
+                self.admin_site.admin_view(self.stream_export),
+                name='%s_%s_stream_export' % info),
+        ]
+        return my_urls + super().get_urls()
+
+
 ##############################################################
 # Transactions
 #
 
-class TransactionInline(admin.TabularInline):
-    model = Transaction
-    ordering = ['-created']
-    show_change_link = True
+TIMELINE_PAGE_SIZE = 20
+
 
-    # The gateway response is a huge field so we don't show it in the inline.
-    # We let the user click on the inline change link to see all the details of the transaction.
-    fields = readonly_fields = ['created', 'token', 'kind', amount, 'is_success', 'error']
+def transaction_timeline_context(payment, cursor=None):
+    """
+    A window of the transactions of the payment, newest first, and the url of the next window.
+    The gateway response is a huge field so it is only loaded when the user asks for it.
+    """
+    transactions = payment.transactions.defer('gateway_response').order_by('-created', '-pk')
+    if cursor:
+        transactions = transactions.filter(older_than(cursor))
+    transactions = list(transactions[:TIMELINE_PAGE_SIZE + 1])
+    next_url = None
+    if len(transactions) > TIMELINE_PAGE_SIZE:
+        transactions = transactions[:TIMELINE_PAGE_SIZE]
+        next_url = '{}?{}'.format(reverse('admin:payment_transaction_timeline', args=[payment.pk]),
+                                  urlencode({'after': format_cursor(transactions[-1])}))
+    return {'transactions': transactions, 'next_url': next_url}
 
-    def has_add_permission(self, request, obj=None):
-        return False
 
-    def has_delete_permission(self, request, obj=None):
-        return request.user.is_superuser
+class TransactionChangeList(LargeTableChangeList):
+    def get_queryset(self, request):
+        # The gateway response is a huge field that is not displayed in the list.
+        return super().get_queryset(request).defer('gateway_response')
 
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    date_hierarchy = 'created'
+class TransactionAdmin(StreamingExportMixin, ExportMixin, LargeTableAdminMixin, admin.ModelAdmin):
     ordering = ['-created']
-    list_filter = ['kind', 'is_success']
+    list_filter = [CreatedRangeFilter, 'kind', 'is_success']
     list_display = ['created', amount, 'kind', 'is_success', 'token', 'error']
-    search_fields = ['token', 'payment__id']
+    search_fields = ['token', 'payment__id']  # See get_search_results
 
     readonly_fields = ['created']
 
+    resource_class = TransactionResource
+    formats = (base_formats.CSV, base_formats.XLS, base_formats.JSON)  # Only useful and safe formats.
+    change_list_template = 'admin/payment/change_list_export.html'
+
+    # The gateway responses are not exported from the admin, see the export_transactions command.
+    export_fields = TRANSACTION_EXPORT_FIELDS
+    export_filename = 'transactions'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(transaction_search_filter(search_term)), False
+
+    def get_changelist(self, request, **kwargs):
+        return TransactionChangeList
+
 
 ##############################################################
 # Payments
@@ -157,32 +241,84 @@ def void_payment_form(request, payment_id):
     )
 
 
+def bulk_action(operation, description):
+    def action(modeladmin, request, queryset):
+        job_id = start_bulk_operation(operation, queryset.values_list('pk', flat=True), request.user.pk)
+        return HttpResponseRedirect(reverse('admin:payment_bulk_job', args=[job_id]))
+
+    action.__name__ = 'bulk_{}'.format(operation)
+    action.short_description = description  # type: ignore
+    action.allowed_permissions = ('change',)  # type: ignore
+    return action
+
+
 @admin.register(Payment)
-class PaymentAdmin(ExportMixin, admin.ModelAdmin):
-    date_hierarchy = 'created'
+class PaymentAdmin(StreamingExportMixin, ExportMixin, LargeTableAdminMixin, admin.ModelAdmin):
     ordering = ['-created']
-    list_filter = ['gateway', 'is_active', 'charge_status']
+    list_filter = [CreatedRangeFilter, 'gateway', 'is_active', 'charge_status', 'needs_reconciliation']
     list_display = ['created', 'gateway', 'is_active', 'charge_status', 'formatted_total', 'formatted_captured_amount',
-                    'customer_email']
-    search_fields = ['customer_email', 'token', 'total', 'id']
+                    'customer_email', 'transaction_count', 'capturable', 'voidable', 'refundable']
+    search_fields = ['customer_email', 'token', 'total', 'id']  # See get_search_results
+
+    readonly_fields = ['created', 'modified', 'operation_button', 'transaction_timeline']
 
-    readonly_fields = ['created', 'modified', 'operation_button']
-    inlines = [TransactionInline]
+    actions = [
+        bulk_action(CAPTURE, _('Capture selected payments')),
+        bulk_action(VOID, _('Void selected payments')),
+        bulk_action(REFUND, _('Refund selected payments')),
+    ]
 
     resource_class = PaymentResource
     formats = (base_formats.CSV, base_formats.XLS, base_formats.JSON)  # Only useful and safe formats.
+    change_list_template = 'admin/payment/change_list_export.html'
+
+    export_fields = PAYMENT_EXPORT_FIELDS
+    export_filename = 'payments'
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(payment_search_filter(search_term)), False
+
+    def get_queryset(self, request):
+        # The annotations let the capability columns and the operation buttons work without querying the transactions.
+        return super().get_queryset(request).with_transaction_summary()
 
     def formatted_total(self, obj):
-        return format_money(obj.total)
+        return cached_format_money(obj.total)
 
     formatted_total.short_description = _('total')  # type: ignore
 
     def formatted_captured_amount(self, obj):
         if obj.captured_amount is not None:
-            return format_money(obj.captured_amount)
+            return cached_format_money(obj.captured_amount)
 
     formatted_captured_amount.short_description = _('captured amount')  # type: ignore
 
+    def transaction_count(self, obj):
+        return obj.transaction_count
+
+    transaction_count.admin_order_field = 'transaction_count'  # type: ignore
+    transaction_count.short_description = _('transactions')  # type: ignore
+
+    def capturable(self, obj):
+        return obj.can_capture()
+
+    capturable.boolean = True  # type: ignore
+    capturable.short_description = _('can capture')  # type: ignore
+
+    def voidable(self, obj):
+        return obj.can_void()
+
+    voidable.boolean = True  # type: ignore
+    voidable.short_description = _('can void')  # type: ignore
+
+    def refundable(self, obj):
+        return obj.can_refund()
+
+    refundable.boolean = True  # type: ignore
+    refundable.short_description = _('can refund')  # type: ignore
+
     def get_urls(self):
         urls = super().get_urls()
         my_urls = [
@@ -195,9 +331,50 @@ class PaymentAdmin(ExportMixin, admin.ModelAdmin):
             url(r'^(?P<payment_id>[0-9a-f-]+)/capture/$',
                 self.admin_site.admin_view(capture_payment_form),
                 name='payment_capture'),
+            url(r'^(?P<payment_id>[0-9a-f-]+)/transactions/$',
+                self.admin_site.admin_view(self.transaction_timeline_view),
+                name='payment_transaction_timeline'),
+            url(r'^bulk/(?P<job_id>[0-9a-f]+)/$',
+                self.admin_site.admin_view(self.bulk_job_view),
+                name='payment_bulk_job'),
+            url(r'^transactions/(?P<transaction_id>[0-9]+)/gateway-response/$',
+                self.admin_site.admin_view(self.transaction_gateway_response_view),
+                name='payment_transaction_gateway_response'),
         ]
         return my_urls + urls
 
+    def transaction_timeline_view(self, request, payment_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        payment = get_object_or_404(Payment, pk=payment_id)
+        try:
+            context = transaction_timeline_context(payment, request.GET.get('after'))
+        except IncorrectLookupParameters as e:
+            return HttpResponseBadRequest(str(e))
+        return render(request, 'admin/payment/transaction_rows.html', context)
+
+    def bulk_job_view(self, request, job_id):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        job = get_bulk_job(job_id)
+        if job is None or job['user_id'] != request.user.pk:  # Only its user follows a job
+            raise Http404('Unknown or expired job')
+        return render(
+            request,
+            'admin/payment/bulk_job.html',
+            {
+                'title': 'Bulk {} of {} payments'.format(job['operation'], job['total']),
+                'job': job,
+                'opts': Payment._meta,  # Used to setup the navigation / breadcrumbs of the page
+            }
+        )
+
+    def transaction_gateway_response_view(self, request, transaction_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        transaction = get_object_or_404(Transaction.objects.only('gateway_response'), pk=transaction_id)
+        return HttpResponse(transaction.gateway_response, content_type='text/plain; charset=utf-8')
+
     def operation_button(self, payment):
         buttons = []
         if payment.can_capture():
@@ -219,3 +396,16 @@ class PaymentAdmin(ExportMixin, admin.ModelAdmin):
         return mark_safe('&nbsp;&nbsp;'.join(buttons)) if buttons else '-'
 
     operation_button.short_description = _('Operation')  # type: ignore
+
+    def transaction_timeline(self, payment):
+        if payment.pk is None:
+            return '-'
+        return render_to_string('admin/payment/transaction_timeline.html', transaction_timeline_context(payment))
+
+    transaction_timeline.short_description = _('transactions')  # type: ignore
+
+
+@admin.register(StripeConnectRoute)
+class StripeConnectRouteAdmin(admin.ModelAdmin):
+    list_display = ['seller', 'destination', 'percent']
+    search_fields = ['seller', 'destination']
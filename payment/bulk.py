@@ -0,0 +1,190 @@
+"""
+Capture, void or refund many payments at once, from the admin.
+
+The gateway calls run in the background on a bounded pool of threads (see PAYMENT_BULK_MAX_WORKERS),
+so the admin request returns immediately. The progress and the result of each payment are kept in the
+Django cache (see PAYMENT_BULK_CACHE), the cache must be shared by all the web workers for the progress page
+to work in a multi-process deployment.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.dispatch import receiver
+
+from . import PaymentError
+from .models import Payment
+from .utils import gateway_capture, gateway_refund, gateway_void
+
+logger = logging.getLogger(__name__)
+
+CAPTURE = 'capture'
+VOID = 'void'
+REFUND = 'refund'
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+DEFAULT_MAX_WORKERS = 8
+JOB_TIMEOUT = 24 * 60 * 60
+JOB_STALE_AFTER = 15 * 60  # Longer than the gateway calls of a payment with all their retries
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = getattr(settings, 'PAYMENT_BULK_MAX_WORKERS', DEFAULT_MAX_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='payment-bulk')
+        return _executor
+
+
+@receiver(setting_changed)
+def _reset_executor(setting, **kwargs):
+    global _executor
+    if setting == 'PAYMENT_BULK_MAX_WORKERS':
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _get_cache():
+    return caches[getattr(settings, 'PAYMENT_BULK_CACHE', 'default')]
+
+
+def _cache_key(job_id: str) -> str:
+    return 'payment-bulk-job:{}'.format(job_id)
+
+
+def _capture(payment):
+    if not payment.can_capture():
+        return None
+    return gateway_capture(payment=payment, amount=payment.get_charge_amount())
+
+
+def _void(payment):
+    if not payment.can_void():
+        return None
+    return gateway_void(payment=payment)
+
+
+def _refund(payment):
+    if not payment.can_refund():
+        return None
+    return gateway_refund(payment=payment, amount=payment.captured_amount)
+
+
+OPERATIONS = {
+    CAPTURE: _capture,
+    VOID: _void,
+    REFUND: _refund,
+}
+
+
+class BulkJob:
+    """
+    The state of a job, written to the cache after each payment.
+
+    Only the counts of the results are kept, and the payments that failed or were skipped with their
+    status and message, so that writing the state does not grow with the number of successful payments.
+    """
+
+    def __init__(self, operation: str, payment_ids: Iterable[int], user_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.payment_ids = list(payment_ids)
+        self.user_id = user_id
+        self.counts = {SUCCEEDED: 0, FAILED: 0, SKIPPED: 0}
+        self.unsuccessful = []
+        self._lock = threading.Lock()
+
+    def as_dict(self):
+        processed = sum(self.counts.values())
+        return {
+            'id': self.id,
+            'operation': self.operation,
+            'user_id': self.user_id,
+            'total': len(self.payment_ids),
+            'processed': processed,
+            'finished': processed == len(self.payment_ids),
+            'counts': dict(self.counts),
+            'unsuccessful': list(self.unsuccessful),
+            'updated': time.time(),
+        }
+
+    def save(self):
+        _get_cache().set(_cache_key(self.id), self.as_dict(), JOB_TIMEOUT)
+
+    def add_result(self, payment_id: int, status: str, message: str = ''):
+        with self._lock:
+            self.counts[status] += 1
+            if status != SUCCEEDED:
+                self.unsuccessful.append({'payment_id': payment_id, 'status': status, 'message': message})
+            self.save()
+
+
+def _process(job: BulkJob, payment_id: int):
+    try:
+        error = None
+        # The payment is locked from its checks to its postprocessing, so that two jobs (or a job and the admin
+        # forms) selecting the same payment do not both capture or refund it.
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=payment_id)
+            try:
+                payment_transaction = OPERATIONS[job.operation](payment)
+            except PaymentError as e:
+                error = e  # Caught in the atomic block, to keep the failed transaction
+        if error is not None:
+            job.add_result(payment_id, FAILED, error.message)
+        elif payment_transaction is None:
+            job.add_result(payment_id, SKIPPED, 'Cannot {} this payment.'.format(job.operation))
+        else:
+            job.add_result(payment_id, SUCCEEDED)
+    except Exception as e:
+        logger.exception('Bulk %s of payment %s failed', job.operation, payment_id)
+        job.add_result(payment_id, FAILED, str(e))
+    finally:
+        # Each thread has its own connections, they would otherwise stay open until the thread exits.
+        connections.close_all()
+
+
+def start_bulk_operation(operation: str, payment_ids: Iterable[int], user_id: Optional[int] = None) -> str:
+    """
+    Start capturing, voiding or refunding the payments in the background.
+
+    :param user_id: The user who started the job, the only one who can follow it in the admin.
+    :return: The id of the job, to follow its progress with get_bulk_job.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError('Unknown bulk operation {}'.format(operation))
+    job = BulkJob(operation, payment_ids, user_id)
+    job.save()
+    executor = _get_executor()
+    for payment_id in job.payment_ids:
+        executor.submit(_process, job, payment_id)
+    return job.id
+
+
+def get_bulk_job(job_id: str) -> Optional[dict]:
+    """
+    The state of the job, or None if it is unknown or expired.
+
+    A job that is not finished but made no progress for JOB_STALE_AFTER seconds is marked as stale: its process
+    was most likely stopped (by a deployment or a restart), the remaining payments will not be processed.
+    """
+    job = _get_cache().get(_cache_key(job_id))
+    if job is not None:
+        job['stale'] = not job['finished'] and time.time() - job['updated'] > JOB_STALE_AFTER
+    return job
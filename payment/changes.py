@@ -0,0 +1,83 @@
+"""
+An incremental change feed of the payments, so that downstream syncs cost in proportion to the changes.
+
+The payments are read in (modified, id) order, starting after a watermark: the (modified, id) of the last
+payment that the consumer has seen. The operations of payment.utils update the modified time of their payment
+(see _gateway_postprocess), so the feed also brings the new transactions of the payments. The transactions that
+are created otherwise (the failed attempts, bulk_create) come with the next change of their payment.
+
+The rows that are being written while the feed is read can commit with a modified time that is older than
+the latest rows: to not skip them, the feed only returns the payments that were modified at least
+PAYMENT_CHANGE_FEED_SETTLE_SECONDS ago (60 by default). The feed delivers each change at least once.
+
+Each consumer can persist its watermark in the database:
+
+    page = read_changes('warehouse')
+    ... process page.payments ...
+    acknowledge_changes('warehouse', page.watermark)
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from .models import ChangeFeedConsumer, Payment, Transaction
+
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_SETTLE_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class Watermark:
+    modified: Optional[datetime] = None  # None is the beginning of the feed
+    id: int = 0
+
+
+@dataclass
+class ChangePage:
+    payments: List[Payment]  # Their transactions created since the watermark are in new_transactions
+    watermark: Watermark  # The position after the last payment of the page
+    has_more: bool
+
+
+def get_changes(watermark: Watermark, limit: int = DEFAULT_PAGE_SIZE) -> ChangePage:
+    """ The payments changed after the watermark, with their new transactions. """
+    settle_seconds = getattr(settings, 'PAYMENT_CHANGE_FEED_SETTLE_SECONDS', DEFAULT_SETTLE_SECONDS)
+    payments = Payment.objects.filter(modified__lte=timezone.now() - timedelta(seconds=settle_seconds))
+    transactions = Transaction.objects.defer('gateway_response').order_by('created', 'pk')
+    if watermark.modified is not None:
+        payments = payments.filter(Q(modified__gt=watermark.modified) | Q(modified=watermark.modified,
+                                                                          id__gt=watermark.id))
+        transactions = transactions.filter(created__gte=watermark.modified)
+
+    payments = list(payments
+                    .order_by('modified', 'id')
+                    .prefetch_related(Prefetch('transactions', queryset=transactions, to_attr='new_transactions'))
+                    [:limit + 1])
+    has_more = len(payments) > limit
+    payments = payments[:limit]
+    if payments:
+        watermark = Watermark(modified=payments[-1].modified, id=payments[-1].id)
+    return ChangePage(payments=payments, watermark=watermark, has_more=has_more)
+
+
+def get_watermark(consumer: str) -> Watermark:
+    row = ChangeFeedConsumer.objects.filter(name=consumer).first()
+    if row is None:
+        return Watermark()
+    return Watermark(modified=row.watermark_modified, id=row.watermark_id)
+
+
+def read_changes(consumer: str, limit: int = DEFAULT_PAGE_SIZE) -> ChangePage:
+    """ The changes after the persisted watermark of the consumer. """
+    return get_changes(get_watermark(consumer), limit)
+
+
+def acknowledge_changes(consumer: str, watermark: Watermark) -> None:
+    """ Persist the watermark of the consumer, once it has processed the changes up to it. """
+    ChangeFeedConsumer.objects.update_or_create(
+        name=consumer,
+        defaults={'watermark_modified': watermark.modified, 'watermark_id': watermark.id})
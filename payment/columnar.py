@@ -0,0 +1,187 @@
+"""
+Columnar exports of the payments and transactions for analytics, in Parquet or Arrow IPC files.
+
+Unlike the CSV exports the columns are typed: amounts are decimals, created and modified are timestamps
+(in UTC when USE_TZ is on), and the columns with few distinct values (gateway, charge status, kind, currencies)
+are dictionary encoded.
+
+The rows are read from the database in chunks and written one row group at a time, so the memory use
+depends on the row group size and not on the number of exported rows.
+
+This needs pyarrow.
+"""
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+from django.conf import settings
+
+from .export import DEFAULT_CHUNK_SIZE, export_rows
+from .models import Payment, Transaction
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = pq = None
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+COLUMNAR_FORMATS = [PARQUET, ARROW]
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+
+# The kinds of columns
+INTEGER = 'integer'
+BOOLEAN = 'boolean'
+STRING = 'string'
+CATEGORY = 'category'  # A string with few distinct values
+TIMESTAMP = 'timestamp'
+DECIMAL = 'decimal'
+
+# The name of each column, the database column it is read from, and its kind.
+# The decimal columns are read from a field of the same name, to get its precision.
+PAYMENT_COLUMNAR_FIELDS: Sequence[Tuple[str, str, str]] = [
+    ('id', 'id', INTEGER),
+    ('created', 'created', TIMESTAMP),
+    ('modified', 'modified', TIMESTAMP),
+    ('active', 'is_active', BOOLEAN),
+    ('gateway', 'gateway', CATEGORY),
+    ('charge_status', 'charge_status', CATEGORY),
+    ('customer_email', 'customer_email', STRING),
+    ('total_amount', 'total', DECIMAL),
+    ('total_currency', 'total_currency', CATEGORY),
+    ('captured_amount', 'captured_amount', DECIMAL),
+    ('captured_currency', 'captured_amount_currency', CATEGORY),
+    ('token', 'token', STRING),
+    ('extra_data', 'extra_data', STRING),
+]
+
+TRANSACTION_COLUMNAR_FIELDS: Sequence[Tuple[str, str, str]] = [
+    ('id', 'id', INTEGER),
+    ('created', 'created', TIMESTAMP),
+    ('payment_id', 'payment_id', INTEGER),
+    ('kind', 'kind', CATEGORY),
+    ('is_success', 'is_success', BOOLEAN),
+    ('amount', 'amount', DECIMAL),
+    ('currency', 'amount_currency', CATEGORY),
+    ('token', 'token', STRING),
+    ('error', 'error', STRING),
+    ('payment_gateway', 'payment__gateway', CATEGORY),
+]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('The columnar exports need pyarrow, install it with: pip install pyarrow')
+
+
+def _arrow_type(model, column: str, kind: str):
+    if kind == INTEGER:
+        return pa.int64()
+    elif kind == BOOLEAN:
+        return pa.bool_()
+    elif kind == STRING:
+        return pa.string()
+    elif kind == CATEGORY:
+        return pa.dictionary(pa.int32(), pa.string())
+    elif kind == TIMESTAMP:
+        return pa.timestamp('us', tz='UTC' if settings.USE_TZ else None)
+    elif kind == DECIMAL:
+        field = model._meta.get_field(column)
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    raise ValueError('Unknown column kind {}'.format(kind))
+
+
+def arrow_schema(model, fields: Sequence[Tuple[str, str, str]]):
+    _require_pyarrow()
+    return pa.schema([pa.field(name, _arrow_type(model, column, kind)) for name, column, kind in fields])
+
+
+def _batches(rows: Iterable[tuple], size: int) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Dictionary:
+    """
+    The distinct values of a categorical column, in order of appearance.
+    The dictionary only grows from one batch to the next, so Arrow IPC files can store it as deltas.
+    """
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.indices: Dict[str, int] = {}
+
+    def encode(self, values):
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = self.indices.get(value)
+            if index is None:
+                index = self.indices[value] = len(self.values)
+                self.values.append(value)
+            indices.append(index)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()), pa.array(self.values, pa.string()))
+
+
+def _table(batch: List[tuple], schema, dictionaries: Dict[str, _Dictionary]):
+    columns = []
+    for values, field in zip(zip(*batch), schema):
+        if pa.types.is_dictionary(field.type):
+            columns.append(dictionaries.setdefault(field.name, _Dictionary()).encode(values))
+        else:
+            columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def write_columnar(destination: Union[str, BinaryIO], queryset, fields: Sequence[Tuple[str, str, str]],
+                   file_format: str = PARQUET, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Write the rows of the queryset to a Parquet or Arrow IPC file.
+
+    :param destination: A path or a binary file.
+    :param fields: PAYMENT_COLUMNAR_FIELDS or TRANSACTION_COLUMNAR_FIELDS, or a subset of them.
+    :param row_group_size: The number of rows per Parquet row group (or Arrow record batch).
+    :return: The number of written rows.
+    """
+    schema = arrow_schema(queryset.model, fields)
+    rows = export_rows(queryset, [(name, column) for name, column, _kind in fields], chunk_size)
+
+    if file_format == PARQUET:
+        writer = pq.ParquetWriter(destination, schema)
+    elif file_format == ARROW:
+        writer = pa.ipc.new_file(destination, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    else:
+        raise ValueError('Unknown columnar format {}'.format(file_format))
+
+    count = 0
+    dictionaries: Dict[str, _Dictionary] = {}
+    with writer:
+        for batch in _batches(rows, row_group_size):
+            table = _table(batch, schema, dictionaries)
+            if file_format == PARQUET:
+                writer.write_table(table, row_group_size=row_group_size)
+            else:
+                writer.write_table(table, max_chunksize=row_group_size)
+            count += len(batch)
+    return count
+
+
+def write_payments(destination: Union[str, BinaryIO], queryset=None, **kwargs) -> int:
+    """ See write_columnar. """
+    queryset = Payment.objects.order_by('pk') if queryset is None else queryset
+    return write_columnar(destination, queryset, PAYMENT_COLUMNAR_FIELDS, **kwargs)
+
+
+def write_transactions(destination: Union[str, BinaryIO], queryset=None, **kwargs) -> int:
+    """ See write_columnar. """
+    queryset = Transaction.objects.order_by('pk') if queryset is None else queryset
+    return write_columnar(destination, queryset, TRANSACTION_COLUMNAR_FIELDS, **kwargs)
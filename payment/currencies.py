@@ -0,0 +1,124 @@
+"""
+Currency exponents, and conversions between decimal amounts and minor units.
+
+The exponent of a currency is the number of digits after the decimal separator, for instance
+2 for CHF (1 franc is 100 centimes) and 0 for JPY.
+
+Besides the scalar conversions, batch conversions are provided for reconciliation and reporting jobs
+that convert large numbers of amounts. They are backed by numpy when it is installed.
+"""
+from decimal import Decimal
+from typing import Dict, List, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+DEFAULT_EXPONENT = 2
+
+# The minor units of the ISO 4217 currencies.
+# Funds and precious metals without minor units (XAU, XDR, ...) are not listed.
+CURRENCY_EXPONENTS: Dict[str, int] = {
+    'AED': 2, 'AFN': 2, 'ALL': 2, 'AMD': 2, 'ANG': 2, 'AOA': 2, 'ARS': 2, 'AUD': 2, 'AWG': 2, 'AZN': 2, 'BAM': 2,
+    'BBD': 2, 'BDT': 2, 'BGN': 2, 'BHD': 3, 'BIF': 0, 'BMD': 2, 'BND': 2, 'BOB': 2, 'BOV': 2, 'BRL': 2, 'BSD': 2,
+    'BTN': 2, 'BWP': 2, 'BYN': 2, 'BZD': 2, 'CAD': 2, 'CDF': 2, 'CHE': 2, 'CHF': 2, 'CHW': 2, 'CLF': 4, 'CLP': 0,
+    'CNY': 2, 'COP': 2, 'COU': 2, 'CRC': 2, 'CUC': 2, 'CUP': 2, 'CVE': 2, 'CZK': 2, 'DJF': 0, 'DKK': 2, 'DOP': 2,
+    'DZD': 2, 'EGP': 2, 'ERN': 2, 'ETB': 2, 'EUR': 2, 'FJD': 2, 'FKP': 2, 'GBP': 2, 'GEL': 2, 'GHS': 2, 'GIP': 2,
+    'GMD': 2, 'GNF': 0, 'GTQ': 2, 'GYD': 2, 'HKD': 2, 'HNL': 2, 'HTG': 2, 'HUF': 2, 'IDR': 2, 'ILS': 2, 'INR': 2,
+    'IQD': 3, 'IRR': 2, 'ISK': 0, 'JMD': 2, 'JOD': 3, 'JPY': 0, 'KES': 2, 'KGS': 2, 'KHR': 2, 'KMF': 0, 'KPW': 2,
+    'KRW': 0, 'KWD': 3, 'KYD': 2, 'KZT': 2, 'LAK': 2, 'LBP': 2, 'LKR': 2, 'LRD': 2, 'LSL': 2, 'LYD': 3, 'MAD': 2,
+    'MDL': 2, 'MGA': 2, 'MKD': 2, 'MMK': 2, 'MNT': 2, 'MOP': 2, 'MRU': 2, 'MUR': 2, 'MVR': 2, 'MWK': 2, 'MXN': 2,
+    'MXV': 2, 'MYR': 2, 'MZN': 2, 'NAD': 2, 'NGN': 2, 'NIO': 2, 'NOK': 2, 'NPR': 2, 'NZD': 2, 'OMR': 3, 'PAB': 2,
+    'PEN': 2, 'PGK': 2, 'PHP': 2, 'PKR': 2, 'PLN': 2, 'PYG': 0, 'QAR': 2, 'RON': 2, 'RSD': 2, 'RUB': 2, 'RWF': 0,
+    'SAR': 2, 'SBD': 2, 'SCR': 2, 'SDG': 2, 'SEK': 2, 'SGD': 2, 'SHP': 2, 'SLE': 2, 'SLL': 2, 'SOS': 2, 'SRD': 2,
+    'SSP': 2, 'STN': 2, 'SVC': 2, 'SYP': 2, 'SZL': 2, 'THB': 2, 'TJS': 2, 'TMT': 2, 'TND': 3, 'TOP': 2, 'TRY': 2,
+    'TTD': 2, 'TWD': 2, 'TZS': 2, 'UAH': 2, 'UGX': 0, 'USD': 2, 'USN': 2, 'UYI': 0, 'UYU': 2, 'UYW': 4, 'UZS': 2,
+    'VED': 2, 'VES': 2, 'VND': 0, 'VUV': 0, 'WST': 2, 'XAF': 0, 'XCD': 2, 'XOF': 0, 'XPF': 0, 'YER': 2, 'ZAR': 2,
+    'ZMW': 2, 'ZWL': 2,
+}
+
+
+def get_exponent(currency: str, exponents: Dict[str, int] = CURRENCY_EXPONENTS) -> int:
+    """ Return the number of decimal digits of the currency. """
+    exponent = exponents.get(currency)
+    if exponent is None:
+        exponent = exponents.get(currency.upper(), DEFAULT_EXPONENT)
+    return exponent
+
+
+def to_minor_units(amount: Decimal, currency: str, exponents: Dict[str, int] = CURRENCY_EXPONENTS) -> int:
+    """ Return the amount expressed in the smallest unit of the currency, rounding half to even. """
+    # Using int(amount * 100) directly may yield a wrong result,
+    # for instance int(Decimal(24.24) * 100) is 2423
+    return int(Decimal(amount).scaleb(get_exponent(currency, exponents)).to_integral_value())
+
+
+def from_minor_units(amount: int, currency: str, exponents: Dict[str, int] = CURRENCY_EXPONENTS) -> Decimal:
+    """ Return the decimal representation of an amount expressed in the smallest unit of the currency. """
+    return Decimal(amount).scaleb(-get_exponent(currency, exponents))
+
+
+##############################################################
+# Batch conversions
+
+Currencies = Union[str, Sequence[str]]
+
+
+def to_minor_units_batch(amounts: Sequence, currencies: Currencies,
+                         exponents: Dict[str, int] = CURRENCY_EXPONENTS):
+    """
+    Convert many amounts to minor units.
+
+    With numpy the conversion goes through float64, which is exact for amounts that have no more decimal places
+    than their currency and whose absolute value is below 10**15 minor units.
+
+    :param amounts: Decimals, ints, strings or floats (or a numpy array).
+    :param currencies: One currency for all the amounts, or one currency per amount.
+    :return: A numpy int64 array when numpy is installed, a list of ints otherwise.
+    """
+    if np is None:
+        if isinstance(currencies, str):
+            exponent = get_exponent(currencies, exponents)
+            return [int(Decimal(a).scaleb(exponent).to_integral_value()) for a in amounts]
+        return [to_minor_units(a, c, exponents) for a, c in zip(amounts, _checked(currencies, amounts))]
+
+    values = np.asarray(amounts, dtype=np.float64)
+    return np.rint(values * _scales(currencies, len(values), exponents)).astype(np.int64)
+
+
+def from_minor_units_batch(amounts: Sequence[int], currencies: Currencies,
+                           exponents: Dict[str, int] = CURRENCY_EXPONENTS) -> List[Decimal]:
+    """
+    Convert many amounts expressed in minor units to decimals.
+
+    :param amounts: ints (or a numpy integer array).
+    :param currencies: One currency for all the amounts, or one currency per amount.
+    """
+    if isinstance(currencies, str):
+        exponent = -get_exponent(currencies, exponents)
+        return [Decimal(int(a)).scaleb(exponent) for a in amounts]
+    return [Decimal(int(a)).scaleb(-int(e)) for a, e in zip(amounts, _exponents(currencies, amounts, exponents))]
+
+
+def _checked(currencies: Sequence[str], amounts: Sequence) -> Sequence[str]:
+    if len(currencies) != len(amounts):
+        raise ValueError('Expected {} currencies, got {}'.format(len(amounts), len(currencies)))
+    return currencies
+
+
+def _exponents(currencies: Sequence[str], amounts: Sequence, exponents: Dict[str, int]):
+    _checked(currencies, amounts)
+    if np is None:
+        return [get_exponent(c, exponents) for c in currencies]
+    # Look up each distinct currency once
+    distinct, inverse = np.unique(np.asarray(currencies), return_inverse=True)
+    return np.array([get_exponent(c, exponents) for c in distinct], dtype=np.int64)[inverse]
+
+
+def _scales(currencies: Currencies, count: int, exponents: Dict[str, int]):
+    if isinstance(currencies, str):
+        return 10.0 ** get_exponent(currencies, exponents)
+    if len(currencies) != count:
+        raise ValueError('Expected {} currencies, got {}'.format(count, len(currencies)))
+    return 10.0 ** _exponents(currencies, currencies, exponents)
@@ -1,7 +1,13 @@
+import csv
+from typing import Iterable, Iterator, Sequence, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
 from import_export import resources
 from import_export.fields import Field
 
-from .models import Payment
+from .models import Payment, Transaction
 
 
 class PaymentResource(resources.ModelResource):
@@ -31,3 +37,167 @@ class PaymentResource(resources.ModelResource):
 
     def dehydrate_captured_currency(self, payment):
         return payment.captured_amount.currency.code
+
+
+class TransactionResource(resources.ModelResource):
+    """
+    The transactions, with the fields of their payment that finance needs.
+    The gateway response is a huge field, it is only exported when asked for.
+    """
+    payment_id = Field('payment_id')
+
+    amount = Field()
+    currency = Field()
+
+    payment_gateway = Field('payment__gateway')
+    customer_email = Field('payment__customer_email')
+    payment_total_amount = Field()
+    payment_total_currency = Field()
+
+    class Meta:
+        model = Transaction
+        fields = ['created', 'kind', 'is_success', 'token', 'error', 'gateway_response']
+        export_order = ['created', 'payment_id', 'kind', 'is_success', 'amount', 'currency', 'token', 'error',
+                        'payment_gateway', 'customer_email', 'payment_total_amount', 'payment_total_currency',
+                        'gateway_response']
+
+    def __init__(self, include_gateway_response=False):
+        super().__init__()
+        self.include_gateway_response = include_gateway_response
+
+    def get_export_fields(self):
+        fields = super().get_export_fields()
+        if not self.include_gateway_response:
+            fields = [field for field in fields if field.column_name != 'gateway_response']
+        return fields
+
+    def export(self, queryset=None, *args, **kwargs):
+        if queryset is None:
+            queryset = self.get_queryset()
+        if isinstance(queryset, QuerySet):
+            # One query for the transactions and their payments.
+            queryset = queryset.select_related('payment')
+            if not self.include_gateway_response:
+                queryset = queryset.defer('gateway_response')
+        return super().export(queryset, *args, **kwargs)
+
+    def dehydrate_amount(self, transaction):
+        return transaction.amount.amount
+
+    def dehydrate_currency(self, transaction):
+        return transaction.amount.currency.code
+
+    def dehydrate_payment_total_amount(self, transaction):
+        return transaction.payment.total.amount
+
+    def dehydrate_payment_total_currency(self, transaction):
+        return transaction.payment.total.currency.code
+
+
+##############################################################
+# Streaming export
+#
+# The rows are read from the database in chunks and written to the response as they come,
+# so the memory use does not depend on the number of exported rows.
+# The amounts and currencies are read straight from their columns, no model instance is built.
+
+# The same columns as the PaymentResource, and the database column each one is read from.
+PAYMENT_EXPORT_FIELDS: Sequence[Tuple[str, str]] = [
+    ('created', 'created'),
+    ('active', 'is_active'),
+    ('customer_email', 'customer_email'),
+    ('total_amount', 'total'),
+    ('total_currency', 'total_currency'),
+    ('captured_amount', 'captured_amount'),
+    ('captured_currency', 'captured_amount_currency'),
+    ('charge_status', 'charge_status'),
+    ('gateway', 'gateway'),
+    ('extra_data', 'extra_data'),
+]
+
+# The same columns as the TransactionResource, the payment columns are joined in the same query.
+TRANSACTION_EXPORT_FIELDS: Sequence[Tuple[str, str]] = [
+    ('created', 'created'),
+    ('payment_id', 'payment_id'),
+    ('kind', 'kind'),
+    ('is_success', 'is_success'),
+    ('amount', 'amount'),
+    ('currency', 'amount_currency'),
+    ('token', 'token'),
+    ('error', 'error'),
+    ('payment_gateway', 'payment__gateway'),
+    ('customer_email', 'payment__customer_email'),
+    ('payment_total_amount', 'payment__total'),
+    ('payment_total_currency', 'payment__total_currency'),
+]
+
+GATEWAY_RESPONSE_EXPORT_FIELD = ('gateway_response', 'gateway_response')
+
+
+def transaction_export_fields(include_gateway_response: bool = False) -> Sequence[Tuple[str, str]]:
+    if include_gateway_response:
+        return [*TRANSACTION_EXPORT_FIELDS, GATEWAY_RESPONSE_EXPORT_FIELD]
+    return TRANSACTION_EXPORT_FIELDS
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# Writing each row separately to the response is slow, rows are sent in batches.
+ROWS_PER_WRITE = 500
+
+STREAMING_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def export_rows(queryset, fields: Sequence[Tuple[str, str]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[tuple]:
+    """ The values of the fields for each row of the queryset, fetched chunk by chunk. """
+    return queryset.values_list(*[column for _name, column in fields]).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """ A file-like object for the csv writer, that returns what is written to it. """
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines: Iterable[str]) -> Iterator[str]:
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == ROWS_PER_WRITE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(names: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(names)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+
+def stream_jsonl(names: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    encoder = DjangoJSONEncoder()
+    yield from _batched(encoder.encode(dict(zip(names, row))) + '\n' for row in rows)
+
+
+def export_lines(fields: Sequence[Tuple[str, str]], rows: Iterable[tuple], file_format: str) -> Iterator[str]:
+    """ :param file_format: One of the STREAMING_FORMATS. """
+    names = [name for name, _column in fields]
+    return stream_csv(names, rows) if file_format == 'csv' else stream_jsonl(names, rows)
+
+
+def streaming_export_response(fields: Sequence[Tuple[str, str]], rows: Iterable[tuple], file_format: str,
+                              filename: str) -> StreamingHttpResponse:
+    """
+    :param file_format: One of the STREAMING_FORMATS.
+    :param filename: Without extension.
+    """
+    response = StreamingHttpResponse(export_lines(fields, rows, file_format),
+                                     content_type=STREAMING_FORMATS[file_format])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, file_format)
+    return response
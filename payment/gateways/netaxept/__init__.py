@@ -36,9 +36,11 @@ def authorize(payment_information: PaymentData,
         query_response = netaxept_protocol.query(config=netaxept_config, transaction_id=payment_information.token)
         transaction_authorized = query_response.authorized
         error = None
+        raw_response = query_response.raw_response
     except NetaxeptProtocolError as exception:
         transaction_authorized = False
         error = exception.error
+        raw_response = exception.raw_response
 
     return GatewayResponse(
         is_success=transaction_authorized,
@@ -47,11 +49,17 @@ def authorize(payment_information: PaymentData,
         currency=payment_information.currency,
         transaction_id=payment_information.token,
         error=error,
-        raw_response=query_response.raw_response)
+        raw_response=raw_response)
 
 
 def process_payment(payment_information: PaymentData, config: GatewayConfig) -> GatewayResponse:
-    raise NotImplementedError()
+    """
+    Authorizes and captures the payment with a single SALE, instead of an authorization and then a capture.
+
+    The payment must have been registered without auto-authorization (see actions.register_payment), and the user
+    must have been through the netaxept terminal.
+    """
+    return _op(payment_information, config, NetaxeptOperation.SALE, TransactionKind.CAPTURE)
 
 
 def capture(payment_information: PaymentData, config: GatewayConfig) -> GatewayResponse:
@@ -78,7 +86,8 @@ def _op(payment_information: PaymentData, config: GatewayConfig,
             config=gateway_to_netaxept_config(config),
             transaction_id=payment_information.token,
             operation=netaxept_operation,
-            amount=payment_information.amount)
+            amount=payment_information.amount,
+            currency=payment_information.currency)
         # We don't need to introspect anything inside the process_result: If no exception was thrown we immediately
         # know process ran successfully
         return GatewayResponse(
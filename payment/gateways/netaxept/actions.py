@@ -18,7 +18,7 @@ class PaymentAlreadyRegisteredAndAuthorized(NetaxeptException):
         return 'Payment already registered and authorized'
 
 
-def register_payment(payment: Payment) -> str:
+def register_payment(payment: Payment, auto_auth: bool = True) -> str:
     """
     This part of the process is unique to netaxept so it cannot be implemented inside the
     payment generic SPI. This implies that a programmer who wants to use the netaxept gateway will have to know
@@ -32,13 +32,15 @@ def register_payment(payment: Payment) -> str:
     - Create a Transaction object representing the registration for auditing purposes.
 
     :param payment: A payment to register
+    :param auto_auth: Whether the terminal authorizes the payment. Turn off for a payment that will be authorized and
+       captured at once with gateway_process_payment, after the terminal.
     :return: The the newly created netaxept transaction id
     :raises NetaxeptException: If the payment was already registered or the registration fails
     """
     logger.info('netaxept-actions-register', payment_id=payment.id)
 
     if payment.token != '':  # The payment was already registered.
-        if payment.is_authorized:
+        if payment.is_authorized or not payment.not_charged:  # A SALE charges without an authorization
             raise PaymentAlreadyRegisteredAndAuthorized()
         else:
             # If payment was registered but not yet authorized we re-register it so that a later authorize can succeeed:
@@ -54,7 +56,8 @@ def register_payment(payment: Payment) -> str:
             order_number=payment.id,
             amount=payment.total,
             language='en',
-            customer_email=payment.customer_email)
+            customer_email=payment.customer_email,
+            auto_auth=auto_auth)
     except NetaxeptProtocolError as exception:
         Transaction.objects.create(
             payment=payment,
@@ -77,6 +80,7 @@ def register_payment(payment: Payment) -> str:
             is_success=True,
             amount=payment.total,
             error=None,
-            gateway_response=register_response.raw_response)
+            gateway_response=register_response.raw_response,
+            auto_auth=auto_auth)
 
     return register_response.transaction_id
@@ -0,0 +1,126 @@
+"""
+Asynchronous communications with netaxept, for the jobs and views that send many calls at the same time.
+
+The calls are the same as in netaxept_protocol (with the same responses and errors), but they are made on an
+AsyncNetaxeptClient: an aiohttp session whose pool of keep-alive connections is shared by all the calls of the client,
+at most pool_size at a time. As with the blocking calls, only the connection errors are retried.
+
+    async with AsyncNetaxeptClient(config) as client:
+        responses = await asyncio.gather(*[client.query(transaction_id) for transaction_id in transaction_ids])
+
+aiohttp is needed: pip install aiohttp
+"""
+import asyncio
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Dict, Optional, Union
+from urllib.parse import urljoin
+
+from moneyed import Money
+from structlog import get_logger
+
+from .netaxept_protocol import NetaxeptConfig, NetaxeptOperation, ProcessResponse, QueryResponse, RegisterResponse, \
+    _build_raw_response, _process_params, _process_response, _query_params, _query_response, _register_params, \
+    _register_response
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+logger = get_logger()
+
+RETRY_BACKOFF = 0.1  # In seconds, doubled at each retry
+
+
+@dataclass
+class _Response:
+    """ The attributes of a requests.Response that are used to read the response. """
+    status_code: int
+    url: str
+    encoding: Optional[str]
+    reason: Optional[str]
+    text: str
+
+
+def _form(params: Dict[str, Any]) -> Dict[str, str]:
+    """ The form as requests encodes it: without the None values. """
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+class AsyncNetaxeptClient:
+    """ The netaxept calls of a config. Use it as an async context manager, to close its connections. """
+
+    def __init__(self, config: NetaxeptConfig) -> None:
+        if aiohttp is None:  # pragma: no cover
+            raise ImportError('The async netaxept client needs aiohttp, install it with: pip install aiohttp')
+        self.config = config
+        self._session: Optional['aiohttp.ClientSession'] = None  # Created in the event loop, by the first call
+
+    async def __aenter__(self) -> 'AsyncNetaxeptClient':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.config.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.config.connect_timeout,
+                                              sock_read=self.config.read_timeout))
+        return self._session
+
+    async def register(self, amount: Money, order_number: Union[str, int], language: Optional[str] = None,
+                       description: Optional[str] = None, customer_email: Optional[str] = None,
+                       auto_auth: bool = True) -> RegisterResponse:
+        """ See netaxept_protocol.register """
+        logger.info('netaxept-register', amount=amount, order_number=order_number, language=language,
+                    description=description, customer_email=customer_email, auto_auth=auto_auth)
+        params = _register_params(self.config, amount, order_number, language, description, customer_email,
+                                  auto_auth)
+        response = await self._post('Netaxept/Register.aspx', params)
+        raw_response = _build_raw_response(response)
+        logger.info('netaxept-register', amount=amount, order_number=order_number, language=language,
+                    description=description, raw_response=raw_response)
+        return _register_response(response, raw_response)
+
+    async def process(self, transaction_id: str, operation: NetaxeptOperation, amount: Decimal,
+                      currency: str) -> ProcessResponse:
+        """ See netaxept_protocol.process """
+        logger.info('netaxept-process', transaction_id=transaction_id, operation=operation.value, amount=amount)
+        params = _process_params(self.config, transaction_id, operation, amount, currency)
+        response = await self._post('Netaxept/Process.aspx', params)
+        raw_response = _build_raw_response(response)
+        logger.info('netaxept-process-response', transaction_id=transaction_id, operation=operation.value,
+                    amount=amount, raw_response=raw_response)
+        return _process_response(response, raw_response)
+
+    async def query(self, transaction_id: str) -> QueryResponse:
+        """ See netaxept_protocol.query """
+        logger.info('netaxept-query', transaction_id=transaction_id)
+        params = _query_params(self.config, transaction_id)
+        response = await self._post('Netaxept/Query.aspx', params)
+        raw_response = _build_raw_response(response)
+        logger.info('netaxept-query-response', transaction_id=transaction_id, raw_response=raw_response)
+        return _query_response(response, raw_response)
+
+    async def _post(self, path: str, params: Dict[str, Any]) -> _Response:
+        url, data = urljoin(self.config.base_url, path), _form(params)
+        attempt = 0
+        while True:
+            try:
+                async with self._get_session().post(url, data=data) as response:
+                    return _Response(status_code=response.status, url=str(response.url),
+                                     encoding=response.charset, reason=response.reason,
+                                     text=await response.text())
+            except aiohttp.ClientConnectorError:  # The request was not sent
+                if attempt == self.config.max_retries:
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+                attempt += 1
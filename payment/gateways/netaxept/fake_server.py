@@ -0,0 +1,218 @@
+"""
+A local HTTP server that answers like the Netaxept API, for the tests, the load tests and the benchmarks.
+
+It implements Register, Process (AUTH, SALE, CAPTURE, CREDIT and ANNUL) and Query on transactions that it keeps
+in memory, and a terminal page that pays the transaction at once and redirects to the after_terminal_url.
+Point the base_url of the netaxept config at it.
+
+In-process:
+
+    server = FakeNetaxept(latency=0.05).start()
+    ...  # NetaxeptConfig(base_url=server.url, ...)
+    server.stop()
+
+Or as a standalone server: ./manage.py run_fake_netaxept --port 8001
+
+To look like the real service under load, each response can be delayed by latency seconds, and a share of the
+requests (error_rate, between 0 and 1) can be answered with an HTTP 500 error.
+
+The tests can have the requests and the client connections recorded (record=True), a long running server does not
+record them.
+"""
+import random
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+_NAMESPACES = 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema"'
+
+
+def _xml(root: str, body: str) -> str:
+    return '<?xml version="1.0" encoding="utf-8"?>\n<{root} {ns}>{body}</{root}>'.format(
+        root=root, ns=_NAMESPACES, body=body)
+
+
+def _exception(message: str) -> str:
+    return _xml('Exception', '<Error xsi:type="GenericError"><Message>{}</Message></Error>'.format(escape(message)))
+
+
+def _bool(value: bool) -> str:
+    return 'true' if value else 'false'
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ http.server.ThreadingHTTPServer, that needs python 3.7. """
+    daemon_threads = True
+
+
+class FakeNetaxept:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0, error_rate: float = 0,
+                 seed: Optional[int] = None, record: bool = False) -> None:
+        """
+        :param port: 0 for any free port.
+        :param latency: The seconds that each response is delayed.
+        :param error_rate: The share of the requests that get an HTTP 500 error.
+        :param seed: Of the random errors.
+        :param record: Whether to record the requests and the client connections, for the tests.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.record = record
+        self.transactions: Dict[str, dict] = {}
+        self.requests = []  # (path, params), when recorded
+        self.connections = set()  # The (host, port) of the clients, when recorded
+        self.lock = threading.Lock()
+        self.server = _ThreadingHTTPServer((host, port), _handler(self))
+        self.url = 'http://{}:{}/'.format(*self.server.server_address[:2])
+
+    def start(self) -> 'FakeNetaxept':
+        """ Serve from a background thread. """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def pay(self, transaction_id: str) -> None:
+        """ What the terminal does once the user has entered a card: it authorizes the payment with autoAuth. """
+        with self.lock:
+            transaction = self.transactions[transaction_id]
+            transaction['card'] = True
+            transaction['authorized'] = transaction['auto_auth']
+
+    def register(self, params) -> str:
+        transaction_id = uuid.uuid4().hex
+        with self.lock:
+            self.transactions[transaction_id] = {
+                'amount': int(params['amount']), 'currency': params['currencyCode'],
+                'order_number': params['orderNumber'], 'auto_auth': params.get('autoAuth') == 'True',
+                'redirect_url': params.get('redirectUrl'),
+                'card': False, 'authorized': False, 'annulled': False,
+                'captured': 0, 'credited': 0,
+            }
+        return _xml('RegisterResponse', '<TransactionId>{}</TransactionId>'.format(transaction_id))
+
+    def process(self, params) -> str:
+        transaction = self.transactions.get(params.get('transactionId'))
+        if transaction is None:
+            return _exception('Unable to find transaction')
+        operation, amount = params['operation'], int(params.get('transactionAmount') or 0)
+        with self.lock:
+            if operation in ('AUTH', 'SALE'):
+                if not transaction['card'] or transaction['authorized']:
+                    return _exception('Unable to {} the transaction'.format(operation.lower()))
+                transaction['authorized'] = True
+                if operation == 'SALE':
+                    transaction['captured'] = transaction['amount']
+            elif not transaction['authorized'] or transaction['annulled']:
+                return _exception('Transaction is not authorized')
+            elif operation == 'CAPTURE':
+                if transaction['captured'] + amount > transaction['amount']:
+                    return _exception('Unable to capture more than the authorized amount')
+                transaction['captured'] += amount
+            elif operation == 'CREDIT':
+                if transaction['credited'] + amount > transaction['captured']:
+                    return _exception('Unable to credit more than the captured amount')
+                transaction['credited'] += amount
+            elif operation == 'ANNUL':
+                if transaction['captured']:
+                    return _exception('Unable to annul a captured transaction')
+                transaction['annulled'] = True
+            else:
+                return _exception('Unknown operation {}'.format(operation))
+        return _xml('ProcessResponse', '<Operation>{}</Operation><ResponseCode>OK</ResponseCode>'
+                                       '<TransactionId>{}</TransactionId>'.format(operation, params['transactionId']))
+
+    def query(self, params) -> str:
+        transaction_id = params.get('transactionId')
+        transaction = self.transactions.get(transaction_id)
+        if transaction is None:
+            return _exception('Unable to find transaction')
+        authorization_id = '<AuthorizationId>123456</AuthorizationId>' if transaction['authorized'] else ''
+        return _xml('PaymentInfo', (
+            '<TransactionId>{id}</TransactionId>'
+            '<OrderInformation><Amount>{t[amount]}</Amount><Currency>{t[currency]}</Currency>'
+            '<OrderNumber>{t[order_number]}</OrderNumber></OrderInformation>'
+            '<Summary><AmountCaptured>{t[captured]}</AmountCaptured><AmountCredited>{t[credited]}</AmountCredited>'
+            '<Annulled>{annulled}</Annulled><Authorized>{authorized}</Authorized>{authorization_id}</Summary>'
+        ).format(id=transaction_id, t=transaction, annulled=_bool(transaction['annulled']),
+                 authorized=_bool(transaction['authorized']), authorization_id=authorization_id))
+
+    def terminal(self, params) -> Optional[str]:
+        """ Pays the transaction, and returns the url the user is redirected to. """
+        transaction = self.transactions.get(params.get('transactionId'))
+        if transaction is None or not transaction['redirect_url']:
+            return None
+        self.pay(params['transactionId'])
+        return '{}?{}'.format(transaction['redirect_url'],
+                              urlencode({'transactionId': params['transactionId'], 'responseCode': 'OK'}))
+
+    def handle(self, path, params) -> Optional[str]:
+        """ The XML response, or None for an HTTP error. """
+        with self.lock:
+            if self.record:
+                self.requests.append((path, params))
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return None
+        if path == '/Netaxept/Register.aspx':
+            return self.register(params)
+        if path == '/Netaxept/Process.aspx':
+            return self.process(params)
+        if path == '/Netaxept/Query.aspx':
+            return self.query(params)
+        return _exception('Unknown path {}'.format(path))
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _send(self, status: int, content: bytes = b'', headers: Optional[Dict[str, str]] = None) -> None:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/Terminal/default.aspx':
+                redirect_url = fake.terminal(dict(parse_qsl(url.query)))
+                if redirect_url is not None:
+                    return self._send(302, headers={'Location': redirect_url})
+            self._send(404)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            params = dict(parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True))
+            if fake.record:
+                with fake.lock:
+                    fake.connections.add(self.client_address)
+            content = fake.handle(urlparse(self.path).path, params)
+            if content is None:
+                self._send(500, b'Internal Server Error', {'Content-Type': 'text/plain'})
+            else:
+                self._send(200, content.encode(), {'Content-Type': 'text/xml; charset=utf-8'})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
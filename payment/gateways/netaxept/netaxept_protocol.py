@@ -2,7 +2,7 @@
 Low-level communications with netaxept.
 
 To avoid overcustomization this library makes a few choices on behalf of the library user:
-- AutoAuth is turned on.
+- AutoAuth is turned on, unless the payment is to be authorized and captured at once with a SALE.
 - We always redirect after the terminal (after_terminal_url must be configured)
 - The terminal is displayed as a single page.
 
@@ -13,20 +13,37 @@ Read this first: https://shop.nets.eu/web/partners/flow-outline
 Terminal details: https://shop.nets.eu/web/partners/terminal-options
 API details: https://shop.nets.eu/web/partners/appi
 Test card numbers: https://shop.nets.eu/web/partners/test-cards
+
+Connections:
+------------
+The calls of a config go through a requests.Session whose pool of keep-alive connections is shared by all the
+threads, so that the calls of a payment (register, query, capture, ...) do not each pay a TCP and TLS handshake.
+Only the connection errors are retried (max_retries times): a request that reached netaxept could have been
+executed, it is never sent again.
 """
 from dataclasses import dataclass
 from decimal import Decimal
 from enum import Enum
+from functools import lru_cache
 from typing import Optional, Union, Dict, Any
 from urllib.parse import urlencode, urljoin
 
 import requests
-import xmltodict
+from requests.adapters import HTTPAdapter
 from moneyed import Money
 from structlog import get_logger
+from urllib3.util.retry import Retry
+
+from .parsing import EXCEPTION, EXCEPTION_MESSAGE, parse_fields
+from ...currencies import to_minor_units
 
 logger = get_logger()
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 2
+
 
 @dataclass
 class NetaxeptConfig:
@@ -34,6 +51,10 @@ class NetaxeptConfig:
     secret: str
     base_url: str
     after_terminal_url: str
+    pool_size: int = DEFAULT_POOL_SIZE  # The number of connections kept open
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT  # In seconds
+    read_timeout: float = DEFAULT_READ_TIMEOUT  # In seconds
+    max_retries: int = DEFAULT_MAX_RETRIES  # The number of retries after a connection error
 
 
 class NetaxeptOperation(Enum):
@@ -59,7 +80,7 @@ class RegisterResponse:
 
 def register(config: NetaxeptConfig, amount: Money, order_number: Union[str, int],
              language: Optional[str] = None, description: Optional[str] = None,
-             customer_email: Optional[str] = None) -> RegisterResponse:
+             customer_email: Optional[str] = None, auto_auth: bool = True) -> RegisterResponse:
     """
     Registering a payment is the first step for netaxept, before taking the user to the netaxept
     terminal hosted page.
@@ -72,13 +93,24 @@ def register(config: NetaxeptConfig, amount: Money, order_number: Union[str, int
     :param language: The iso639-1 code of the language in which the terminal should be displayed.
     :param description: A text that will be displayed in the netaxept admin (but not to the user).
     :param customer_email: The email of the customer, can then be seen in the netaxept admin portal.
+    :param auto_auth: Whether the terminal authorizes the payment. Turn off to process it with a SALE afterwards.
     :return: a RegisterResponse
     :raises: NetaxeptProtocolError
     """
 
     logger.info('netaxept-register', amount=amount, order_number=order_number, language=language,
-                description=description, customer_email=customer_email)
+                description=description, customer_email=customer_email, auto_auth=auto_auth)
+
+    params = _register_params(config, amount, order_number, language, description, customer_email, auto_auth)
+    response = _post(config, 'Netaxept/Register.aspx', params)
+    raw_response = _build_raw_response(response)
+    logger.info('netaxept-register', amount=amount, order_number=order_number, language=language,
+                description=description, raw_response=raw_response)
+    return _register_response(response, raw_response)
+
 
+def _register_params(config: NetaxeptConfig, amount: Money, order_number: Union[str, int], language: Optional[str],
+                     description: Optional[str], customer_email: Optional[str], auto_auth: bool) -> Dict[str, Any]:
     params = {
         'merchantId': config.merchant_id,
         'token': config.secret,
@@ -90,7 +122,7 @@ def register(config: NetaxeptConfig, amount: Money, order_number: Union[str, int
         'currencyCode': _money_to_netaxept_currency(amount),
 
         # Terminal
-        'autoAuth': True,
+        'autoAuth': auto_auth,
         'terminalSinglePage': True,
         'language': _iso6391_to_netaxept_language(language),
         'redirectUrl': config.after_terminal_url
@@ -98,20 +130,18 @@ def register(config: NetaxeptConfig, amount: Money, order_number: Union[str, int
 
     if customer_email is not None:
         params['customerEmail'] = customer_email
+    return params
 
-    response = requests.post(url=urljoin(config.base_url, 'Netaxept/Register.aspx'), data=params)
-    raw_response = _build_raw_response(response)
-    logger.info('netaxept-register', amount=amount, order_number=order_number, language=language,
-                description=description, raw_response=raw_response)
 
+def _register_response(response, raw_response: Dict[str, Any]) -> RegisterResponse:
     if response.status_code == requests.codes.ok:
-        d = xmltodict.parse(response.text)
-        if 'RegisterResponse' in d:
+        root, fields = parse_fields(response.text, 'RegisterResponse', ['TransactionId'])
+        if root == 'RegisterResponse':
             return RegisterResponse(
-                transaction_id=d['RegisterResponse']['TransactionId'],
+                transaction_id=fields['TransactionId'],
                 raw_response=raw_response)
-        elif 'Exception' in d:
-            raise NetaxeptProtocolError(d['Exception']['Error']['Message'], raw_response)
+        elif root == EXCEPTION:
+            raise NetaxeptProtocolError(fields[EXCEPTION_MESSAGE], raw_response)
     raise NetaxeptProtocolError(response.reason, raw_response)
 
 
@@ -122,38 +152,46 @@ class ProcessResponse:
 
 
 def process(config: NetaxeptConfig, transaction_id: str, operation: NetaxeptOperation,
-            amount: Decimal) -> ProcessResponse:
+            amount: Decimal, currency: str) -> ProcessResponse:
     """
     :param config: The netaxept config
     :param transaction_id: The id of the transaction, should match the transaction id of the register call
     :param operation: The type of operation to perform
-    :param amount: The amount to process (only applies to Capture and Refund)
+    :param amount: The amount to process (only applies to Capture, Sale and Refund)
+    :param currency: The currency of the amount
     :return: ProcessResponse
     :raises: NetaxeptProtocolError
     """
     logger.info('netaxept-process', transaction_id=transaction_id, operation=operation.value, amount=amount)
 
-    params = {
+    params = _process_params(config, transaction_id, operation, amount, currency)
+    response = _post(config, 'Netaxept/Process.aspx', params)
+    raw_response = _build_raw_response(response)
+    logger.info('netaxept-process-response', transaction_id=transaction_id, operation=operation.value,
+                amount=amount, raw_response=raw_response)
+    return _process_response(response, raw_response)
+
+
+def _process_params(config: NetaxeptConfig, transaction_id: str, operation: NetaxeptOperation,
+                    amount: Decimal, currency: str) -> Dict[str, Any]:
+    return {
         'merchantId': config.merchant_id,
         'token': config.secret,
         'operation': operation.value,
         'transactionId': transaction_id,
-        'transactionAmount': _decimal_to_netaxept_amount(amount),
+        'transactionAmount': _decimal_to_netaxept_amount(amount, currency),
     }
 
-    response = requests.post(url=urljoin(config.base_url, 'Netaxept/Process.aspx'), data=params)
-    raw_response = _build_raw_response(response)
-    logger.info('netaxept-process-response', transaction_id=transaction_id, operation=operation.value,
-                amount=amount, raw_response=raw_response)
 
+def _process_response(response, raw_response: Dict[str, Any]) -> ProcessResponse:
     if response.status_code == requests.codes.ok:
-        d = xmltodict.parse(response.text)
-        if 'ProcessResponse' in d:
+        root, fields = parse_fields(response.text, 'ProcessResponse', ['ResponseCode'])
+        if root == 'ProcessResponse':
             return ProcessResponse(
-                response_code=d['ProcessResponse']['ResponseCode'],
+                response_code=fields['ResponseCode'],
                 raw_response=raw_response)
-        elif 'Exception' in d:
-            raise NetaxeptProtocolError(d['Exception']['Error']['Message'], raw_response)
+        elif root == EXCEPTION:
+            raise NetaxeptProtocolError(fields[EXCEPTION_MESSAGE], raw_response)
     raise NetaxeptProtocolError(response.reason, raw_response)
 
 
@@ -173,44 +211,74 @@ class QueryResponse:
     raw_response: Dict[str, Any]
 
 
+_QUERY_FIELDS = ['Summary/Annulled', 'Summary/Authorized', 'Summary/AuthorizationId']
+
+
 def query(config: NetaxeptConfig, transaction_id: str) -> QueryResponse:
     logger.info('netaxept-query', transaction_id=transaction_id)
 
-    params = {
+    params = _query_params(config, transaction_id)
+    response = _post(config, 'Netaxept/Query.aspx', params)
+    raw_response = _build_raw_response(response)
+    logger.info('netaxept-query-response', transaction_id=transaction_id, raw_response=raw_response)
+    return _query_response(response, raw_response)
+
+
+def _query_params(config: NetaxeptConfig, transaction_id: str) -> Dict[str, Any]:
+    return {
         'merchantId': config.merchant_id,
         'token': config.secret,
         'transactionId': transaction_id,
     }
 
-    response = requests.post(url=urljoin(config.base_url, 'Netaxept/Query.aspx'), data=params)
-    raw_response = _build_raw_response(response)
-    logger.info('netaxept-query-response', transaction_id=transaction_id, raw_response=raw_response)
+
+def _query_response(response, raw_response: Dict[str, Any]) -> QueryResponse:
     if response.status_code == requests.codes.ok:
-        d = xmltodict.parse(response.text)
-        if 'PaymentInfo' in d:
-            summary = d['PaymentInfo']['Summary']
-            annulled = summary['Annulled'] == 'true'
-            authorized = summary['Authorized'] == 'true'
-            authorization_id = summary.get('AuthorizationId')  # AuthorizationId may be absent from the response
+        root, fields = parse_fields(response.text, 'PaymentInfo', _QUERY_FIELDS)
+        if root == 'PaymentInfo':
+            annulled = fields['Summary/Annulled'] == 'true'
+            authorized = fields['Summary/Authorized'] == 'true'
+            authorization_id = fields.get('Summary/AuthorizationId')  # AuthorizationId may be absent from the response
             return QueryResponse(
                 annulled=annulled,
                 authorized=authorized,
                 authorization_id=authorization_id,
                 raw_response=raw_response
             )
-        elif 'Exception' in d:
-            raise NetaxeptProtocolError(d['Exception']['Error']['Message'], raw_response)
+        elif root == EXCEPTION:
+            raise NetaxeptProtocolError(fields[EXCEPTION_MESSAGE], raw_response)
     raise NetaxeptProtocolError(response.reason, raw_response)
 
 
-def _decimal_to_netaxept_amount(decimal_amount: Decimal) -> int:
-    """ Return the netaxept representation of the decimal representation of the amount. """
-    return int((decimal_amount * 100).to_integral_value())
+@lru_cache(maxsize=None)
+def _get_session(base_url: str, pool_size: int, max_retries: int) -> requests.Session:
+    retry = Retry(total=max_retries, connect=max_retries, read=0, status=0, other=0, redirect=False,
+                  backoff_factor=0.1)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(config: NetaxeptConfig) -> requests.Session:
+    """ The pooled session of the config, shared by all the threads. """
+    return _get_session(config.base_url, config.pool_size, config.max_retries)
+
+
+def _post(config: NetaxeptConfig, path: str, params: Dict[str, Any]) -> requests.Response:
+    return get_session(config).post(url=urljoin(config.base_url, path), data=params,
+                                    timeout=(config.connect_timeout, config.read_timeout))
+
+
+def _decimal_to_netaxept_amount(decimal_amount: Decimal, currency: str) -> int:
+    """ Return the netaxept representation (in minor units) of the decimal representation of the amount. """
+    return to_minor_units(decimal_amount, currency)
 
 
 def _money_to_netaxept_amount(money: Money) -> int:
     """ Return the netaxept representation of the money's amount. """
-    return _decimal_to_netaxept_amount(money.amount)
+    return _decimal_to_netaxept_amount(money.amount, money.currency.code)
 
 
 def _money_to_netaxept_currency(money: Money) -> str:
@@ -229,7 +297,8 @@ def _iso6391_to_netaxept_language(iso6391_language: Optional[str]) -> Optional[s
     return _netaxept_language_codes_by_prefix.get(iso6391_language)  # type:ignore
 
 
-def _build_raw_response(response: requests.Response):
+def _build_raw_response(response):
+    """ :param response: a requests.Response, or an object with the same attributes (see async_protocol). """
     return {
         'status_code': response.status_code,
         'url': response.url,
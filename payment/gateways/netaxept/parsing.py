@@ -0,0 +1,67 @@
+"""
+Reads the few fields that are needed from the XML responses of netaxept.
+
+The responses are fed by chunks to an incremental parser (lxml when it is installed, else the ElementTree of the
+standard library), the fields are picked by their path below the root element, and the parsing stops as soon as they are
+all known: for instance the History and CardInformation of a large PaymentInfo, that come after its Summary,
+are not parsed.
+"""
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    from xml.etree import ElementTree as etree  # type: ignore
+
+EXCEPTION = 'Exception'
+EXCEPTION_MESSAGE = 'Error/Message'
+
+CHUNK_SIZE = 2048  # Fed to the parser at once, so that it does not parse far beyond the fields
+
+
+def _events(data: bytes) -> Iterator[tuple]:
+    parser = etree.XMLPullParser(events=('start', 'end'))
+    for start in range(0, len(data), CHUNK_SIZE):
+        parser.feed(data[start:start + CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def parse_fields(text: str, root: str, paths: Sequence[str]) -> Tuple[str, Dict[str, Optional[str]]]:
+    """
+    The tag of the root element, and the text of the elements at the paths (like 'Summary/Authorized') that are
+    present, when the root is the expected one. For an Exception document it is the text of its Error/Message.
+    As with xmltodict, the texts are stripped, and an empty element is None.
+
+    :param text: The XML document.
+    :param root: The expected tag of the root element.
+    :param paths: The paths below the root element.
+    :return: (the tag of the root element, path -> text)
+    """
+    wanted: Dict[Tuple[str, ...], str] = {}
+    fields: Dict[str, Optional[str]] = {}
+    stack = []
+    for event, element in _events(text.encode('utf-8')):
+        if event == 'start':
+            if not stack:
+                if element.tag == root:
+                    wanted = {tuple(path.split('/')): path for path in paths}
+                elif element.tag == EXCEPTION:
+                    wanted = {tuple(EXCEPTION_MESSAGE.split('/')): EXCEPTION_MESSAGE}
+                else:
+                    return element.tag, fields
+            stack.append(element.tag)
+            continue
+        stack.pop()
+        if not stack:
+            return element.tag, fields
+        path = tuple(stack[1:]) + (element.tag,)
+        if path in wanted:
+            fields[wanted.pop(path)] = (element.text or '').strip() or None
+            if not wanted:
+                return stack[0], fields
+        elif all(missing[:len(path)] == path for missing in wanted):
+            return stack[0], fields  # The missing fields would have been below this element
+        element.clear()
+    raise etree.ParseError('no element found')  # pragma: no cover
@@ -0,0 +1,129 @@
+"""
+Sweeps the netaxept payments that were registered but never came back from the terminal.
+
+Such a payment has a token (the netaxept transaction id) but no successful authorization. Once it is older than
+a given age, its transaction is queried from netaxept:
+
+- if it was authorized after all (the user closed the browser before being redirected), the authorization
+  transaction is recorded, as the after_terminal view would have.
+- else the payment is marked as abandoned: a failed authorization transaction is recorded and the payment is
+  deactivated. Netaxept has nothing to annul, a registration that is not authorized expires by itself.
+
+The payments are selected with one query (on the payment_gateway_status_idx index), and queried from netaxept by a
+pool of threads. The database is only written from the calling thread.
+
+See the sweep_netaxept_registrations management command.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import requests
+from django.db import transaction
+from django.db.models import Exists, OuterRef, QuerySet, Subquery
+from django.utils import timezone
+from structlog import get_logger
+
+from . import gateway_to_netaxept_config, netaxept_protocol
+from .netaxept_protocol import NetaxeptConfig, NetaxeptProtocolError, QueryResponse
+from ... import ChargeStatus, TransactionKind, get_payment_gateway
+from ...models import Payment, Transaction
+
+logger = get_logger()
+
+DEFAULT_AGE = timedelta(hours=1)
+DEFAULT_WORKERS = 8
+
+ABANDONED_ERROR = 'Abandoned in the netaxept terminal'
+
+
+@dataclass
+class SweepSummary:
+    checked: int = 0
+    authorized: int = 0
+    abandoned: int = 0
+    skipped: int = 0  # Authorized or deactivated while they were queried
+    errors: int = 0
+
+
+def abandoned_registrations(gateway: str, registered_before: datetime) -> QuerySet:
+    """
+    The active payments of the gateway last registered before the date, that are neither authorized nor charged.
+
+    The payments last registered without authorization (auto_auth=False) are left out, they wait for their SALE.
+    """
+    last_registration = Transaction.objects \
+        .filter(payment=OuterRef('pk'), kind=TransactionKind.REGISTER, is_success=True) \
+        .order_by('-created', '-pk')
+    # A payment is registered after its creation, the filter on created only narrows the scan of the index
+    return Payment.objects \
+        .filter(gateway=gateway, charge_status=ChargeStatus.NOT_CHARGED, created__lt=registered_before,
+                is_active=True) \
+        .exclude(token='') \
+        .annotate(last_registered=Subquery(last_registration.values('created')[:1]),
+                  last_auto_auth=Subquery(last_registration.values('auto_auth')[:1]),
+                  has_successful_auth=Exists(Transaction.objects.filter(
+                      payment=OuterRef('pk'), kind=TransactionKind.AUTH, is_success=True))) \
+        .filter(last_registered__lt=registered_before, last_auto_auth=True, has_successful_auth=False)
+
+
+def _query(config: NetaxeptConfig, token: str) -> Tuple[Optional[QueryResponse], Optional[str]]:
+    try:
+        return netaxept_protocol.query(config=config, transaction_id=token), None
+    except NetaxeptProtocolError as exception:
+        return None, exception.error
+    except requests.RequestException as exception:
+        return None, str(exception)
+
+
+def _record(payment: Payment, query_response: QueryResponse, summary: SweepSummary) -> None:
+    authorized = query_response.authorized and not query_response.annulled
+    with transaction.atomic():
+        # The user can have come back from the terminal since the payment was selected
+        payment = Payment.objects.select_for_update().get(pk=payment.pk)
+        if not payment.is_active or \
+                payment.transactions.filter(kind=TransactionKind.AUTH, is_success=True).exists():
+            summary.skipped += 1
+            return
+        Transaction.objects.create(
+            payment=payment,
+            kind=TransactionKind.AUTH,
+            token=payment.token,
+            is_success=authorized,
+            amount=payment.total,
+            error=None if authorized else ABANDONED_ERROR,
+            gateway_response=query_response.raw_response)
+        if not authorized:
+            payment.is_active = False
+        payment.save()  # Also for its modified time, the change feed brings the new transaction
+    if authorized:
+        summary.authorized += 1
+    else:
+        summary.abandoned += 1
+
+
+def sweep(gateway: str, age: timedelta = DEFAULT_AGE, workers: int = DEFAULT_WORKERS) -> SweepSummary:
+    """
+    Settle the payments of the gateway that were registered more than age ago, and not authorized since.
+
+    :param gateway: The name of a netaxept gateway in PAYMENT_GATEWAYS.
+    :param workers: The number of queries sent to netaxept at the same time.
+    :return: The counts of the payments.
+    """
+    summary = SweepSummary()
+    _, gateway_config = get_payment_gateway(gateway)
+    config = gateway_to_netaxept_config(gateway_config)
+    payments = list(abandoned_registrations(gateway, timezone.now() - age))
+    logger.info('netaxept-sweep', gateway=gateway, payments=len(payments))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='netaxept-sweeper') as executor:
+        results = executor.map(lambda payment: _query(config, payment.token), payments)
+        for payment, (query_response, error) in zip(payments, results):
+            summary.checked += 1
+            if query_response is None:
+                logger.warning('netaxept-sweep-error', payment_id=payment.id, error=error)
+                summary.errors += 1
+            else:
+                _record(payment, query_response, summary)
+    return summary
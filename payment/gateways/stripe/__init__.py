@@ -2,6 +2,7 @@ import stripe
 from typing import Dict, Optional
 
 from . import connect
+from .client import HttpOptions, StripeClient, get_client
 from .forms import StripePaymentModalForm
 from .utils import (
     get_amount_for_stripe,
@@ -57,9 +58,8 @@ def capture(payment_information: PaymentData, config: GatewayConfig) -> GatewayR
     stripe_amount = get_amount_for_stripe(amount, payment_information.currency)
 
     try:
-        # Retrieve stripe charge and capture specific amount
-        stripe_charge = client.Charge.retrieve(payment_information.token)
-        response = stripe_charge.capture(amount=stripe_amount)
+        # Capture specific amount, by charge id
+        response = client.Charge.capture(payment_information.token, amount=stripe_amount)
     except stripe.error.StripeError as exc:
         response = _get_error_response_from_exc(exc)
         error = exc.user_message
@@ -81,9 +81,8 @@ def refund(payment_information: PaymentData, config: GatewayConfig) -> GatewayRe
     stripe_amount = get_amount_for_stripe(amount, payment_information.currency)
 
     try:
-        # Retrieve stripe charge and refund specific amount
-        stripe_charge = client.Charge.retrieve(payment_information.token)
-        response = client.Refund.create(charge=stripe_charge.id, amount=stripe_amount)
+        # Refund specific amount, by charge id
+        response = client.Refund.create(charge=payment_information.token, amount=stripe_amount)
     except stripe.error.StripeError as exc:
         response = _get_error_response_from_exc(exc)
         error = exc.user_message
@@ -101,9 +100,8 @@ def void(payment_information: PaymentData, config: GatewayConfig) -> GatewayResp
     client, error = _get_client(**config.connection_params), None
 
     try:
-        # Retrieve stripe charge and refund all
-        stripe_charge = client.Charge.retrieve(payment_information.token)
-        response = client.Refund.create(charge=stripe_charge.id)
+        # Refund all, by charge id
+        response = client.Refund.create(charge=payment_information.token)
     except stripe.error.StripeError as exc:
         response = _get_error_response_from_exc(exc)
         error = exc.user_message
@@ -136,9 +134,8 @@ def create_form(
     )
 
 
-def _get_client(**connection_params):
-    stripe.api_key = connection_params.get("secret_key")
-    return stripe
+def _get_client(**connection_params) -> StripeClient:
+    return get_client(connection_params.get("secret_key"), HttpOptions.from_connection_params(connection_params))
 
 
 def _get_stripe_charge_payload(
@@ -149,8 +146,8 @@ def _get_stripe_charge_payload(
     # Get currency
     currency = get_currency_for_stripe(payment_information.currency)
 
-    # Get appropriate amount for stripe
-    stripe_amount = get_amount_for_stripe(payment_information.amount, currency)
+    # Get appropriate amount for stripe (the exponents are keyed by the upper case code)
+    stripe_amount = get_amount_for_stripe(payment_information.amount, payment_information.currency)
 
     # Get billing name from payment
     name = get_payment_billing_fullname(payment_information)
@@ -178,7 +175,7 @@ def _get_stripe_charge_payload(
 def _create_stripe_charge(client, payment_information, should_capture: bool):
     """Create a charge with specific amount, ignoring payment's total."""
     charge_payload = _get_stripe_charge_payload(payment_information, should_capture)
-    connect.maybe_add_transfer_data(charge_payload)
+    connect.maybe_add_transfer_data(charge_payload, payment_information)
     return client.Charge.create(**charge_payload)
 
 
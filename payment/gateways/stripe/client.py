@@ -0,0 +1,135 @@
+"""
+A Stripe client per gateway config.
+
+The stripe library keeps the api key in a module global (stripe.api_key). Setting it before each call is not
+safe when configs with different keys are used from several threads: a request could go out with the key of
+another config. Instead the client passes the api key of its config with each request.
+
+The library also keeps a single global HTTP client, that is left alone. The requests of a client are sent with
+the HTTP client of its config instead, passed to each request: a requests.Session whose pool of keep-alive
+connections is shared by all the threads, so that a burst of calls does not pay a TCP and TLS handshake per call.
+It is configured with these optional connection_params:
+
+- pool_size: the number of connections kept open (10 by default)
+- keep_alive: False to open a new connection for each request (True by default)
+- max_network_retries: the number of retries after a connection error or timeout (2 by default)
+- timeout: in seconds (80 by default, as the stripe library)
+- proxy: the url of a proxy, or a dict of urls per scheme
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Union
+from urllib.parse import quote_plus
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from stripe.api_requestor import APIRequestor
+from stripe.http_client import RequestsClient
+from stripe.util import convert_to_stripe_object
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_NETWORK_RETRIES = 2
+DEFAULT_TIMEOUT = 80
+
+
+@dataclass(frozen=True)
+class HttpOptions:
+    pool_size: int = DEFAULT_POOL_SIZE
+    keep_alive: bool = True
+    max_network_retries: int = DEFAULT_MAX_NETWORK_RETRIES
+    timeout: float = DEFAULT_TIMEOUT
+    proxy: Union[None, str, tuple] = None  # A dict of urls is kept as a tuple of items, to be hashable
+
+    @classmethod
+    def from_connection_params(cls, connection_params: dict) -> 'HttpOptions':
+        proxy = connection_params.get('proxy')
+        return cls(
+            pool_size=int(connection_params.get('pool_size', DEFAULT_POOL_SIZE)),
+            keep_alive=bool(connection_params.get('keep_alive', True)),
+            max_network_retries=int(connection_params.get('max_network_retries', DEFAULT_MAX_NETWORK_RETRIES)),
+            timeout=connection_params.get('timeout', DEFAULT_TIMEOUT),
+            proxy=tuple(sorted(proxy.items())) if isinstance(proxy, dict) else proxy,
+        )
+
+
+class PooledHttpClient(RequestsClient):
+    """ A stripe HTTP client on one requests.Session, shared by all the threads. """
+
+    def __init__(self, options: HttpOptions) -> None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=options.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not options.keep_alive:
+            session.headers['Connection'] = 'close'
+        proxy = dict(options.proxy) if isinstance(options.proxy, tuple) else options.proxy
+        super().__init__(timeout=options.timeout, session=session, verify_ssl_certs=stripe.verify_ssl_certs,
+                         proxy=proxy)
+        self.options = options
+
+    def _max_network_retries(self):
+        return self.options.max_network_retries
+
+    def _should_retry(self, response, api_connection_error, num_retries):
+        # Only the connection errors and timeouts are retried, a response of stripe is final.
+        if response is not None:
+            return False
+        return super()._should_retry(response, api_connection_error, num_retries)
+
+
+class _Resource:
+    """ A Stripe API resource (stripe.Charge, stripe.Refund, ...), requested with an api key and an HTTP client. """
+
+    def __init__(self, resource, api_key: str, http_client: PooledHttpClient) -> None:
+        self._resource = resource
+        self._api_key = api_key
+        self._http_client = http_client
+
+    def _request(self, method: str, url: str, params: dict):
+        # A requestor per request, as the stripe library does: it takes the current stripe.api_base and api_version
+        requestor = APIRequestor(key=self._api_key, client=self._http_client)
+        response, api_key = requestor.request(method, url, params)
+        return convert_to_stripe_object(response, api_key)
+
+    def _instance_url(self, id: str) -> str:
+        return '{}/{}'.format(self._resource.class_url(), quote_plus(id))
+
+    def create(self, **params):
+        return self._request('post', self._resource.class_url(), params)
+
+    def retrieve(self, id: str, **params):
+        return self._request('get', self._instance_url(id), params)
+
+    def list(self, **params):
+        return self._request('get', self._resource.class_url(), params)
+
+
+class _ChargeResource(_Resource):
+    def capture(self, id: str, **params):
+        return self._request('post', self._instance_url(id) + '/capture', params)
+
+
+class StripeClient:
+    """
+    Offers the resources of the stripe module that the gateway uses, for one api key. Safe to share between threads.
+
+    The objects returned by the resources (a retrieved charge, ...) keep the api key for their own methods,
+    but these send their requests with the global HTTP client of the stripe library.
+    """
+
+    def __init__(self, api_key: str, http_client: PooledHttpClient) -> None:
+        self.api_key = api_key
+        self.http_client = http_client
+        self.Charge = _ChargeResource(stripe.Charge, api_key, http_client)
+        self.Refund = _Resource(stripe.Refund, api_key, http_client)
+
+
+@lru_cache(maxsize=None)
+def get_http_client(options: HttpOptions) -> PooledHttpClient:
+    return PooledHttpClient(options)
+
+
+@lru_cache(maxsize=None)
+def get_client(api_key: str, options: HttpOptions = HttpOptions()) -> StripeClient:
+    return StripeClient(api_key, get_http_client(options))
@@ -1,8 +1,46 @@
+"""
+Split payments with stripe connect: the part of a charge that is transferred to a connected account.
+
+The destination and percent of each charge are resolved by a router, a function that takes the PaymentData of the
+charge and returns a Transfer (or None for no transfer). The router is set with the STRIPE_CONNECT_ROUTER setting
+(a dotted path), the default_router tries in order:
+
+- metadata_router: the transfer_destination and transfer_percent of the payment metadata (without transfer_percent,
+  the percent of the STRIPE_CONNECT setting)
+- table_router: the StripeConnectRoute of the seller of the payment metadata (its 'seller' key, see
+  STRIPE_CONNECT_SELLER_KEY)
+- settings_router: the STRIPE_CONNECT setting
+
+The routes of the table are kept in an in-process cache, for STRIPE_CONNECT_CACHE_TTL seconds (60 by default) and
+at most STRIPE_CONNECT_CACHE_SIZE sellers (10000 by default), so that most charges route without a query.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, NamedTuple, Optional
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
 from structlog import get_logger
 
+from ...interface import PaymentData
+from ...models import StripeConnectRoute
+
 logger = get_logger()
 
+DEFAULT_CACHE_TTL = 60
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_SELLER_KEY = 'seller'
+
+
+class Transfer(NamedTuple):
+    destination: str
+    percent: int
+
 
 def add_transfer_data(charge_payload, destination, percent):
     full_amount = charge_payload['amount']
@@ -17,15 +55,134 @@ def add_transfer_data(charge_payload, destination, percent):
                  destination=destination)
 
 
-def maybe_add_transfer_data(charge_payload):
-    if hasattr(settings, 'STRIPE_CONNECT'):
-        _connect_settings = settings.STRIPE_CONNECT
-        _transfer_destination = _connect_settings['transfer_destination']
-        _transfer_percent_string = _connect_settings['transfer_percent']
-        try:
-            _transfer_percent = int(_transfer_percent_string)
-        except ValueError:
-            raise Exception("STRIPE_TRANSFER_PERCENT should be an int")
-        if _transfer_percent < 0 or _transfer_percent > 100:
-            raise Exception("STRIPE_TRANSFER_PERCENT should be between 0 and 100")
-        add_transfer_data(charge_payload=charge_payload, destination=_transfer_destination, percent=_transfer_percent)
+def _transfer(destination, percent) -> Transfer:
+    try:
+        percent = int(percent)
+    except ValueError:
+        raise Exception("STRIPE_TRANSFER_PERCENT should be an int")
+    if percent < 0 or percent > 100:
+        raise Exception("STRIPE_TRANSFER_PERCENT should be between 0 and 100")
+    return Transfer(destination, percent)
+
+
+@lru_cache(maxsize=None)
+def get_transfer_settings() -> Optional[Transfer]:
+    """The destination and percent of the STRIPE_CONNECT setting, validated once (until the setting changes)."""
+    if not hasattr(settings, 'STRIPE_CONNECT'):
+        return None
+    _connect_settings = settings.STRIPE_CONNECT
+    return _transfer(_connect_settings['transfer_destination'], _connect_settings['transfer_percent'])
+
+
+class TTLCache:
+    """A thread-safe mapping whose entries expire after ttl seconds, and that keeps at most maxsize entries."""
+
+    def __init__(self, ttl: float, maxsize: int) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()  # key -> (expiry, value), the least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, load: Callable):
+        """ The value of the key, loaded with load(key) when missing or expired. """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = load(key)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def discard(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_routes: Optional[TTLCache] = None
+
+
+def _get_routes() -> TTLCache:
+    global _routes
+    if _routes is None:
+        _routes = TTLCache(ttl=getattr(settings, 'STRIPE_CONNECT_CACHE_TTL', DEFAULT_CACHE_TTL),
+                           maxsize=getattr(settings, 'STRIPE_CONNECT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+    return _routes
+
+
+def _load_route(seller: str) -> Optional[Transfer]:
+    route = StripeConnectRoute.objects.filter(seller=seller).values_list('destination', 'percent').first()
+    return Transfer(*route) if route is not None else None  # A seller without route is cached too
+
+
+def settings_router(payment_information: PaymentData) -> Optional[Transfer]:
+    return get_transfer_settings()
+
+
+def metadata_router(payment_information: PaymentData) -> Optional[Transfer]:
+    metadata = payment_information.metadata or {}
+    if 'transfer_destination' not in metadata:
+        return None
+    percent = metadata.get('transfer_percent')
+    if percent is None:
+        # Never the whole charge by default: the percent of the STRIPE_CONNECT setting, if any
+        transfer_settings = get_transfer_settings()
+        if transfer_settings is None:
+            raise Exception("The payment metadata has a transfer_destination but no transfer_percent")
+        percent = transfer_settings.percent
+    return _transfer(metadata['transfer_destination'], percent)
+
+
+def table_router(payment_information: PaymentData) -> Optional[Transfer]:
+    seller = (payment_information.metadata or {}).get(getattr(settings, 'STRIPE_CONNECT_SELLER_KEY',
+                                                              DEFAULT_SELLER_KEY))
+    if seller is None:
+        return None
+    return _get_routes().get(str(seller), _load_route)
+
+
+def default_router(payment_information: PaymentData) -> Optional[Transfer]:
+    return metadata_router(payment_information) or table_router(payment_information) or \
+        settings_router(payment_information)
+
+
+@lru_cache(maxsize=None)
+def get_router() -> Callable[[PaymentData], Optional[Transfer]]:
+    path = getattr(settings, 'STRIPE_CONNECT_ROUTER', None)
+    return import_string(path) if path else default_router
+
+
+@receiver(setting_changed)
+def _clear_transfer_settings(setting, **kwargs):
+    global _routes
+    if setting == 'STRIPE_CONNECT':
+        get_transfer_settings.cache_clear()
+    elif setting == 'STRIPE_CONNECT_ROUTER':
+        get_router.cache_clear()
+    elif setting in ('STRIPE_CONNECT_CACHE_TTL', 'STRIPE_CONNECT_CACHE_SIZE'):
+        _routes = None
+
+
+@receiver(post_save, sender=StripeConnectRoute)
+@receiver(post_delete, sender=StripeConnectRoute)
+def _discard_route(instance, **kwargs):
+    # Only the cache of this process, the other processes see the change once their entry expires.
+    _get_routes().discard(instance.seller)
+
+
+def maybe_add_transfer_data(charge_payload, payment_information: Optional[PaymentData] = None):
+    if payment_information is None:
+        transfer = get_transfer_settings()
+    else:
+        transfer = get_router()(payment_information)
+    if transfer is not None:
+        add_transfer_data(charge_payload=charge_payload, destination=transfer.destination, percent=transfer.percent)
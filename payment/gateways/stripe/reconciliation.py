@@ -0,0 +1,223 @@
+"""
+Reconciliation of the Stripe charges and refunds with the transactions.
+
+The charges and refunds created in a date range are listed from Stripe in windows of time, that are paged
+concurrently. They are compared, as they arrive, with an index of the successful transactions of the gateway:
+token (the id of the charge or of the refund) -> kinds and amounts. The index is built from one streaming query,
+and is the only thing that is kept in memory.
+
+The problems that are reported:
+
+- mismatch: the transaction of a charge or refund has another amount or currency.
+- missing: there is no transaction for a succeeded charge or refund, but there are transactions for its charge
+  (for instance a refund made in the Stripe dashboard).
+- orphaned: there is no transaction at all for the charge.
+
+A captured charge is expected to have a capture transaction for its captured amount, an uncaptured charge an
+authorization transaction for its amount, and a refund a refund (or void) transaction for its amount.
+Note that the captured amount is known only when the charges have amount_captured (in the recent versions of
+the Stripe API), with the older versions a partial capture is reported as a mismatch.
+
+See the reconcile_stripe management command.
+"""
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .client import HttpOptions, get_client
+from .utils import get_amount_for_stripe
+from ... import TransactionKind, get_payment_gateway
+from ...export import DEFAULT_CHUNK_SIZE
+from ...models import Transaction
+
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+ORPHANED = 'orphaned'
+
+CHARGE = 'charge'
+REFUND = 'refund'
+
+DEFAULT_WINDOW = timedelta(days=1)
+DEFAULT_WORKERS = 8
+PAGE_SIZE = 100  # The maximum of the Stripe API
+
+# The transactions of the objects created in the range can be created a bit before (clock differences),
+# and after: a charge can be captured up to 7 days after its authorization.
+INDEX_MARGIN_BEFORE = timedelta(hours=1)
+INDEX_MARGIN_AFTER = timedelta(days=8)
+
+# Token -> (kind, amount in the stripe minor unit, stripe currency) of each successful transaction
+Index = Dict[str, List[Tuple[str, int, str]]]
+
+
+@dataclass
+class Problem:
+    problem: str  # MISMATCH, MISSING or ORPHANED
+    object: str  # CHARGE or REFUND
+    id: str
+    charge: str
+    kind: str  # The kind of the expected transaction
+    amount: int  # In the stripe minor unit
+    currency: str
+    recorded_amount: Optional[int] = None
+    recorded_currency: Optional[str] = None
+
+
+@dataclass
+class Summary:
+    transactions: int = 0
+    charges: int = 0
+    refunds: int = 0
+    mismatch: int = 0
+    missing: int = 0
+    orphaned: int = 0
+
+
+def build_index(gateway: str, created_from: datetime, created_until: datetime,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Index:
+    """ The successful transactions of the gateway around the range, read with one streaming query. """
+    rows = Transaction.objects \
+        .filter(payment__gateway=gateway, is_success=True,
+                created__gte=created_from - INDEX_MARGIN_BEFORE, created__lt=created_until + INDEX_MARGIN_AFTER) \
+        .values_list('token', 'kind', 'amount', 'amount_currency') \
+        .iterator(chunk_size=chunk_size)
+    index: Index = {}
+    for token, kind, amount, currency in rows:
+        index.setdefault(token, []).append(
+            (sys.intern(kind), get_amount_for_stripe(amount, currency), sys.intern(currency.lower())))
+    return index
+
+
+def time_windows(created_from: datetime, created_until: datetime, size: timedelta) -> List[Tuple[int, int]]:
+    """ The range split in windows of size, as [start, end) timestamps. """
+    start, end, step = int(created_from.timestamp()), int(created_until.timestamp()), int(size.total_seconds())
+    return [(window_start, min(window_start + step, end)) for window_start in range(start, end, max(step, 1))]
+
+
+def _pages(resource, start: int, end: int) -> Iterator[list]:
+    params = {'created': {'gte': start, 'lt': end}, 'limit': PAGE_SIZE}
+    while True:
+        page = resource.list(**params)
+        if page['data']:
+            yield page['data']
+        if not page['has_more']:
+            return
+        params['starting_after'] = page['data'][-1]['id']
+
+
+def list_objects(client, windows: List[Tuple[int, int]], workers: int = DEFAULT_WORKERS) -> Iterator[Tuple[str, dict]]:
+    """
+    The charges and refunds of the windows, as (CHARGE or REFUND, object). The windows are paged by a pool of
+    threads, the pages wait in a bounded queue until they are consumed.
+    """
+    pages: queue.Queue = queue.Queue(maxsize=2 * workers)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def page_window(name, resource, start, end):
+        try:
+            for page in _pages(resource, start, end):
+                if stop.is_set():
+                    return
+                put((name, page))
+        finally:
+            put((done, None))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stripe-reconciliation') as executor:
+        futures = [executor.submit(page_window, name, resource, start, end)
+                   for name, resource in [(CHARGE, client.Charge), (REFUND, client.Refund)]
+                   for start, end in windows]
+        try:
+            remaining = len(futures)
+            while remaining:
+                name, page = pages.get()
+                if name is done:
+                    remaining -= 1
+                    continue
+                for obj in page:
+                    yield name, obj
+        finally:
+            stop.set()
+        for future in futures:
+            future.result()  # Raises the error of a window
+
+
+def check_charge(charge: dict, index: Index) -> Optional[Problem]:
+    if charge['status'] != 'succeeded':
+        return None
+    recorded = index.get(charge['id'])
+    if charge['captured']:
+        kind, amount = TransactionKind.CAPTURE, charge.get('amount_captured', charge['amount'])
+    else:
+        kind, amount = TransactionKind.AUTH, charge['amount']
+    problem = Problem(problem=ORPHANED, object=CHARGE, id=charge['id'], charge=charge['id'], kind=kind,
+                      amount=amount, currency=charge['currency'])
+    if recorded is None:
+        return problem
+    return _compare(problem, [entry for entry in recorded if entry[0] == kind])
+
+
+def check_refund(refund: dict, index: Index) -> Optional[Problem]:
+    if refund['status'] != 'succeeded':
+        return None
+    recorded = index.get(refund['id'])
+    problem = Problem(problem=ORPHANED, object=REFUND, id=refund['id'], charge=refund['charge'],
+                      kind=TransactionKind.REFUND, amount=refund['amount'], currency=refund['currency'])
+    if recorded is None:
+        if refund['charge'] in index:
+            problem.problem = MISSING
+        return problem
+    refund_kinds = (TransactionKind.REFUND, TransactionKind.VOID)
+    return _compare(problem, [entry for entry in recorded if entry[0] in refund_kinds])
+
+
+def _compare(problem: Problem, recorded: List[Tuple[str, int, str]]) -> Optional[Problem]:
+    if not recorded:
+        problem.problem = MISSING
+        return problem
+    if any(amount == problem.amount and currency == problem.currency for _kind, amount, currency in recorded):
+        return None
+    problem.problem = MISMATCH
+    _kind, problem.recorded_amount, problem.recorded_currency = recorded[0]
+    return problem
+
+
+def reconcile(gateway: str, created_from: datetime, created_until: datetime, window: timedelta = DEFAULT_WINDOW,
+              workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+              summary: Optional[Summary] = None) -> Iterator[Problem]:
+    """
+    The problems of the charges and refunds created in [created_from, created_until), as they are found.
+
+    :param gateway: The name of a stripe gateway in PAYMENT_GATEWAYS.
+    :param summary: Updated with the counts.
+    """
+    summary = summary if summary is not None else Summary()
+    _, config = get_payment_gateway(gateway)
+    connection_params = config.connection_params
+    client = get_client(connection_params.get('secret_key'), HttpOptions.from_connection_params(connection_params))
+
+    index = build_index(gateway, created_from, created_until, chunk_size)
+    summary.transactions = sum(len(entries) for entries in index.values())
+
+    for name, obj in list_objects(client, time_windows(created_from, created_until, window), workers):
+        if name == CHARGE:
+            summary.charges += 1
+            problem = check_charge(obj, index)
+        else:
+            summary.refunds += 1
+            problem = check_refund(obj, index)
+        if problem is not None:
+            setattr(summary, problem.problem, getattr(summary, problem.problem) + 1)
+            yield problem
@@ -1,15 +1,19 @@
-from decimal import Decimal
+from functools import lru_cache
 from typing import Dict
 
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.translation import get_language
 from django_countries import countries
 
-# List of zero-decimal currencies
+from ...currencies import CURRENCY_EXPONENTS, from_minor_units, to_minor_units
+from ...interface import AddressData, PaymentData
+
+# Set of zero-decimal currencies
 # Since there is no public API in Stripe backend or helper function
 # in Stripe's Python library, this list is straight out of Stripe's docs
 # https://stripe.com/docs/currencies#zero-decimal
-from ...interface import AddressData, PaymentData
-
-ZERO_DECIMAL_CURRENCIES = [
+ZERO_DECIMAL_CURRENCIES = frozenset([
     "BIF",
     "CLP",
     "DJF",
@@ -26,7 +30,14 @@ ZERO_DECIMAL_CURRENCIES = [
     "XAF",
     "XOF",
     "XPF",
-]
+])
+
+# Stripe uses the ISO 4217 minor units, except for its own list of zero-decimal currencies.
+# The other ISO zero-decimal currencies (such as ISK) are represented with two decimals by stripe.
+STRIPE_CURRENCY_EXPONENTS = {
+    currency: 0 if currency in ZERO_DECIMAL_CURRENCIES else (exponent or 2)
+    for currency, exponent in CURRENCY_EXPONENTS.items()
+}
 
 
 def get_amount_for_stripe(amount, currency):
@@ -36,26 +47,12 @@ def get_amount_for_stripe(amount, currency):
     and converting to integer is required. But for zero-decimal currencies,
     multiplying by 100 is not needed.
     """
-    # Multiply by 100 for non-zero-decimal currencies
-    if currency.upper() not in ZERO_DECIMAL_CURRENCIES:
-        amount *= 100
-
-    # Using int(Decimal) directly may yield wrong result
-    # such as int(Decimal(24.24)*100) will equal to 2423
-    return int(amount.to_integral_value())
+    return to_minor_units(amount, currency, STRIPE_CURRENCY_EXPONENTS)
 
 
 def get_amount_from_stripe(amount, currency):
     """Get appropriate amount from stripe."""
-    amount = Decimal(amount)
-
-    # Divide by 100 for non-zero-decimal currencies
-    if currency.upper() not in ZERO_DECIMAL_CURRENCIES:
-        # Using Decimal(amount / 100.0) will convert to decimal from float
-        # where precision may be lost
-        amount /= Decimal(100)
-
-    return amount
+    return from_minor_units(amount, currency, STRIPE_CURRENCY_EXPONENTS)
 
 
 def get_currency_for_stripe(currency):
@@ -84,6 +81,18 @@ def get_payment_billing_fullname(payment_information: PaymentData) -> str:
     """
 
 
+@lru_cache(maxsize=None)
+def get_country_names(language: str) -> Dict[str, str]:
+    """The names of the countries by code, in the language (that must be the active language)."""
+    return dict(countries)
+
+
+@receiver(setting_changed)
+def _clear_country_names(setting, **kwargs):
+    if setting.startswith("COUNTRIES_"):
+        get_country_names.cache_clear()
+
+
 def shipping_to_stripe_dict(shipping: AddressData) -> Dict:
     return {
         "line1": shipping.street_address_1,
@@ -91,5 +100,5 @@ def shipping_to_stripe_dict(shipping: AddressData) -> Dict:
         "city": shipping.city,
         "state": shipping.country_area,
         "postal_code": shipping.postal_code,
-        "country": dict(countries).get(shipping.country, ""),
+        "country": get_country_names(get_language()).get(shipping.country, ""),
     }
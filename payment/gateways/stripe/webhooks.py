@@ -0,0 +1,183 @@
+"""
+Stripe webhooks: the changes made in Stripe (a capture or a refund from the Stripe dashboard, ...) are pushed
+to the payments instead of being polled.
+
+The webhook view only checks the signature and stores the event (once, by event id), so that Stripe gets its
+answer immediately. The stored events are then processed in batches by a worker, see the
+process_webhook_events management command, that creates the missing transactions and updates the payments.
+
+The webhook of a gateway config is at payment/stripe/<gateway>/webhook/, its signing secret is the
+webhook_secret of the connection_params.
+"""
+import json
+from typing import Dict, Optional
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from moneyed import Money
+from stripe import WebhookSignature
+from stripe.error import SignatureVerificationError
+from structlog import get_logger
+
+from .utils import get_amount_from_stripe, get_currency_from_stripe
+from ... import TransactionKind, get_payment_gateway
+from ...models import Payment, Transaction, WebhookEvent
+from ...utils import _gateway_postprocess
+
+logger = get_logger()
+
+DEFAULT_BATCH_SIZE = 100
+MAX_ATTEMPTS = 5  # The events that failed that many times are left to be looked at
+
+NO_PAYMENT_ERROR = 'No payment for this charge'
+
+
+@csrf_exempt
+@require_POST
+def webhook(request: HttpRequest, gateway: str) -> HttpResponse:
+    try:
+        _, gateway_config = get_payment_gateway(gateway)
+        secret = gateway_config.connection_params['webhook_secret']
+    except (ValueError, KeyError):
+        secret = None
+    if not secret:
+        return HttpResponseBadRequest('No webhook for this gateway')
+
+    payload = request.body.decode('utf-8')
+    try:
+        WebhookSignature.verify_header(payload, request.META.get('HTTP_STRIPE_SIGNATURE', ''), secret,
+                                       tolerance=300)
+        event = json.loads(payload)
+        event_id, event_type = event['id'], event['type']
+    except (SignatureVerificationError, ValueError, KeyError, TypeError) as exc:
+        logger.warning('stripe webhook rejected', gateway=gateway, error=str(exc))
+        return HttpResponseBadRequest('Invalid event')
+
+    # Stripe delivers each event at least once, the event is stored only the first time.
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(gateway=gateway, event_id=event_id, type=event_type, payload=payload)],
+        ignore_conflicts=True)
+    return HttpResponse()
+
+
+def _amount(charge: dict, stripe_amount: int) -> Money:
+    currency = get_currency_from_stripe(charge['currency'])
+    return Money(get_amount_from_stripe(stripe_amount, currency), currency)
+
+
+def _create_transaction(payment: Payment, kind: str, token: str, amount: Money, charge: dict) -> Transaction:
+    txn = Transaction.objects.create(
+        payment=payment,
+        kind=kind,
+        token=token,
+        is_success=True,
+        amount=amount,
+        gateway_response=charge,
+    )
+    _gateway_postprocess(txn, payment)
+    return txn
+
+
+# The handlers are called with the payment locked (select_for_update), as gateway_capture and gateway_refund do
+# while they call Stripe: an operation made through the gateway is recorded before its events are handled, and is
+# found by the id of its Stripe object (the token of its transaction).
+
+def _charge_captured(payment: Payment, charge: dict) -> Optional[Transaction]:
+    if payment.transactions.filter(kind=TransactionKind.CAPTURE, is_success=True).exists():
+        return None  # Captured by the gateway, or an earlier event (Stripe captures a charge only once)
+    captured = charge.get('amount_captured', charge['amount'] - charge.get('amount_refunded', 0))
+    return _create_transaction(payment, TransactionKind.CAPTURE, charge['id'], _amount(charge, captured), charge)
+
+
+def _charge_refunded(payment: Payment, charge: dict) -> Optional[Transaction]:
+    if not charge.get('captured', True):
+        # The refund of an uncaptured charge releases the authorization
+        if not payment.can_void():
+            return None
+        return _create_transaction(payment, TransactionKind.VOID, charge['id'], _amount(charge, charge['amount']),
+                                   charge)
+
+    # After a partial capture, the uncaptured part is included in amount_refunded
+    # (known only when the charge has amount_captured, that is in the recent versions of the Stripe API).
+    uncaptured = charge['amount'] - charge.get('amount_captured', charge['amount'])
+    refunded = _amount(charge, charge['amount_refunded'] - uncaptured)
+    recorded = Money(0, refunded.currency)
+    for txn in payment.transactions.filter(kind=TransactionKind.REFUND, is_success=True,
+                                           amount_currency=refunded.currency.code):
+        recorded += txn.amount
+    missing = refunded - recorded
+    if missing.amount <= 0 or not payment.can_refund():
+        return None
+    # The refunds are listed from the newest, the ones already recorded (by the gateway or an earlier event) are skipped
+    refund_ids = [refund['id'] for refund in charge.get('refunds', {}).get('data') or [{'id': charge['id']}]]
+    known = set(payment.transactions.filter(kind=TransactionKind.REFUND, token__in=refund_ids)
+                .values_list('token', flat=True))
+    new_ids = [refund_id for refund_id in refund_ids if refund_id not in known]
+    if not new_ids:
+        return None
+    return _create_transaction(payment, TransactionKind.REFUND, new_ids[0], missing, charge)
+
+
+# The events that change the payments. The other events are only stored.
+HANDLERS = {
+    'charge.captured': _charge_captured,
+    'charge.refunded': _charge_refunded,
+}
+
+
+def _charge_id(event: dict) -> Optional[str]:
+    obj = event.get('data', {}).get('object', {})
+    return obj.get('id') if obj.get('object') == 'charge' else None
+
+
+def process_events(batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Process a batch of the pending events, in order of arrival.
+
+    The payments are found by the charge id, that is the token of their transactions. The events of a charge
+    that has no payment (yet) are left pending, and retried up to MAX_ATTEMPTS times. Several workers can run
+    at the same time on databases that can skip locked rows (PostgreSQL): each takes its own batch.
+
+    :return: The number of events in the batch, 0 when there are no pending events.
+    """
+    with transaction.atomic():
+        pending = WebhookEvent.objects.filter(processed__isnull=True, attempts__lt=MAX_ATTEMPTS).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        events = list(pending[:batch_size])
+        if not events:
+            return 0
+
+        payloads = {event.pk: json.loads(event.payload) for event in events}
+        charge_ids = {_charge_id(payload) for payload in payloads.values()} - {None}
+        payment_ids: Dict[str, int] = dict(
+            Transaction.objects.filter(token__in=charge_ids).values_list('token', 'payment_id'))
+        payments = Payment.objects.select_for_update().in_bulk(set(payment_ids.values()))
+
+        processed = []
+        for event in events:
+            payload = payloads[event.pk]
+            handler = HANDLERS.get(event.type)
+            payment = payments.get(payment_ids.get(_charge_id(payload)))
+            if handler is not None and payment is None:
+                logger.warning('stripe webhook event without payment', event_id=event.event_id, type=event.type)
+                WebhookEvent.objects.filter(pk=event.pk).update(attempts=F('attempts') + 1, error=NO_PAYMENT_ERROR)
+                continue
+            try:
+                if handler is not None:
+                    with transaction.atomic():
+                        handler(payment, payload['data']['object'])
+                processed.append(event.pk)
+            except Exception as exc:
+                logger.exception('stripe webhook event failed', event_id=event.event_id, type=event.type)
+                if payment is not None:
+                    payment.refresh_from_db()
+                WebhookEvent.objects.filter(pk=event.pk).update(attempts=F('attempts') + 1, error=str(exc))
+
+        WebhookEvent.objects.filter(pk__in=processed).update(
+            processed=timezone.now(), attempts=F('attempts') + 1, error='')
+    return len(events)
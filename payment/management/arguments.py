@@ -0,0 +1,30 @@
+from argparse import ArgumentTypeError
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def start_of_day(value: str) -> datetime:
+    """ An argument type for the commands that take a date. """
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ArgumentTypeError('Expected a date like 2019-12-31, got {}'.format(value))
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def add_created_range_arguments(parser) -> None:
+    parser.add_argument('--created-from', type=start_of_day, help='The first day to export, like 2019-01-01.')
+    parser.add_argument('--created-until', type=start_of_day,
+                        help='The day after the last day to export, like 2020-01-01.')
+
+
+def filter_created_range(queryset, options):
+    if options['created_from']:
+        queryset = queryset.filter(created__gte=options['created_from'])
+    if options['created_until']:
+        queryset = queryset.filter(created__lt=options['created_until'])
+    return queryset
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ...changes import DEFAULT_PAGE_SIZE, acknowledge_changes, read_changes
+
+
+def transaction_row(transaction):
+    return {
+        'id': transaction.id,
+        'created': transaction.created,
+        'kind': transaction.kind,
+        'is_success': transaction.is_success,
+        'amount': transaction.amount.amount,
+        'currency': transaction.amount.currency.code,
+        'token': transaction.token,
+        'error': transaction.error,
+    }
+
+
+def payment_row(payment):
+    return {
+        'id': payment.id,
+        'created': payment.created,
+        'modified': payment.modified,
+        'active': payment.is_active,
+        'customer_email': payment.customer_email,
+        'total_amount': payment.total.amount,
+        'total_currency': payment.total.currency.code,
+        'captured_amount': payment.captured_amount.amount,
+        'captured_currency': payment.captured_amount.currency.code,
+        'charge_status': payment.charge_status,
+        'gateway': payment.gateway,
+        'token': payment.token,
+        'extra_data': payment.extra_data,
+        'new_transactions': [transaction_row(t) for t in payment.new_transactions],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Export the payments changed since the last export of the consumer, with their new transactions, '
+            'as JSON lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer', help='The name of the consumer, whose position in the feed is persisted.')
+        parser.add_argument('--output', help='The file to append to, the standard output by default.')
+        parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE)
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        out = open(options['output'], 'a', encoding='utf-8') if options['output'] else self.stdout
+        encoder = DjangoJSONEncoder()
+        count = 0
+        try:
+            while True:
+                page = read_changes(consumer, options['page_size'])
+                for payment in page.payments:
+                    out.write(encoder.encode(payment_row(payment)) + '\n')
+                out.flush()
+                # The changes are acknowledged once written, a crash can only repeat them.
+                acknowledge_changes(consumer, page.watermark)
+                count += len(page.payments)
+                if not page.has_more:
+                    break
+        finally:
+            if out is not self.stdout:
+                out.close()
+        self.stderr.write('Exported {} changed payments for {}'.format(count, consumer))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ..arguments import add_created_range_arguments, filter_created_range
+from ...columnar import COLUMNAR_FORMATS, DEFAULT_ROW_GROUP_SIZE, PARQUET, write_payments, write_transactions
+from ...export import DEFAULT_CHUNK_SIZE
+from ...models import Payment, Transaction
+
+EXPORTS = {
+    'payments': (Payment, write_payments),
+    'transactions': (Transaction, write_transactions),
+}
+
+
+class Command(BaseCommand):
+    help = 'Export the payments or the transactions to a Parquet or Arrow IPC file, for analytics.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('what', choices=sorted(EXPORTS))
+        parser.add_argument('output', help='The file to write to.')
+        parser.add_argument('--format', choices=COLUMNAR_FORMATS, default=PARQUET)
+        parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE,
+                            help='The number of rows per Parquet row group or Arrow record batch.')
+        add_created_range_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='The number of rows fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        model, write = EXPORTS[options['what']]
+        queryset = filter_created_range(model.objects.order_by('pk'), options)
+        try:
+            count = write(options['output'], queryset, file_format=options['format'],
+                          row_group_size=options['row_group_size'], chunk_size=options['chunk_size'])
+        except ImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Exported {} {} to {}'.format(count, options['what'], options['output']))
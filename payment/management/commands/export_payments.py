@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ..arguments import add_created_range_arguments
+from ...export import DEFAULT_CHUNK_SIZE
+from ...sharded_export import MODELS, SHARDED_FORMATS, CSV, Manifest, plan_shards, run_export
+
+
+class Command(BaseCommand):
+    help = ('Export the payments (or the transactions) in parallel, into one file per pk range shard '
+            'and a manifest. An interrupted export can be resumed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help='The directory of the shard files and of the manifest.')
+        parser.add_argument('--model', choices=sorted(MODELS), default='payments')
+        parser.add_argument('--format', choices=SHARDED_FORMATS, default=CSV)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='The number of processes.')
+        parser.add_argument('--shards', type=int, help='The number of shards, 4 per worker by default.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Export the shards that are not done, according to the manifest.')
+        add_created_range_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='The number of rows fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        directory = options['output_dir']
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = Manifest.load(directory)
+        if manifest is not None and not options['resume']:
+            raise CommandError('{} already has an export, use --resume to complete it'.format(directory))
+        if manifest is None:
+            if options['resume']:
+                raise CommandError('There is no export to resume in {}'.format(directory))
+            created_from, created_until = options['created_from'], options['created_until']
+            manifest = Manifest(model=options['model'], format=options['format'],
+                                created_from=created_from.isoformat() if created_from else None,
+                                created_until=created_until.isoformat() if created_until else None)
+            plan_shards(manifest, options['shards'] or 4 * max(options['workers'], 1))
+            manifest.save(directory)
+
+        def report(shard):
+            self.stdout.write('Shard {}: {} rows in {:.1f}s ({:.0f} rows/s)'.format(
+                shard.index, shard.rows, shard.seconds, shard.rows / shard.seconds if shard.seconds else 0))
+
+        started = time.monotonic()
+        rows_before = sum(shard.rows for shard in manifest.shards if shard.done)
+        try:
+            run_export(directory, manifest, options['workers'], options['chunk_size'], on_shard_done=report)
+        except ImportError as e:
+            raise CommandError(str(e))
+        seconds = time.monotonic() - started
+        rows = sum(shard.rows for shard in manifest.shards) - rows_before
+        self.stdout.write('Exported {} {} in {:.1f}s ({:.0f} rows/s)'.format(
+            rows, manifest.model, seconds, rows / seconds if seconds else 0))
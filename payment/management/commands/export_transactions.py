@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from ..arguments import add_created_range_arguments, filter_created_range
+from ...export import DEFAULT_CHUNK_SIZE, STREAMING_FORMATS, export_lines, export_rows, transaction_export_fields
+from ...models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Export the transactions, with the fields of their payment, as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(STREAMING_FORMATS), default='csv')
+        parser.add_argument('--output', help='The file to write to, the standard output by default.')
+        parser.add_argument('--gateway-response', action='store_true',
+                            help='Also export the gateway responses, which are large.')
+        add_created_range_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='The number of rows fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        transactions = filter_created_range(Transaction.objects.order_by('pk'), options)
+        fields = transaction_export_fields(options['gateway_response'])
+        lines = export_lines(fields, export_rows(transactions, fields, options['chunk_size']), options['format'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...gateways.stripe.webhooks import DEFAULT_BATCH_SIZE, process_events
+
+
+class Command(BaseCommand):
+    help = 'Process the pending webhook events, in batches: create their transactions and update their payments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep waiting for new events, instead of stopping when there are no pending events.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='With --follow, the seconds to wait when there are no pending events.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        count = 0
+        while True:
+            processed = process_events(batch_size)
+            count += processed
+            if processed < batch_size:
+                if not options['follow']:
+                    break
+                time.sleep(options['interval'])
+        self.stderr.write('Processed {} webhook events'.format(count))
@@ -0,0 +1,44 @@
+import json
+from dataclasses import asdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ..arguments import add_created_range_arguments
+from ...export import DEFAULT_CHUNK_SIZE
+from ...gateways.stripe.reconciliation import DEFAULT_WORKERS, Summary, reconcile
+
+
+class Command(BaseCommand):
+    help = ('Compare the stripe charges and refunds created in a date range with the transactions, and write the '
+            'mismatches, missing transactions and orphaned charges as JSON lines.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('gateway', help='The name of the stripe gateway in PAYMENT_GATEWAYS.')
+        add_created_range_arguments(parser)
+        parser.add_argument('--output', help='The file to write to, the standard output by default.')
+        parser.add_argument('--window-hours', type=float, default=24,
+                            help='The range is listed from stripe in windows of that many hours, concurrently.')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help='The number of windows that are listed at the same time.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='The number of transactions fetched from the database at once.')
+
+    def handle(self, *args, **options):
+        if not (options['created_from'] and options['created_until']):
+            raise CommandError('--created-from and --created-until are required')
+        summary = Summary()
+        problems = reconcile(options['gateway'], options['created_from'], options['created_until'],
+                             window=timedelta(hours=options['window_hours']), workers=options['workers'],
+                             chunk_size=options['chunk_size'], summary=summary)
+
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else self.stdout
+        try:
+            for problem in problems:
+                out.write(json.dumps(asdict(problem)) + '\n')
+        finally:
+            if out is not self.stdout:
+                out.close()
+        self.stderr.write(
+            'Checked {s.charges} charges and {s.refunds} refunds against {s.transactions} transactions: '
+            '{s.mismatch} mismatches, {s.missing} missing, {s.orphaned} orphaned'.format(s=summary))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ...gateways.netaxept.fake_server import FakeNetaxept
+
+
+class Command(BaseCommand):
+    help = ('Run a fake of the Netaxept API, for load tests and benchmarks: point the base_url of the netaxept '
+            'gateway at it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0, help='The seconds that each response is delayed.')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='The share of the requests that get an HTTP 500 error, between 0 and 1.')
+        parser.add_argument('--seed', type=int, help='Of the random errors.')
+
+    def handle(self, *args, **options):
+        server = FakeNetaxept(host=options['host'], port=options['port'], latency=options['latency'],
+                              error_rate=options['error_rate'], seed=options['seed'])
+        self.stderr.write('Fake netaxept listening on {}'.format(server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ...gateways.netaxept.sweeper import DEFAULT_AGE, DEFAULT_WORKERS, sweep
+
+
+class Command(BaseCommand):
+    help = ('Query netaxept for the payments that were registered but not authorized, record the authorization of '
+            'the ones that were authorized, and deactivate the ones that were abandoned in the terminal.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('gateway', nargs='?', default='netaxept',
+                            help='The name of the netaxept gateway in PAYMENT_GATEWAYS.')
+        parser.add_argument('--minutes', type=float, default=DEFAULT_AGE.total_seconds() / 60,
+                            help='Only the payments registered more than that many minutes ago.')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help='The number of payments queried from netaxept at the same time.')
+
+    def handle(self, *args, **options):
+        summary = sweep(options['gateway'], age=timedelta(minutes=options['minutes']), workers=options['workers'])
+        self.stderr.write(
+            'Checked {s.checked} registrations: {s.authorized} authorized, {s.abandoned} abandoned, '
+            '{s.skipped} skipped, {s.errors} errors'.format(s=summary))
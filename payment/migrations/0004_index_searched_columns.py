@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-19 04:52
+
+from django.conf import settings
+from django.db import migrations, models
+import djmoney.models.fields
+
+
+def create_trigram_index(apps, schema_editor):
+    """Only on postgresql, and when PAYMENT_TRIGRAM_SEARCH is enabled (creating the extension needs privileges)."""
+    if schema_editor.connection.vendor != 'postgresql' or not getattr(settings, 'PAYMENT_TRIGRAM_SEARCH', False):
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS payment_payment_customer_email_trgm '
+                          'ON payment_payment USING gin (customer_email gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS payment_payment_customer_email_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0003_index_token_and_add_transaction_kind'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='customer_email',
+            field=models.EmailField(db_index=True, max_length=254, verbose_name='customer email'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='total',
+            field=djmoney.models.fields.MoneyField(db_index=True, decimal_places=2, max_digits=12, verbose_name='total'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='token',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=128, verbose_name='token'),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
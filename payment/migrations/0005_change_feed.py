@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0004_index_searched_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeFeedConsumer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='name')),
+                ('watermark_modified', models.DateTimeField(blank=True, null=True, verbose_name='watermark modified')),
+                ('watermark_id', models.PositiveIntegerField(default=0, verbose_name='watermark id')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+            ],
+            options={
+                'verbose_name': 'change feed consumer',
+                'verbose_name_plural': 'change feed consumers',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['modified', 'id'], name='payment_modified_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0005_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gateway', models.CharField(max_length=255, verbose_name='gateway')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='event id')),
+                ('type', models.CharField(max_length=100, verbose_name='type')),
+                ('payload', models.TextField(verbose_name='payload')),
+                ('received', models.DateTimeField(auto_now_add=True, verbose_name='received')),
+                ('processed', models.DateTimeField(blank=True, null=True, verbose_name='processed')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+            ],
+            options={
+                'verbose_name': 'webhook event',
+                'verbose_name_plural': 'webhook events',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['processed', 'id'], name='webhookevent_pending_idx'),
+        ),
+    ]
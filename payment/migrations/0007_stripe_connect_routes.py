@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:20
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0006_webhook_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeConnectRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seller', models.CharField(max_length=100, unique=True, verbose_name='seller')),
+                ('destination', models.CharField(max_length=255, verbose_name='destination account')),
+                ('percent', models.PositiveIntegerField(validators=[django.core.validators.MaxValueValidator(100)], verbose_name='percent')),
+            ],
+            options={
+                'verbose_name': 'stripe connect route',
+                'verbose_name_plural': 'stripe connect routes',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0007_stripe_connect_routes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['gateway', 'charge_status', 'created'], name='payment_gateway_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0008_index_payments_by_gateway_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='auto_auth',
+            field=models.BooleanField(default=True, verbose_name='auto auth'),
+        ),
+    ]
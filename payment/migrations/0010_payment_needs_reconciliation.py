@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payment', '0009_transaction_auto_auth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='needs_reconciliation',
+            field=models.BooleanField(default=False, verbose_name='needs reconciliation'),
+        ),
+    ]
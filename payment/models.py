@@ -3,7 +3,7 @@ from operator import attrgetter
 
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models import CASCADE
+from django.db.models import CASCADE, Count, Exists, OuterRef
 from django.utils.translation import ugettext_lazy as _
 from djmoney.models.fields import MoneyField
 from moneyed import Money
@@ -17,6 +17,20 @@ from . import (
 )
 
 
+class PaymentQuerySet(models.QuerySet):
+    def with_transaction_summary(self):
+        """Annotate each payment with what is needed to know its capabilities, without querying its transactions.
+
+        - transaction_count: the number of transactions of the payment.
+        - has_successful_auth: used by is_authorized (and thus by can_capture and can_void).
+        """
+        return self.annotate(
+            transaction_count=Count('transactions'),
+            has_successful_auth=Exists(Transaction.objects.filter(
+                payment=OuterRef('pk'), kind=TransactionKind.AUTH, is_success=True)),
+        )
+
+
 class Payment(models.Model):
     """A model that represents a single payment.
 
@@ -39,7 +53,7 @@ class Payment(models.Model):
     charge_status = models.CharField(_('charge status'), max_length=20, choices=ChargeStatus.CHOICES,
                                      default=ChargeStatus.NOT_CHARGED)
     token = models.CharField(_('token'), max_length=128, blank=True, default="", db_index=True)
-    total = MoneyField(_('total'), max_digits=12, decimal_places=2)
+    total = MoneyField(_('total'), max_digits=12, decimal_places=2, db_index=True)
     captured_amount = MoneyField(_('captured amount'), max_digits=12, decimal_places=2)
 
     cc_first_digits = models.CharField(_('cc first digits'), max_length=6, blank=True, default="")
@@ -51,15 +65,25 @@ class Payment(models.Model):
     cc_exp_year = models.PositiveIntegerField(_('cc exp year'), validators=[MinValueValidator(1000)], null=True,
                                               blank=True)
 
-    customer_email = models.EmailField(_('customer email'), )
+    customer_email = models.EmailField(_('customer email'), db_index=True)
 
     customer_ip_address = models.GenericIPAddressField(_('customer ip address'), blank=True, null=True)
     extra_data = models.TextField(_('extra data'), blank=True, default="")
+    # Set when a transaction in another currency could not be applied to the payment, see utils._gateway_postprocess
+    needs_reconciliation = models.BooleanField(_('needs reconciliation'), default=False)
+
+    objects = PaymentQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('payment')
         verbose_name_plural = _('payments')
         ordering = ("pk",)
+        indexes = [
+            # For the change feed, see changes.py
+            models.Index(fields=['modified', 'id'], name='payment_modified_id_idx'),
+            # For the sweeper of the abandoned netaxept registrations, see gateways/netaxept/sweeper.py
+            models.Index(fields=['gateway', 'charge_status', 'created'], name='payment_gateway_status_idx'),
+        ]
 
     def __str__(self):
         return _('Payment {} ({})').format(self.id, self.get_charge_status_display())
@@ -76,7 +100,7 @@ class Payment(models.Model):
         return max(self.transactions.all(), default=None, key=attrgetter("pk"))
 
     def get_authorized_amount(self):
-        money = Money(0, self.total.currency)
+        authorized = Money(0, self.total.currency)
 
         # Query all the transactions which should be prefetched
         # to optimize db queries
@@ -85,17 +109,18 @@ class Payment(models.Model):
         # There is no authorized amount anymore when capture is succeeded
         # since capture can only be made once, even it is a partial capture
         if any([txn.kind == TransactionKind.CAPTURE and txn.is_success for txn in transactions]):
-            return money
+            return authorized
 
-        # Filter the succeeded auth transactions
-        authorized_txns = [txn for txn in transactions if txn.kind == TransactionKind.AUTH and txn.is_success]
+        # Filter the succeeded auth transactions, the ones in another currency are left to the reconciliation
+        authorized_txns = [txn for txn in transactions if txn.kind == TransactionKind.AUTH and txn.is_success
+                           and txn.amount.currency == self.total.currency]
 
         for txn in authorized_txns:
-            money += txn.amount
+            authorized += txn.amount
 
         # If multiple partial capture is supported later though it's unlikely,
         # the authorized amount should exclude the already captured amount here
-        return money
+        return authorized
 
     def get_charge_amount(self):
         """Retrieve the maximum capture possible."""
@@ -103,6 +128,8 @@ class Payment(models.Model):
 
     @property
     def is_authorized(self):
+        if hasattr(self, 'has_successful_auth'):  # See PaymentQuerySet.with_transaction_summary
+            return self.has_successful_auth
         return any([txn.kind == TransactionKind.AUTH and txn.is_success for txn in self.transactions.all()])
 
     @property
@@ -162,12 +189,14 @@ class Transaction(models.Model):
     created = models.DateTimeField(_('created'), auto_now_add=True, editable=False)
     payment = models.ForeignKey(Payment, related_name="transactions", on_delete=CASCADE,
                                 verbose_name=_('payment'))
-    token = models.CharField(_('token'), max_length=128, blank=True, default="")
+    token = models.CharField(_('token'), max_length=128, blank=True, default="", db_index=True)
     kind = models.CharField(_('kind'), max_length=10, choices=TransactionKind.CHOICES)
     is_success = models.BooleanField(_('is success'), default=False)
     amount = MoneyField(_('amount'), max_digits=12, decimal_places=2)
     error = models.CharField(_('error'), max_length=256, blank=True, null=True)
     gateway_response = models.TextField(_('gateway response'), )  # JSON or XML
+    # Of a registration: False when the gateway does not authorize the payment (see netaxept's register_payment)
+    auto_auth = models.BooleanField(_('auto auth'), default=True)
 
     class Meta:
         verbose_name = _('transaction')
@@ -177,3 +206,58 @@ class Transaction(models.Model):
     def __repr__(self):
         return "Transaction(type=%s, is_success=%s, created=%s)" % \
                (self.kind, self.is_success, self.created)
+
+
+class ChangeFeedConsumer(models.Model):
+    """The position of a consumer of the change feed, see changes.py."""
+
+    name = models.CharField(_('name'), max_length=100, unique=True)
+    watermark_modified = models.DateTimeField(_('watermark modified'), null=True, blank=True)
+    watermark_id = models.PositiveIntegerField(_('watermark id'), default=0)
+    updated = models.DateTimeField(_('updated'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('change feed consumer')
+        verbose_name_plural = _('change feed consumers')
+
+    def __str__(self):
+        return self.name
+
+
+class WebhookEvent(models.Model):
+    """An event pushed by a gateway, stored as received until it is processed. See gateways/stripe/webhooks.py."""
+
+    gateway = models.CharField(_('gateway'), max_length=255)
+    event_id = models.CharField(_('event id'), max_length=255, unique=True)
+    type = models.CharField(_('type'), max_length=100)
+    payload = models.TextField(_('payload'))  # JSON
+    received = models.DateTimeField(_('received'), auto_now_add=True)
+    processed = models.DateTimeField(_('processed'), null=True, blank=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    error = models.TextField(_('error'), blank=True, default="")
+
+    class Meta:
+        verbose_name = _('webhook event')
+        verbose_name_plural = _('webhook events')
+        indexes = [
+            # For the workers, that process the events in order of arrival
+            models.Index(fields=['processed', 'id'], name='webhookevent_pending_idx'),
+        ]
+
+    def __str__(self):
+        return '{} {}'.format(self.type, self.event_id)
+
+
+class StripeConnectRoute(models.Model):
+    """Where the charges of a seller are transferred with stripe connect, see gateways/stripe/connect.py."""
+
+    seller = models.CharField(_('seller'), max_length=100, unique=True)
+    destination = models.CharField(_('destination account'), max_length=255)
+    percent = models.PositiveIntegerField(_('percent'), validators=[MaxValueValidator(100)])
+
+    class Meta:
+        verbose_name = _('stripe connect route')
+        verbose_name_plural = _('stripe connect routes')
+
+    def __str__(self):
+        return '{} → {} ({}%)'.format(self.seller, self.destination, self.percent)
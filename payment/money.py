@@ -0,0 +1,102 @@
+"""
+A compact money representation for the payment state machine.
+
+Amounts are held as an integer number of minor units (cents for CHF, yen for JPY) so that
+additions and comparisons are plain integer operations instead of Decimal arithmetic.
+Money objects are converted to and from this representation at the edges of the API only.
+"""
+from decimal import Decimal
+
+from moneyed import Money
+
+from .currencies import get_exponent
+
+_SCALES = {exponent: Decimal(10) ** exponent for exponent in range(5)}
+
+
+class MinorMoney:
+    """ An integer amount of minor units, together with its currency code.
+
+    Instances are meant to be immutable, operations return new instances.
+    """
+
+    __slots__ = ('amount', 'currency')
+
+    def __init__(self, amount: int, currency: str) -> None:
+        self.amount = amount
+        self.currency = currency
+
+    @classmethod
+    def zero(cls, currency: str) -> 'MinorMoney':
+        return cls(0, currency)
+
+    @classmethod
+    def from_decimal(cls, amount: Decimal, currency: str) -> 'MinorMoney':
+        """
+        :raises ValueError: If the amount has more decimal places than the currency allows.
+        """
+        scaled = amount * _SCALES[get_exponent(currency)]
+        minor = int(scaled)
+        if minor != scaled:
+            raise ValueError('{} has more decimal places than {} allows'.format(amount, currency))
+        return cls(minor, currency)
+
+    @classmethod
+    def from_money(cls, money: Money) -> 'MinorMoney':
+        """
+        :raises ValueError: If the amount has more decimal places than the currency allows.
+        """
+        return cls.from_decimal(money.amount, money.currency.code)
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.amount).scaleb(-get_exponent(self.currency))
+
+    def to_money(self) -> Money:
+        return Money(self.to_decimal(), self.currency)
+
+    def _raise_incompatible(self, other) -> None:
+        if type(other) is not MinorMoney:
+            raise TypeError('Cannot combine a MinorMoney and a {}'.format(other.__class__.__name__))
+        raise TypeError('Cannot combine amounts in {} and {}'.format(self.currency, other.currency))
+
+    def __add__(self, other: 'MinorMoney') -> 'MinorMoney':
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return MinorMoney(self.amount + other.amount, self.currency)
+
+    def __sub__(self, other: 'MinorMoney') -> 'MinorMoney':
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return MinorMoney(self.amount - other.amount, self.currency)
+
+    def __neg__(self) -> 'MinorMoney':
+        return MinorMoney(-self.amount, self.currency)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MinorMoney) and self.amount == other.amount and self.currency == other.currency
+
+    def __hash__(self) -> int:
+        return hash((self.amount, self.currency))
+
+    def __lt__(self, other: 'MinorMoney') -> bool:
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return self.amount < other.amount
+
+    def __le__(self, other: 'MinorMoney') -> bool:
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return self.amount <= other.amount
+
+    def __gt__(self, other: 'MinorMoney') -> bool:
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return self.amount > other.amount
+
+    def __ge__(self, other: 'MinorMoney') -> bool:
+        if type(other) is not MinorMoney or self.currency != other.currency:
+            self._raise_incompatible(other)
+        return self.amount >= other.amount
+
+    def __repr__(self) -> str:
+        return 'MinorMoney(amount={}, currency={})'.format(self.amount, self.currency)
@@ -0,0 +1,185 @@
+"""
+Changelists for tables with tens of millions of rows.
+
+- Counts come from the PostgreSQL planner estimates instead of COUNT(*).
+- Pages are fetched with keyset pagination on (created, id) instead of OFFSET.
+- Date drill-down (date_hierarchy and its date-distinct queries) is replaced by bounded range filters.
+
+Select the behavior per admin class with LargeTableAdminMixin.
+"""
+import json
+from datetime import timedelta
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+# Below this many rows an exact count is cheap enough, and more accurate than an estimate.
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def estimate_count(queryset) -> int:
+    """
+    Return the number of rows of the queryset, as estimated by the PostgreSQL planner.
+    Small counts, and counts on other databases, are exact.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            estimate = int(row[0]) if row else 0
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+
+    if estimate < EXACT_COUNT_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+def format_cursor(obj) -> str:
+    """ The position of an object in the newest first order, see older_than. """
+    return '{}_{}'.format(obj.created.isoformat(), obj.pk)
+
+
+def parse_cursor(value: str):
+    created, _, pk = value.rpartition('_')
+    try:
+        created = parse_datetime(created)
+        pk = int(pk)
+    except ValueError:
+        created = None
+    if created is None:
+        raise IncorrectLookupParameters('Invalid cursor {}'.format(value))
+    return created, pk
+
+
+def older_than(cursor: str) -> Q:
+    """ The filter for the objects that come after the cursor in the newest first order. """
+    created, pk = parse_cursor(cursor)
+    return Q(created__lt=created) | Q(created=created, pk__lt=pk)
+
+
+class LargeTableChangeList(ChangeList):
+    """
+    When the model admin has keyset_pagination enabled and the list is in its default order (newest first),
+    the pages are fetched with keyset pagination and the list is navigated with newer / older links.
+    In any other order the regular pagination applies. The list is not editable with keyset pagination.
+    """
+
+    def get_queryset(self, request):
+        # The cursors are not filters, and should not be preserved by the links to other filters or orderings.
+        self.params.pop(AFTER_VAR, None)
+        self.params.pop(BEFORE_VAR, None)
+        return super().get_queryset(request)
+
+    @property
+    def keyset_pagination(self):
+        return getattr(self.model_admin, 'keyset_pagination', False) and ORDER_VAR not in self.params
+
+    def get_results(self, request):
+        if not self.keyset_pagination:
+            self.previous_url = self.next_url = None
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        after, before = request.GET.get(AFTER_VAR), request.GET.get(BEFORE_VAR)
+
+        queryset = self.queryset.order_by('-created', '-pk')
+        if before:
+            created, pk = parse_cursor(before)
+            queryset = self.queryset.order_by('created', 'pk').filter(
+                Q(created__gt=created) | Q(created=created, pk__gt=pk))
+        elif after:
+            queryset = queryset.filter(older_than(after))
+
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        result_list = result_list[:self.list_per_page]
+        if before:
+            result_list.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = bool(after), has_more
+
+        self.previous_url = self.get_query_string({BEFORE_VAR: format_cursor(result_list[0])}, [AFTER_VAR]) \
+            if has_newer and result_list else None
+        self.next_url = self.get_query_string({AFTER_VAR: format_cursor(result_list[-1])}, [BEFORE_VAR]) \
+            if has_older and result_list else None
+
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_newer or has_older
+        self.paginator = paginator
+
+
+class CreatedRangeFilter(admin.SimpleListFilter):
+    """ Bounded ranges of creation dates, a cheap replacement for date_hierarchy. """
+    title = _('created')
+    parameter_name = 'created_range'
+
+    # The number of days, up to the end of today.
+    ranges = {
+        'today': (_('Today'), 1),
+        '7d': (_('Past 7 days'), 7),
+        '30d': (_('Past 30 days'), 30),
+        '365d': (_('Past year'), 365),
+    }
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, (label, _days) in self.ranges.items()]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.ranges:
+            return queryset
+        _label, days = self.ranges[self.value()]
+        end = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        start = end - timedelta(days=days)
+        return queryset.filter(created__gte=start, created__lt=end)
+
+
+class LargeTableAdminMixin:
+    """
+    Model admin options for very large tables. The model must have a created field.
+
+    Use CreatedRangeFilter in the list_filter, instead of a date_hierarchy.
+    """
+    estimated_count = True
+    keyset_pagination = True
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.estimated_count:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
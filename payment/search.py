@@ -0,0 +1,98 @@
+"""
+Search for payments and transactions, by recognizing the shape of the search term.
+
+Instead of OR-ing icontains lookups over many columns (which always scans the whole table),
+each shape of search term is routed to an exact or a prefix lookup on an indexed column:
+
+- A number (of at most 18 digits, to fit in a bigint) is a payment id.
+- An amount, optionally with a currency code ("12.50", "12.50 CHF", "CHF 12"), is a payment total.
+- An email address is a customer email, a partial email ("john@exa") is an email prefix.
+- Anything else is a gateway token prefix (or a customer email prefix).
+
+On PostgreSQL, partial emails can also be matched with trigram similarity, see PAYMENT_TRIGRAM_SEARCH.
+"""
+import re
+from decimal import Decimal
+from enum import Enum
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+
+class SearchShape(Enum):
+    ID = 'id'
+    AMOUNT = 'amount'
+    EMAIL = 'email'
+    PARTIAL_EMAIL = 'partial_email'
+    TOKEN = 'token'
+
+
+_id_re = re.compile(r'^\d{1,18}$')  # Longer numbers are token prefixes
+_amount_re = re.compile(
+    r'^(?:(?P<currency_before>[A-Za-z]{3})\s*)?(?P<amount>\d+(?:\.\d{1,4})?)(?:\s*(?P<currency_after>[A-Za-z]{3}))?$')
+_email_re = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+
+def get_search_shape(term: str) -> SearchShape:
+    if _id_re.match(term):
+        return SearchShape.ID
+    match = _amount_re.match(term)
+    # A bare integer is an id, an amount needs a decimal point or a currency code.
+    if match and ('.' in match.group('amount') or match.group('currency_before') or match.group('currency_after')):
+        return SearchShape.AMOUNT
+    if _email_re.match(term):
+        return SearchShape.EMAIL
+    if '@' in term:
+        return SearchShape.PARTIAL_EMAIL
+    return SearchShape.TOKEN
+
+
+def _parse_amount(term: str):
+    match = _amount_re.match(term)
+    currency = match.group('currency_before') or match.group('currency_after')
+    return Decimal(match.group('amount')), currency.upper() if currency else None
+
+
+def trigram_search_enabled() -> bool:
+    return getattr(settings, 'PAYMENT_TRIGRAM_SEARCH', False) and connection.vendor == 'postgresql'
+
+
+def _email_prefix_filter(term: str) -> Q:
+    q = Q(customer_email__startswith=term)
+    if term != term.lower():
+        q |= Q(customer_email__startswith=term.lower())
+    if trigram_search_enabled():
+        q |= Q(customer_email__trigram_similar=term)
+    return q
+
+
+def payment_search_filter(term: str) -> Q:
+    """ Return the filter that finds the payments matching the search term. """
+    term = term.strip()
+    shape = get_search_shape(term)
+    if shape == SearchShape.ID:
+        return Q(pk=int(term))
+    elif shape == SearchShape.AMOUNT:
+        amount, currency = _parse_amount(term)
+        q = Q(total=amount)
+        if currency:
+            q &= Q(total_currency=currency)
+        return q
+    elif shape == SearchShape.EMAIL:
+        q = Q(customer_email=term)
+        if term != term.lower():
+            q |= Q(customer_email=term.lower())
+        return q
+    elif shape == SearchShape.PARTIAL_EMAIL:
+        return _email_prefix_filter(term)
+    else:
+        return Q(token__startswith=term) | _email_prefix_filter(term)
+
+
+def transaction_search_filter(term: str) -> Q:
+    """ Return the filter that finds the transactions matching the search term. """
+    term = term.strip()
+    if get_search_shape(term) == SearchShape.ID:
+        return Q(payment_id=int(term))
+    return Q(token__startswith=term)
@@ -0,0 +1,164 @@
+"""
+Export a whole table in parallel: the pk range is split into shards, that are exported by a pool of processes
+(each with its own database connection) into one file per shard.
+
+A manifest in the output directory records the plan and the shards that are done, so that an interrupted
+export can be resumed: only the shards that are not done are exported again.
+
+See the export_payments management command.
+"""
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from django.db import connections
+from django.db.models import Max, Min
+
+from .columnar import PAYMENT_COLUMNAR_FIELDS, TRANSACTION_COLUMNAR_FIELDS, write_columnar
+from .export import DEFAULT_CHUNK_SIZE, PAYMENT_EXPORT_FIELDS, TRANSACTION_EXPORT_FIELDS, export_lines, export_rows
+from .models import Payment, Transaction
+from .workers import setup_worker
+
+CSV = 'csv'
+JSONL = 'jsonl'
+PARQUET = 'parquet'
+SHARDED_FORMATS = [CSV, JSONL, PARQUET]
+
+MODELS = {
+    'payments': Payment,
+    'transactions': Transaction,
+}
+
+MANIFEST_NAME = 'manifest.json'
+
+
+@dataclass
+class Shard:
+    index: int
+    start: int  # The first pk of the shard
+    end: int  # The pk after the last pk of the shard
+    file: str
+    done: bool = False
+    rows: int = 0
+    seconds: float = 0
+
+
+@dataclass
+class Manifest:
+    model: str
+    format: str
+    created_from: Optional[str] = None  # ISO datetimes
+    created_until: Optional[str] = None
+    shards: List[Shard] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional['Manifest']:
+        path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        data['shards'] = [Shard(**shard) for shard in data['shards']]
+        return cls(**data)
+
+    def save(self, directory: str) -> None:
+        path = os.path.join(directory, MANIFEST_NAME)
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(path + '.part', path)
+
+
+def base_queryset(model: str, created_from: Optional[str] = None, created_until: Optional[str] = None):
+    queryset = MODELS[model].objects.all()
+    if created_from:
+        queryset = queryset.filter(created__gte=created_from)
+    if created_until:
+        queryset = queryset.filter(created__lt=created_until)
+    return queryset
+
+
+def plan_shards(manifest: Manifest, shard_count: int) -> None:
+    """ Split the pk range of the rows to export into shard_count ranges of the same size. """
+    bounds = base_queryset(manifest.model, manifest.created_from, manifest.created_until) \
+        .aggregate(first=Min('pk'), last=Max('pk'))
+    manifest.shards = []
+    if bounds['first'] is None:
+        return
+    first, end = bounds['first'], bounds['last'] + 1
+    size = -(-(end - first) // shard_count)  # Rounded up
+    for index, start in enumerate(range(first, end, size)):
+        manifest.shards.append(Shard(index=index, start=start, end=min(start + size, end),
+                                     file='{}-{:05d}.{}'.format(manifest.model, index, manifest.format)))
+
+
+def export_shard(directory: str, manifest: Manifest, shard: Shard, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Shard:
+    """
+    Export the rows of the shard. The file is written under a temporary name and renamed once complete.
+    Runs in the worker processes.
+    """
+    started = time.monotonic()
+    queryset = base_queryset(manifest.model, manifest.created_from, manifest.created_until) \
+        .filter(pk__gte=shard.start, pk__lt=shard.end).order_by('pk')
+    path = os.path.join(directory, shard.file)
+
+    if manifest.format == PARQUET:
+        fields = PAYMENT_COLUMNAR_FIELDS if manifest.model == 'payments' else TRANSACTION_COLUMNAR_FIELDS
+        rows = write_columnar(path + '.part', queryset, fields, chunk_size=chunk_size)
+    else:
+        fields = PAYMENT_EXPORT_FIELDS if manifest.model == 'payments' else TRANSACTION_EXPORT_FIELDS
+        counted = _Counter(export_rows(queryset, fields, chunk_size))
+        with open(path + '.part', 'w', newline='', encoding='utf-8') as f:
+            f.writelines(export_lines(fields, counted, manifest.format))
+        rows = counted.count
+    os.replace(path + '.part', path)
+
+    shard.done, shard.rows, shard.seconds = True, rows, time.monotonic() - started
+    return shard
+
+
+class _Counter:
+    def __init__(self, rows: Iterable[tuple]):
+        self.rows = rows
+        self.count = 0
+
+    def __iter__(self) -> Iterator[tuple]:
+        for row in self.rows:
+            self.count += 1
+            yield row
+
+
+def run_export(directory: str, manifest: Manifest, workers: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               on_shard_done: Callable[[Shard], None] = lambda shard: None) -> None:
+    """
+    Export the shards that are not done. The manifest is saved after each shard.
+
+    :param workers: The number of processes, with 1 the shards are exported in this process.
+    """
+    pending = [shard for shard in manifest.shards
+               if not (shard.done and os.path.exists(os.path.join(directory, shard.file)))]
+
+    def done(shard: Shard):
+        manifest.shards[shard.index] = shard
+        manifest.save(directory)
+        on_shard_done(shard)
+
+    if not pending:
+        return
+    if workers <= 1:
+        for shard in pending:
+            done(export_shard(directory, manifest, shard, chunk_size))
+        return
+
+    # The workers are started with spawn, which gives them their own database connections.
+    # They set django up again (with the same settings module, on the same databases), before they load this module.
+    context = multiprocessing.get_context('spawn')
+    database_names = {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=setup_worker,
+                             initargs=(database_names,)) as executor:
+        futures = [executor.submit(export_shard, directory, manifest, shard, chunk_size) for shard in pending]
+        for future in as_completed(futures):
+            done(future.result())
@@ -1,3 +1,9 @@
+from django.urls import path
+
+from .gateways.stripe import webhooks as stripe_webhooks
+
 app_name = 'payment'
 
-urlpatterns = []  # type: ignore
+urlpatterns = [
+    path('stripe/<str:gateway>/webhook/', stripe_webhooks.webhook, name='stripe_webhook'),
+]
@@ -142,10 +142,26 @@ def clean_capture(payment: Payment, amount: Money):
         raise PaymentError("Amount should be a positive number.")
     if not payment.can_capture():
         raise PaymentError("This payment cannot be captured.")
-    if amount > payment.total or amount > (payment.total - payment.captured_amount):
+    if amount > payment.total or amount > (payment.total - _captured_amount(payment)):
         raise PaymentError("Unable to charge more than un-captured amount.")
 
 
+def clean_void(payment: Payment):
+    """Check if payment can be voided."""
+    if not payment.can_void():
+        raise PaymentError("Only pre-authorized transactions can be voided.")
+
+
+def clean_refund(payment: Payment, amount: Money):
+    """Check if payment can be refunded."""
+    if not payment.can_refund():
+        raise PaymentError("This payment cannot be refunded.")
+    if amount.amount <= 0:
+        raise PaymentError("Amount should be a positive number.")
+    if amount > _captured_amount(payment):
+        raise PaymentError("Cannot refund more than captured")
+
+
 def clean_authorize(payment: Payment):
     """Check if payment can be authorized."""
     if not payment.can_authorize():
@@ -231,17 +247,33 @@ def validate_gateway_response(response: GatewayResponse):
         raise GatewayError("Gateway response needs to be json serializable")
 
 
+def _captured_amount(payment: Payment) -> Money:
+    if payment.captured_amount is None:
+        return Money(0, payment.total.currency)
+    return payment.captured_amount
+
+
 @transaction.atomic
 def _gateway_postprocess(transaction, payment):
+    """Update the payment after a successful operation, and its modified time in any case.
+
+    It is called once the money has moved at the gateway, so it does not raise on the
+    amounts. A transaction in another currency than the payment is kept as reported, and
+    the payment is flagged for reconciliation instead of being updated.
+    """
     transaction_kind = transaction.kind
 
-    if transaction_kind == TransactionKind.CAPTURE:
-        if payment.captured_amount is not None:
-            payment.captured_amount += transaction.amount
-        else:
-            payment.captured_amount = transaction.amount
+    if transaction.amount.currency != payment.total.currency:
+        logger.error(
+            "Transaction in %s for a payment in %s", transaction.amount.currency, payment.total.currency
+        )
+        payment.needs_reconciliation = True
+        payment.save()
+
+    elif transaction_kind == TransactionKind.CAPTURE:
+        payment.captured_amount = _captured_amount(payment) + transaction.amount
 
-        if payment.get_charge_amount().amount <= 0:
+        if (payment.total - payment.captured_amount).amount <= 0:
             payment.charge_status = ChargeStatus.FULLY_CHARGED
         else:
             payment.charge_status = ChargeStatus.PARTIALLY_CHARGED
@@ -253,13 +285,47 @@ def _gateway_postprocess(transaction, payment):
         payment.save()
 
     elif transaction_kind == TransactionKind.REFUND:
-        payment.captured_amount -= transaction.amount
+        payment.captured_amount = _captured_amount(payment) - transaction.amount
         payment.charge_status = ChargeStatus.PARTIALLY_REFUNDED
         if payment.captured_amount.amount <= 0:
             payment.charge_status = ChargeStatus.FULLY_REFUNDED
             payment.is_active = False
         payment.save()
 
+    else:
+        # Only the modified time, the new transaction is a change of the payment for the change feed.
+        payment.save(update_fields=["modified"])
+
+
+def _call_gateway_locked(operation_type, payment, payment_token, check, **extra_params) -> Transaction:
+    """Call the gateway and postprocess its transaction with the payment row locked.
+
+    The webhooks handle the events of the payment under the same lock, so they find
+    the transaction of the operation instead of recording it a second time. The payment
+    is read again under the lock and checked with `check`, as a webhook may have changed
+    it since the caller loaded it, and the caller's instance gets the result.
+    """
+    error = None
+    with transaction.atomic():
+        locked_payment = Payment.objects.select_for_update().get(pk=payment.pk)
+        try:
+            check(locked_payment)
+            payment_transaction = call_gateway(
+                operation_type=operation_type,
+                payment=locked_payment,
+                payment_token=payment_token,
+                **extra_params,
+            )
+        except PaymentError as e:
+            error = e  # Raised outside of the atomic block, to keep the failed transaction
+        else:
+            _gateway_postprocess(payment_transaction, locked_payment)
+    for field in Payment._meta.concrete_fields:
+        setattr(payment, field.attname, getattr(locked_payment, field.attname))
+    if error is not None:
+        raise error
+    return payment_transaction
+
 
 @require_active_payment
 def gateway_process_payment(payment: Payment, payment_token: str, **extras) -> Transaction:
@@ -283,7 +349,10 @@ def gateway_authorize(payment: Payment, payment_token: str) -> Transaction:
      - payment_token: One-time-use reference to payment information.
     """
     clean_authorize(payment)
-    return call_gateway(operation_type=OperationType.AUTH, payment=payment, payment_token=payment_token)
+    transaction = call_gateway(operation_type=OperationType.AUTH, payment=payment, payment_token=payment_token)
+
+    _gateway_postprocess(transaction, payment)
+    return transaction
 
 
 @require_active_payment
@@ -300,21 +369,18 @@ def gateway_capture(payment: Payment, amount: Money = None) -> Transaction:
         raise PaymentError("Cannot capture unauthorized transaction")
     payment_token = auth_transaction.token
 
-    transaction = call_gateway(
+    return _call_gateway_locked(
         operation_type=OperationType.CAPTURE,
         payment=payment,
         payment_token=payment_token,
+        check=lambda locked_payment: clean_capture(locked_payment, amount),
         amount=amount,
     )
 
-    _gateway_postprocess(transaction, payment)
-    return transaction
-
 
 @require_active_payment
 def gateway_void(payment) -> Transaction:
-    if not payment.can_void():
-        raise PaymentError("Only pre-authorized transactions can be voided.")
+    clean_void(payment)
 
     auth_transaction = payment.transactions.filter(
         kind=TransactionKind.AUTH, is_success=True
@@ -323,13 +389,10 @@ def gateway_void(payment) -> Transaction:
         raise PaymentError("Cannot void unauthorized transaction")
     payment_token = auth_transaction.token
 
-    transaction = call_gateway(
-        operation_type=OperationType.VOID, payment=payment, payment_token=payment_token
+    return _call_gateway_locked(
+        operation_type=OperationType.VOID, payment=payment, payment_token=payment_token, check=clean_void
     )
 
-    _gateway_postprocess(transaction, payment)
-    return transaction
-
 
 @require_active_payment
 def gateway_refund(payment, amount: Money = None) -> Transaction:
@@ -340,13 +403,7 @@ def gateway_refund(payment, amount: Money = None) -> Transaction:
         # If no amount is specified, refund the maximum possible
         amount = payment.captured_amount
 
-    if not payment.can_refund():
-        raise PaymentError("This payment cannot be refunded.")
-
-    if amount.amount <= 0:
-        raise PaymentError("Amount should be a positive number.")
-    if amount > payment.captured_amount:
-        raise PaymentError("Cannot refund more than captured")
+    clean_refund(payment, amount)
 
     transaction = payment.transactions.filter(
         kind=TransactionKind.CAPTURE, is_success=True
@@ -355,12 +412,10 @@ def gateway_refund(payment, amount: Money = None) -> Transaction:
         raise PaymentError("Cannot refund uncaptured transaction")
     payment_token = transaction.token
 
-    transaction = call_gateway(
+    return _call_gateway_locked(
         operation_type=OperationType.REFUND,
         payment=payment,
         payment_token=payment_token,
+        check=lambda locked_payment: clean_refund(locked_payment, amount),
         amount=amount,
     )
-
-    _gateway_postprocess(transaction, payment)
-    return transaction
@@ -0,0 +1,19 @@
+"""
+The setup of the processes that the package spawns (see sharded_export).
+
+This module is loaded by the new processes before django is set up, it must not import the models.
+"""
+from typing import Dict
+
+import django
+from django.conf import settings
+
+
+def setup_worker(database_names: Dict[str, str]) -> None:
+    """
+    Set django up, on the databases of the parent process: their names can differ from the ones of the settings
+    module (for a test database).
+    """
+    django.setup()
+    for alias, name in database_names.items():
+        settings.DATABASES[alias]['NAME'] = name
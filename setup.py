@@ -13,6 +13,8 @@ setup(
     packages=[
         'payment',
         'payment.gateways',
+        'payment.management',
+        'payment.management.commands',
         'payment.migrations',
         'payment.gateways.dummy',
         'payment.gateways.stripe',
@@ -34,7 +36,6 @@ setup(
         'dataclasses',
         'django-import-export',
         'requests',
-        'xmltodict',
     ],
     license='MIT',
     classifiers=[
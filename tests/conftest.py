@@ -66,3 +66,21 @@ def payment_not_authorized(payment_dummy):
     payment_dummy.is_active = False
     payment_dummy.save()
     return payment_dummy
+
+
+def create_payments(count, gateway):
+    for i in range(count):
+        payment = Payment.objects.create(
+            gateway=gateway,
+            total=Money(80 + i, 'CHF'),
+            captured_amount=Money(0, 'CHF'),
+            customer_email='test{}@example.com'.format(i),
+        )
+        payment.transactions.create(amount=payment.total, kind=TransactionKind.AUTH, is_success=True,
+                                    gateway_response={})
+        if i % 2:
+            payment.captured_amount = payment.total
+            payment.charge_status = ChargeStatus.FULLY_CHARGED
+            payment.save()
+            payment.transactions.create(amount=payment.total, kind=TransactionKind.CAPTURE, is_success=True,
+                                        gateway_response={})
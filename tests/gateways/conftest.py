@@ -0,0 +1,32 @@
+import copy
+
+import pytest
+import stripe
+
+from payment.gateways.netaxept.fake_server import FakeNetaxept
+from .fake_stripe import FakeStripe
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    server = FakeStripe().start()
+    monkeypatch.setattr(stripe, 'api_base', server.url)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fake_netaxept():
+    server = FakeNetaxept(record=True).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def netaxept_gateway(db, fake_netaxept, settings):
+    """ The netaxept gateway, configured to call the fake server. """
+    gateways = copy.deepcopy(settings.PAYMENT_GATEWAYS)
+    gateways[settings.NETAXEPT]['config']['connection_params'].update(
+        base_url=fake_netaxept.url, merchant_id='123456', secret='supersekret', after_terminal_url='http://localhost')
+    settings.PAYMENT_GATEWAYS = gateways
+    return settings.NETAXEPT
@@ -0,0 +1,164 @@
+"""
+A local HTTP server that answers like the Stripe API, just enough for the tests and the benchmarks.
+"""
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+def _form_to_dict(body: str) -> dict:
+    """ Decode the stripe form encoding, where metadata[key]=value is a nested dict. """
+    params: dict = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        if '[' in key:
+            name, _, subkey = key.partition('[')
+            params.setdefault(name, {})[subkey.rstrip(']')] = value
+        else:
+            params[key] = value
+    return params
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ http.server.ThreadingHTTPServer, that needs python 3.7. """
+    daemon_threads = True
+
+
+class FakeStripe:
+    def __init__(self):
+        self.charges = {}
+        self.refunds = {}
+        self.requests = []  # (method, path, api key, params)
+        self.connections = set()  # The (host, port) of the clients
+        self.lock = threading.Lock()
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _handler(self))
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_charge(self, params):
+        with self.lock:
+            charge_id = 'ch_{}'.format(len(self.charges) + 1)
+            charge = self.charges[charge_id] = {
+                'id': charge_id,
+                'object': 'charge',
+                'amount': int(params['amount']),
+                'amount_refunded': 0,
+                'currency': params['currency'],
+                'captured': params.get('capture', 'true').lower() == 'true',
+                'description': params.get('description'),
+                'metadata': params.get('metadata', {}),
+                'status': 'succeeded',
+                'created': int(time.time()),
+            }
+        return 200, charge
+
+    def capture_charge(self, charge_id, params):
+        charge = self.charges.get(charge_id)
+        if charge is None:
+            return _not_found('charge', charge_id)
+        with self.lock:
+            amount = int(params.get('amount', charge['amount']))
+            charge['amount_refunded'] = charge['amount'] - amount
+            charge['captured'] = True
+        return 200, charge
+
+    def create_refund(self, params):
+        charge = self.charges.get(params['charge'])
+        if charge is None:
+            return _not_found('charge', params['charge'])
+        with self.lock:
+            amount = int(params.get('amount', charge['amount'] - charge['amount_refunded']))
+            charge['amount_refunded'] += amount
+            refund_id = 're_{}'.format(len(self.refunds) + 1)
+            refund = self.refunds[refund_id] = {
+                'id': refund_id,
+                'object': 'refund',
+                'amount': amount,
+                'charge': charge['id'],
+                'currency': charge['currency'],
+                'status': 'succeeded',
+                'created': int(time.time()),
+            }
+        return 200, refund
+
+    def add(self, objects: dict, **fields):
+        """ Add a charge or a refund as is, for instance with its created timestamp. """
+        with self.lock:
+            objects[fields['id']] = fields
+        return fields
+
+    def list_objects(self, objects: dict, params):
+        """ A page of the objects, the most recently created first, as the Stripe API. """
+        created = params.get('created', {})
+        with self.lock:
+            selected = [obj for obj in reversed(list(objects.values()))
+                        if int(created.get('gte', 0)) <= obj['created'] < int(created.get('lt', 2 ** 40))]
+        selected.sort(key=lambda obj: obj['created'], reverse=True)
+        if 'starting_after' in params:
+            ids = [obj['id'] for obj in selected]
+            selected = selected[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        return 200, {'object': 'list', 'data': selected[:limit], 'has_more': len(selected) > limit}
+
+    def handle(self, method, path, api_key, params):
+        with self.lock:
+            self.requests.append((method, path, api_key, params))
+        parts = path.strip('/').split('/')
+        if method == 'POST' and parts == ['v1', 'charges']:
+            return self.create_charge(params)
+        if method == 'POST' and len(parts) == 4 and parts[:2] == ['v1', 'charges'] and parts[3] == 'capture':
+            return self.capture_charge(parts[2], params)
+        if method == 'GET' and len(parts) == 3 and parts[:2] == ['v1', 'charges']:
+            charge = self.charges.get(parts[2])
+            return (200, charge) if charge else _not_found('charge', parts[2])
+        if method == 'POST' and parts == ['v1', 'refunds']:
+            return self.create_refund(params)
+        if method == 'GET' and parts == ['v1', 'charges']:
+            return self.list_objects(self.charges, params)
+        if method == 'GET' and parts == ['v1', 'refunds']:
+            return self.list_objects(self.refunds, params)
+        return 404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}}
+
+
+def _not_found(kind, object_id):
+    return 404, {'error': {'type': 'invalid_request_error', 'code': 'resource_missing',
+                           'message': 'No such {}: {}'.format(kind, object_id)}}
+
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _respond(self, method, params):
+            api_key = self.headers.get('Authorization', '').replace('Bearer ', '')
+            with fake.lock:
+                fake.connections.add(self.client_address)
+            status, body = fake.handle(method, urlparse(self.path).path, api_key, params)
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            self._respond('GET', _form_to_dict(urlparse(self.path).query))
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self._respond('POST', _form_to_dict(self.rfile.read(length).decode()))
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -7,7 +7,9 @@ from payment import (
     TransactionKind,
     get_payment_gateway,
 )
+from payment.models import Payment
 from payment.utils import (
+    _gateway_postprocess,
     create_payment_information,
     gateway_authorize,
     gateway_capture,
@@ -149,6 +151,13 @@ def test_capture_gateway_error(payment_txn_preauth, monkeypatch):
         assert txn.payment == payment_txn_preauth
 
 
+def test_capture_gateway_error_keeps_the_failed_transaction(payment_txn_preauth, monkeypatch):
+    monkeypatch.setattr("payment.gateways.dummy.dummy_success", lambda: False)
+    with pytest.raises(PaymentError):
+        gateway_capture(payment=payment_txn_preauth, amount=Money(80, 'USD'))
+    assert payment_txn_preauth.transactions.filter(kind=TransactionKind.CAPTURE, is_success=False).exists()
+
+
 @pytest.mark.parametrize(
     (
             "initial_captured_amount, refund_amount, final_captured_amount, "
@@ -220,6 +229,44 @@ def test_refund_gateway_error(payment_txn_captured, monkeypatch):
     assert payment.captured_amount == Money(80, 'USD')
 
 
+def _record_webhook_refund(payment, amount):
+    """ Record a refund as a webhook does, on its own instance of the payment. """
+    payment = Payment.objects.get(pk=payment.pk)
+    txn = payment.transactions.create(amount=amount, kind=TransactionKind.REFUND, gateway_response={},
+                                      is_success=True)
+    _gateway_postprocess(txn, payment)
+
+
+def test_refund_rechecks_the_payment_refunded_by_a_webhook(payment_txn_captured):
+    payment = payment_txn_captured
+    _record_webhook_refund(payment, Money(30, 'USD'))
+    txn = gateway_refund(payment=payment, amount=Money(20, 'USD'))
+    assert txn.is_success
+    assert payment.captured_amount == Money(30, 'USD')
+    assert payment.charge_status == ChargeStatus.PARTIALLY_REFUNDED
+    payment.refresh_from_db()
+    assert payment.captured_amount == Money(30, 'USD')
+
+    _record_webhook_refund(payment, Money(30, 'USD'))
+    with pytest.raises(PaymentError):
+        gateway_refund(payment=payment, amount=Money(30, 'USD'))
+    assert payment.charge_status == ChargeStatus.FULLY_REFUNDED
+    assert not payment.is_active
+    assert payment.transactions.filter(kind=TransactionKind.REFUND).count() == 3
+
+
+def test_capture_rechecks_the_payment_refunded_by_a_webhook(payment_txn_preauth):
+    payment = payment_txn_preauth
+    gateway_capture(payment=payment, amount=Money(30, 'USD'))
+    _record_webhook_refund(payment, Money(30, 'USD'))
+    assert payment.charge_status == ChargeStatus.PARTIALLY_CHARGED
+    with pytest.raises(PaymentError):
+        gateway_capture(payment=payment, amount=Money(50, 'USD'))
+    assert payment.charge_status == ChargeStatus.FULLY_REFUNDED
+    assert payment.captured_amount == Money(0, 'USD')
+    assert payment.transactions.filter(kind=TransactionKind.CAPTURE).count() == 1
+
+
 @pytest.mark.parametrize(
     "kind, charge_status",
     (
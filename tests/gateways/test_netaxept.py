@@ -1,4 +1,5 @@
 # flake8: noqa
+import dataclasses
 from dataclasses import dataclass, asdict
 from decimal import Decimal
 from unittest.mock import patch
@@ -8,12 +9,15 @@ from moneyed import Money
 from pytest import raises
 
 from payment import GatewayConfig, ChargeStatus, TransactionKind
-from payment.gateways.netaxept import gateway_to_netaxept_config, capture, refund, void, authorize
+from payment.gateways.netaxept import gateway_to_netaxept_config, capture, refund, void, authorize, process_payment
 from payment.gateways.netaxept.netaxept_protocol import NetaxeptConfig, get_payment_terminal_url, \
     _iso6391_to_netaxept_language, _money_to_netaxept_amount, _money_to_netaxept_currency, register, RegisterResponse, \
-    NetaxeptProtocolError, process, ProcessResponse, NetaxeptOperation, query, QueryResponse
+    NetaxeptProtocolError, process, ProcessResponse, NetaxeptOperation, query, QueryResponse, get_session
+from payment.gateways.netaxept import actions
+from payment.gateways.netaxept.parsing import CHUNK_SIZE, parse_fields
 from payment.interface import GatewayResponse
-from payment.utils import create_payment_information
+from payment.models import Payment
+from payment.utils import create_payment_information, gateway_process_payment
 
 _gateway_config = GatewayConfig(
     auto_capture=True,
@@ -50,11 +54,49 @@ def it_should_transform_money_to_netaxept_representation():
     assert _money_to_netaxept_currency(money) == 'NOK'
 
 
+def it_should_transform_zero_decimal_money_to_netaxept_representation():
+    money = Money(10, 'JPY')
+    assert _money_to_netaxept_amount(money) == 10
+    assert _money_to_netaxept_currency(money) == 'JPY'
+
+
 def it_should_build_terminal_url():
     assert get_payment_terminal_url(_netaxept_config, transaction_id='11111') == \
            'https://test.epayment.nets.eu/Terminal/default.aspx?merchantId=123456&transactionId=11111'
 
 
+##############################################################################
+# Parsing tests
+
+def it_should_parse_the_fields_of_the_expected_root():
+    root, fields = parse_fields(
+        '<PaymentInfo><Summary><Annulled>false</Annulled><Authorized> true </Authorized><AuthorizationId />'
+        '</Summary></PaymentInfo>',
+        'PaymentInfo', ['Summary/Annulled', 'Summary/Authorized', 'Summary/AuthorizationId', 'Summary/Missing'])
+    assert root == 'PaymentInfo'
+    assert fields == {'Summary/Annulled': 'false', 'Summary/Authorized': 'true', 'Summary/AuthorizationId': None}
+
+
+def it_should_parse_the_message_of_an_exception():
+    assert parse_fields(
+        '<?xml version="1.0" encoding="utf-8"?><Exception xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        '<Error xsi:type="GenericError"><Message>Unable to find transaction</Message></Error></Exception>',
+        'PaymentInfo', ['Summary/Authorized']) == ('Exception', {'Error/Message': 'Unable to find transaction'})
+
+
+def it_should_not_parse_an_unexpected_root():
+    assert parse_fields('<Other><TransactionId>1</TransactionId></Other>', 'RegisterResponse', ['TransactionId']) \
+        == ('Other', {})
+
+
+def it_should_stop_parsing_once_the_fields_are_known():
+    # The end of the document is not even well-formed
+    history = '<History>{}</History><Oops></PaymentInfo>'.format('<Line>Capture</Line>' * CHUNK_SIZE)
+    assert parse_fields('<PaymentInfo><Summary><Authorized>true</Authorized></Summary>' + history,
+                        'PaymentInfo', ['Summary/Authorized', 'Summary/AuthorizationId']) == \
+        ('PaymentInfo', {'Summary/Authorized': 'true'})
+
+
 ##############################################################################
 # Protocol tests
 
@@ -67,7 +109,7 @@ class MockResponse:
     text: str
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_register(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -88,10 +130,11 @@ def it_should_register(requests_post):
         url='https://test.epayment.nets.eu/Netaxept/Register.aspx',
         data={'merchantId': '123456', 'token': 'supersekret', 'description': None, 'orderNumber': '123',
               'amount': 1000, 'currencyCode': 'CHF', 'autoAuth': True, 'terminalSinglePage': True,
-              'language': None, 'customerEmail': 'nwolff@gmail.com', 'redirectUrl': 'http://localhost'})
+              'language': None, 'customerEmail': 'nwolff@gmail.com', 'redirectUrl': 'http://localhost'},
+        timeout=(5, 30))
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_handle_registration_failure(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -114,10 +157,11 @@ def it_should_handle_registration_failure(requests_post):
         url='https://test.epayment.nets.eu/Netaxept/Register.aspx',
         data={'merchantId': '123456', 'token': 'supersekret', 'description': None, 'orderNumber': '123',
               'amount': 1000, 'currencyCode': 'CAD', 'autoAuth': True, 'terminalSinglePage': True,
-              'language': None, 'redirectUrl': 'http://localhost'})
+              'language': None, 'redirectUrl': 'http://localhost'},
+        timeout=(5, 30))
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_process(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -138,17 +182,19 @@ def it_should_process(requests_post):
         config=_netaxept_config,
         transaction_id='1111111111114cf693a1cf86123e0d8f',
         operation=NetaxeptOperation.CAPTURE,
-        amount=Decimal(10))
+        amount=Decimal(10),
+        currency='NOK')
     assert process_response == ProcessResponse(
         response_code='OK',
         raw_response=asdict(mock_response))
     requests_post.assert_called_once_with(
         url='https://test.epayment.nets.eu/Netaxept/Process.aspx',
         data={'merchantId': '123456', 'token': 'supersekret', 'operation': 'CAPTURE',
-              'transactionId': '1111111111114cf693a1cf86123e0d8f', 'transactionAmount': 1000})
+              'transactionId': '1111111111114cf693a1cf86123e0d8f', 'transactionAmount': 1000},
+        timeout=(5, 30))
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_handle_process_failure(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -167,17 +213,19 @@ def it_should_handle_process_failure(requests_post):
             config=_netaxept_config,
             transaction_id='1111111111114cf693a1cf86123e0d8f',
             operation=NetaxeptOperation.CAPTURE,
-            amount=Decimal(10))
+            amount=Decimal(10),
+            currency='NOK')
         assert excinfo.value == NetaxeptProtocolError(
             error='Unable to translate supermerchant to submerchant, please check currency code and merchant ID',
             raw_response=asdict(mock_response))
     requests_post.assert_called_once_with(
         url='https://test.epayment.nets.eu/Netaxept/Process.aspx',
         data={'merchantId': '123456', 'token': 'supersekret', 'operation': 'CAPTURE',
-              'transactionId': '1111111111114cf693a1cf86123e0d8f', 'transactionAmount': 1000})
+              'transactionId': '1111111111114cf693a1cf86123e0d8f', 'transactionAmount': 1000},
+        timeout=(5, 30))
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_query(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -265,7 +313,7 @@ def it_should_query(requests_post):
         raw_response=asdict(mock_response))
 
 
-@patch('requests.post')
+@patch('requests.Session.post')
 def it_should_handle_query_response_without_authorization_id(requests_post):
     mock_response = MockResponse(
         status_code=200,
@@ -403,6 +451,28 @@ def it_should_authorize(query, netaxept_payment):
         transaction_id='1111111111114cf693a1cf86123e0d8f')
 
 
+@patch('payment.gateways.netaxept.netaxept_protocol.query')
+def it_should_not_authorize_when_query_fails(query, netaxept_payment):
+    raw_response = {'status_code': 200, 'url': 'https://test.epayment.nets.eu/Netaxept/Query.aspx',
+                    'encoding': 'ISO-8859-1', 'reason': 'OK', 'text': 'some xml'}
+    query.side_effect = NetaxeptProtocolError(error='Unable to find transaction', raw_response=raw_response)
+
+    payment_info = create_payment_information(
+        payment=netaxept_payment,
+        payment_token='1111111111114cf693a1cf86123e0d8f',
+        amount=Money(10, 'CHF'))
+
+    authorize_result = authorize(config=_gateway_config, payment_information=payment_info)
+    assert authorize_result == GatewayResponse(
+        is_success=False,
+        kind=TransactionKind.AUTH,
+        amount=Decimal('10'),
+        currency='CHF',
+        transaction_id='1111111111114cf693a1cf86123e0d8f',
+        error='Unable to find transaction',
+        raw_response=raw_response)
+
+
 @patch('payment.gateways.netaxept.netaxept_protocol.query')
 def it_should_not_authorize_when_query_returns_not_authorized(query, netaxept_payment):
     mock_query_response = QueryResponse(
@@ -456,6 +526,7 @@ def it_should_capture(process, netaxept_payment):
     process.assert_called_once_with(
         config=_netaxept_config,
         amount=Decimal('10'),
+        currency='CHF',
         transaction_id='1111111111114cf693a1cf86123e0d8f',
         operation=NetaxeptOperation.CAPTURE)
 
@@ -479,6 +550,7 @@ def it_should_not_capture_when_protocol_error(process, netaxept_payment):
     process.assert_called_once_with(
         config=_netaxept_config,
         amount=Decimal('10'),
+        currency='CHF',
         transaction_id='1111111111114cf693a1cf86123e0d8f',
         operation=NetaxeptOperation.CAPTURE)
 
@@ -509,6 +581,7 @@ def it_should_refund(process, netaxept_payment):
     process.assert_called_once_with(
         config=_netaxept_config,
         amount=Decimal('10'),
+        currency='CHF',
         transaction_id='1111111111114cf693a1cf86123e0d8f',
         operation=NetaxeptOperation.CREDIT)
 
@@ -539,5 +612,91 @@ def it_should_void(process, netaxept_payment):
     process.assert_called_once_with(
         config=_netaxept_config,
         amount=Decimal('10'),
+        currency='CHF',
         transaction_id='1111111111114cf693a1cf86123e0d8f',
         operation=NetaxeptOperation.ANNUL)
+
+
+@patch('payment.gateways.netaxept.netaxept_protocol.process')
+def it_should_process_payment_with_a_sale(process, netaxept_payment):
+    mock_process_response = ProcessResponse(
+        response_code='OK',
+        raw_response={'status_code': 200, 'url': 'https://test.epayment.nets.eu/Netaxept/Process.aspx',
+                      'encoding': 'ISO-8859-1', 'reason': 'OK',
+                      'text': 'some xml'})
+    process.return_value = mock_process_response
+    payment_info = create_payment_information(
+        payment=netaxept_payment,
+        payment_token='1111111111114cf693a1cf86123e0d8f',
+        amount=Money(10, 'CHF'))
+    process_result = process_payment(config=_gateway_config, payment_information=payment_info)
+    assert process_result == GatewayResponse(
+        is_success=True,
+        kind=TransactionKind.CAPTURE,
+        amount=Decimal('10'),
+        currency='CHF',
+        transaction_id='1111111111114cf693a1cf86123e0d8f',
+        error=None,
+        raw_response=mock_process_response.raw_response)
+    process.assert_called_once_with(
+        config=_netaxept_config,
+        amount=Decimal('10'),
+        currency='CHF',
+        transaction_id='1111111111114cf693a1cf86123e0d8f',
+        operation=NetaxeptOperation.SALE)
+
+
+##############################################################################
+# Connection tests
+
+def it_should_share_a_session_per_config():
+    assert get_session(_netaxept_config) is get_session(dataclasses.replace(_netaxept_config, secret='other'))
+    assert get_session(_netaxept_config) is not get_session(dataclasses.replace(_netaxept_config, pool_size=2))
+
+
+def it_should_only_retry_connection_errors():
+    adapter = get_session(_netaxept_config).get_adapter(_netaxept_config.base_url)
+    assert adapter.max_retries.connect == 2
+    assert adapter.max_retries.read == 0
+    assert adapter.max_retries.status == 0
+
+
+def it_should_take_the_connection_params_from_the_gateway_config():
+    config = gateway_to_netaxept_config(GatewayConfig(
+        auto_capture=True, template_path='',
+        connection_params={**_gateway_config.connection_params, 'pool_size': 4, 'read_timeout': 10}))
+    assert (config.pool_size, config.connect_timeout, config.read_timeout) == (4, 5, 10)
+
+
+def it_should_keep_the_connection_alive_between_calls(fake_netaxept):
+    config = dataclasses.replace(_netaxept_config, base_url=fake_netaxept.url)
+    transaction_id = register(config, amount=Money(10, 'NOK'), order_number='1').transaction_id
+    fake_netaxept.pay(transaction_id)
+    assert query(config, transaction_id).authorized
+    process(config, transaction_id, NetaxeptOperation.CAPTURE, amount=Decimal(10), currency='NOK')
+    assert '<AmountCaptured>1000<' in query(config, transaction_id).raw_response['text']
+    assert len(fake_netaxept.requests) == 4
+    assert len(fake_netaxept.connections) == 1
+
+
+##############################################################################
+# Actions tests
+
+def it_should_authorize_and_capture_with_a_single_sale(fake_netaxept, netaxept_gateway):
+    payment = Payment.objects.create(gateway=netaxept_gateway, total=Money(10, 'NOK'),
+                                     captured_amount=Money(0, 'NOK'), customer_email='test@example.com')
+    transaction_id = actions.register_payment(payment, auto_auth=False)
+    assert fake_netaxept.requests[-1][1]['autoAuth'] == 'False'
+    fake_netaxept.pay(transaction_id)
+
+    transaction = gateway_process_payment(payment, payment.token)
+
+    assert transaction.kind == TransactionKind.CAPTURE
+    assert [(path, params.get('operation')) for path, params in fake_netaxept.requests[1:]] == [
+        ('/Netaxept/Process.aspx', 'SALE')]
+    payment.refresh_from_db()
+    assert payment.charge_status == ChargeStatus.FULLY_CHARGED
+    assert payment.captured_amount == Money(10, 'NOK')
+    assert [t.kind for t in payment.transactions.order_by('id')] == [TransactionKind.REGISTER, TransactionKind.CAPTURE]
+    with raises(actions.PaymentAlreadyRegisteredAndAuthorized):
+        actions.register_payment(payment)
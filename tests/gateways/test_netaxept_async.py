@@ -0,0 +1,94 @@
+import asyncio
+import socket
+from decimal import Decimal
+
+import pytest
+from moneyed import Money
+
+from payment.gateways.netaxept.netaxept_protocol import NetaxeptConfig, NetaxeptOperation, NetaxeptProtocolError, \
+    QueryResponse, register
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from payment.gateways.netaxept.async_protocol import AsyncNetaxeptClient  # noqa: E402
+
+
+def run(coroutine):
+    """ asyncio.run, that needs python 3.7. """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def config(fake_netaxept):
+    return NetaxeptConfig(merchant_id='123456', secret='supersekret', base_url=fake_netaxept.url,
+                          after_terminal_url='http://localhost', pool_size=4)
+
+
+def test_register_process_and_query(config, fake_netaxept):
+    async def payment():
+        async with AsyncNetaxeptClient(config) as client:
+            transaction_id = (await client.register(Money(10, 'NOK'), order_number='1')).transaction_id
+            fake_netaxept.pay(transaction_id)
+            process_response = await client.process(transaction_id, NetaxeptOperation.CAPTURE, Decimal(10), 'NOK')
+            return transaction_id, process_response, await client.query(transaction_id)
+
+    transaction_id, process_response, query_response = run(payment())
+
+    path, params = fake_netaxept.requests[0]
+    assert params['autoAuth'] == 'True' and 'description' not in params  # Encoded as requests does
+    assert process_response.response_code == 'OK'
+    assert query_response == QueryResponse(annulled=False, authorized=True, authorization_id='123456',
+                                           raw_response=query_response.raw_response)
+    assert query_response.raw_response['status_code'] == 200
+    assert '<AmountCaptured>1000<' in query_response.raw_response['text']
+
+
+def test_protocol_error(config):
+    async def query():
+        async with AsyncNetaxeptClient(config) as client:
+            return await client.query('unknown')
+
+    with pytest.raises(NetaxeptProtocolError) as excinfo:
+        run(query())
+    assert excinfo.value.error == 'Unable to find transaction'
+    assert excinfo.value.raw_response['status_code'] == 200
+
+
+def test_concurrent_queries_share_the_pool(config, fake_netaxept):
+    transaction_ids = [register(config, Money(10, 'NOK'), order_number=str(i)).transaction_id for i in range(3)]
+    fake_netaxept.connections.clear()
+
+    async def queries():
+        async with AsyncNetaxeptClient(config) as client:
+            return await asyncio.gather(*[client.query(transaction_ids[i % 3]) for i in range(100)])
+
+    responses = run(queries())
+
+    assert [response.authorized for response in responses] == [False] * 100
+    assert 1 <= len(fake_netaxept.connections) <= 4
+
+
+def test_connection_errors_are_retried(config, monkeypatch):
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+    config.base_url = 'http://127.0.0.1:{}/'.format(port)
+    config.max_retries = 2
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr('payment.gateways.netaxept.async_protocol.asyncio.sleep', sleep)
+
+    async def query():
+        async with AsyncNetaxeptClient(config) as client:
+            return await client.query('1')
+
+    with pytest.raises(aiohttp.ClientConnectorError):
+        run(query())
+    assert sleeps == [0.1, 0.2]
@@ -0,0 +1,104 @@
+import time
+from io import StringIO
+
+import pytest
+import requests
+from django.core.management import call_command
+from moneyed import Money
+
+from payment import ChargeStatus, PaymentError, TransactionKind, get_payment_gateway
+from payment.gateways.netaxept import actions, gateway_to_netaxept_config, netaxept_protocol
+from payment.gateways.netaxept.fake_server import FakeNetaxept
+from payment.gateways.netaxept.netaxept_protocol import NetaxeptConfig, NetaxeptProtocolError
+from payment.models import Payment
+from payment.utils import gateway_authorize, gateway_capture
+
+
+@pytest.fixture
+def netaxept_payment(netaxept_gateway):
+    return Payment.objects.create(gateway=netaxept_gateway, total=Money(10, 'NOK'), captured_amount=Money(0, 'NOK'),
+                                  customer_email='test@example.com')
+
+
+def config(server):
+    return NetaxeptConfig(merchant_id='123456', secret='supersekret', base_url=server.url,
+                          after_terminal_url='http://localhost/after_terminal', max_retries=0)
+
+
+def test_authorize_and_capture_through_the_terminal(fake_netaxept, netaxept_payment):
+    transaction_id = actions.register_payment(netaxept_payment)
+    netaxept_config = gateway_to_netaxept_config(get_payment_gateway(netaxept_payment.gateway)[1])
+    terminal_url = netaxept_protocol.get_payment_terminal_url(netaxept_config, transaction_id=transaction_id)
+
+    response = requests.get(terminal_url, allow_redirects=False)
+    assert response.status_code == 302
+    assert response.headers['Location'] == \
+        'http://localhost?transactionId={}&responseCode=OK'.format(transaction_id)
+
+    assert gateway_authorize(netaxept_payment, netaxept_payment.token).is_success
+    assert gateway_capture(netaxept_payment).kind == TransactionKind.CAPTURE
+    netaxept_payment.refresh_from_db()
+    assert netaxept_payment.charge_status == ChargeStatus.FULLY_CHARGED
+    assert fake_netaxept.transactions[transaction_id]['captured'] == 1000
+
+
+def test_state_is_checked(fake_netaxept):
+    netaxept_config = config(fake_netaxept)
+    transaction_id = netaxept_protocol.register(netaxept_config, Money(10, 'NOK'), order_number='1').transaction_id
+    with pytest.raises(NetaxeptProtocolError, match='not authorized'):
+        netaxept_protocol.process(netaxept_config, transaction_id, netaxept_protocol.NetaxeptOperation.CAPTURE,
+                                  amount=10, currency='NOK')
+
+
+def test_latency():
+    server = FakeNetaxept(latency=0.05).start()
+    try:
+        start = time.monotonic()
+        with pytest.raises(NetaxeptProtocolError):
+            netaxept_protocol.query(config(server), 'unknown')
+        assert time.monotonic() - start >= 0.05
+    finally:
+        server.stop()
+
+
+def test_error_injection():
+    server = FakeNetaxept(error_rate=0.5, seed=1).start()
+    try:
+        errors = []
+        for _ in range(20):
+            with pytest.raises(NetaxeptProtocolError) as excinfo:
+                netaxept_protocol.query(config(server), 'unknown')
+            errors.append(excinfo.value.error)
+        assert set(errors) == {'Internal Server Error', 'Unable to find transaction'}
+    finally:
+        server.stop()
+
+
+def test_requests_are_recorded_only_on_demand():
+    server = FakeNetaxept().start()
+    try:
+        with pytest.raises(NetaxeptProtocolError):
+            netaxept_protocol.query(config(server), 'unknown')
+        assert server.requests == [] and server.connections == set()
+    finally:
+        server.stop()
+
+
+def test_gateway_errors_are_payment_errors(netaxept_payment, fake_netaxept):
+    actions.register_payment(netaxept_payment)
+    fake_netaxept.error_rate = 1
+    with pytest.raises(PaymentError, match='Internal Server Error'):
+        gateway_authorize(netaxept_payment, netaxept_payment.token)
+
+
+def test_run_fake_netaxept_command(monkeypatch):
+    served = []
+    monkeypatch.setattr(FakeNetaxept, 'serve_forever', lambda server: served.append(server))
+    stderr = StringIO()
+
+    call_command('run_fake_netaxept', '--port', '0', '--latency', '0.1', stderr=stderr)
+
+    server, = served
+    server.server.server_close()
+    assert server.latency == 0.1 and not server.record
+    assert 'Fake netaxept listening on {}'.format(server.url) in stderr.getvalue()
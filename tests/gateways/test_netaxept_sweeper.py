@@ -0,0 +1,110 @@
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from moneyed import Money
+
+from payment import TransactionKind
+from payment.gateways.netaxept import actions, sweeper
+from payment.gateways.netaxept.sweeper import ABANDONED_ERROR, SweepSummary, abandoned_registrations, sweep
+from payment.models import Payment
+
+
+def _age(payment, minutes_ago):
+    """ Date back the payment and its registrations. """
+    created = timezone.now() - timedelta(minutes=minutes_ago)
+    Payment.objects.filter(id=payment.id).update(created=created)
+    payment.transactions.filter(kind=TransactionKind.REGISTER).update(created=created)
+
+
+@pytest.fixture
+def register(fake_netaxept, netaxept_gateway):
+    def register(minutes_ago, pay=False, auto_auth=True):
+        payment = Payment.objects.create(gateway=netaxept_gateway, total=Money(10, 'NOK'),
+                                         captured_amount=Money(0, 'NOK'), customer_email='test@example.com')
+        actions.register_payment(payment, auto_auth=auto_auth)
+        _age(payment, minutes_ago)
+        if pay:
+            fake_netaxept.pay(payment.token)
+        return payment
+    return register
+
+
+def test_abandoned_registrations(register, netaxept_gateway, django_assert_num_queries):
+    old = register(90)
+    register(10)  # Too recent
+    authorized = register(90)
+    authorized.transactions.create(kind=TransactionKind.AUTH, token=authorized.token, amount=authorized.total,
+                                   is_success=True, gateway_response={})
+    Payment.objects.create(gateway=netaxept_gateway, total=Money(10, 'NOK'), captured_amount=Money(0, 'NOK'),
+                           customer_email='test@example.com')  # Not registered
+
+    with django_assert_num_queries(1):
+        assert list(abandoned_registrations(netaxept_gateway, timezone.now() - timedelta(hours=1))) == [old]
+
+
+def test_abandoned_registrations_by_the_last_registration(register, netaxept_gateway):
+    registered_again = register(90)
+    actions.register_payment(registered_again)  # The user went back to the terminal
+    register(90, auto_auth=False)  # Waits for its SALE
+    for_sale_again = register(90)
+    actions.register_payment(for_sale_again, auto_auth=False)
+    _age(for_sale_again, 90)
+    old = register(90)
+
+    assert list(abandoned_registrations(netaxept_gateway, timezone.now() - timedelta(hours=1))) == [old]
+
+    _age(registered_again, 90)
+    assert list(abandoned_registrations(netaxept_gateway, timezone.now() - timedelta(hours=1))) == \
+        [registered_again, old]
+
+
+def test_sweep(register, netaxept_gateway, fake_netaxept):
+    paid = register(90, pay=True)
+    abandoned = register(90)
+    for_sale = register(90, pay=True, auto_auth=False)
+    lost = register(90)
+    del fake_netaxept.transactions[lost.token]
+    recent = register(10)
+
+    summary = sweep(netaxept_gateway, workers=2)
+
+    assert summary == SweepSummary(checked=3, authorized=1, abandoned=1, errors=1)
+    paid.refresh_from_db()
+    assert paid.is_authorized and paid.is_active
+    abandoned.refresh_from_db()
+    assert not abandoned.is_active
+    transaction = abandoned.transactions.get(kind=TransactionKind.AUTH)
+    assert (transaction.is_success, transaction.error) == (False, ABANDONED_ERROR)
+    for_sale.refresh_from_db()
+    assert for_sale.is_active and not for_sale.transactions.filter(kind=TransactionKind.AUTH).exists()
+    lost.refresh_from_db()
+    assert lost.is_active and not lost.transactions.filter(kind=TransactionKind.AUTH).exists()
+    assert recent.transactions.count() == 1
+
+    assert sweep(netaxept_gateway) == SweepSummary(checked=1, errors=1)  # Only the lost one is left
+
+
+def test_sweep_skips_the_payments_authorized_meanwhile(register, netaxept_gateway, monkeypatch):
+    paid = register(90, pay=True)
+    selected = list(abandoned_registrations(netaxept_gateway, timezone.now()))
+    # The user comes back from the terminal while the sweeper queries netaxept
+    paid.transactions.create(kind=TransactionKind.AUTH, token=paid.token, amount=paid.total, is_success=True,
+                             gateway_response={})
+    monkeypatch.setattr(sweeper, 'abandoned_registrations', lambda gateway, registered_before: selected)
+
+    summary = sweep(netaxept_gateway)
+
+    assert summary == SweepSummary(checked=1, skipped=1)
+    assert paid.transactions.filter(kind=TransactionKind.AUTH).count() == 1
+
+
+def test_sweep_netaxept_registrations_command(register, netaxept_gateway):
+    register(90, pay=True)
+    stderr = StringIO()
+
+    call_command('sweep_netaxept_registrations', netaxept_gateway, '--minutes', '30', stderr=stderr)
+
+    assert 'Checked 1 registrations: 1 authorized, 0 abandoned, 0 skipped, 0 errors' in stderr.getvalue()
@@ -1,12 +1,16 @@
+import dataclasses
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
 import pytest
 import stripe
 from math import isclose
 from moneyed import Money
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 
 from payment import ChargeStatus
+from payment.gateways.stripe import connect
 from payment.gateways.stripe import (
     TransactionKind,
     _create_response,
@@ -24,14 +28,16 @@ from payment.gateways.stripe import (
     refund,
     void,
 )
+from payment.gateways.stripe.client import HttpOptions, get_http_client
 from payment.gateways.stripe.forms import (
     StripeCheckoutWidget,
     StripePaymentModalForm,
 )
 from payment.gateways.stripe.utils import (
+    get_country_names,
     get_payment_billing_fullname,
 )
-from payment.interface import GatewayConfig
+from payment.interface import AddressData, GatewayConfig
 from payment.utils import create_payment_information
 
 TRANSACTION_AMOUNT = Decimal(42.42)
@@ -136,6 +142,10 @@ def test_get_amount_for_stripe():
     assert get_amount_for_stripe(Decimal(1), "JPY") == 1
     assert get_amount_for_stripe(Decimal(1), "jpy") == 1
 
+    assert get_amount_for_stripe(Decimal(1), "MGA") == 1
+    assert get_amount_for_stripe(Decimal(1), "ISK") == 100
+    assert get_amount_for_stripe(Decimal(1), "KWD") == 1000
+
 
 def test_get_amount_from_stripe():
     assert get_amount_from_stripe(100, "USD") == Decimal(1)
@@ -248,6 +258,159 @@ def test_get_client(gateway_config):
     assert _get_client(**gateway_config.connection_params).api_key == "secret"
 
 
+def test_get_client_is_cached_per_key_without_changing_the_global_key(gateway_config):
+    global_key = stripe.api_key
+    client = _get_client(**gateway_config.connection_params)
+    assert _get_client(**gateway_config.connection_params) is client
+    assert _get_client(secret_key="other").api_key == "other"
+    assert stripe.api_key == global_key
+
+
+@pytest.fixture()
+def frequent_thread_switches():
+    """ Switch threads as often as possible, to make races likely. """
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        yield
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
+def test_authorize_concurrently_with_different_keys(fake_stripe, stripe_payment, gateway_config,
+                                                    frequent_thread_switches):
+    payment_info = create_payment_information(stripe_payment, FAKE_TOKEN)
+
+    def authorize_with_own_key(i):
+        config = dataclasses.replace(
+            gateway_config, connection_params={**gateway_config.connection_params, "secret_key": "sk_{}".format(i)})
+        return authorize(dataclasses.replace(payment_info, metadata={"thread": str(i)}), config)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        responses = list(executor.map(authorize_with_own_key, range(64)))
+
+    assert all(response.is_success for response in responses)
+    assert [response.raw_response["metadata"]["thread"] for response in responses] == [str(i) for i in range(64)]
+    keys = {params["metadata"]["thread"]: api_key for _method, _path, api_key, params in fake_stripe.requests}
+    assert keys == {str(i): "sk_{}".format(i) for i in range(64)}
+
+
+@pytest.fixture()
+def fake_stripe_charge(fake_stripe, stripe_authorized_payment):
+    _status, charge = fake_stripe.create_charge({
+        "amount": str(get_amount_for_stripe(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY)),
+        "currency": "usd",
+        "capture": "false",
+    })
+    fake_stripe.requests.clear()
+    return charge
+
+
+def test_capture_is_a_single_request(fake_stripe, fake_stripe_charge, stripe_authorized_payment, gateway_config):
+    payment_info = create_payment_information(
+        stripe_authorized_payment, fake_stripe_charge["id"],
+        amount=Money(TRANSACTION_AMOUNT - TRANSACTION_REFUND_AMOUNT, TRANSACTION_CURRENCY))
+
+    response = capture(payment_info, gateway_config)
+
+    assert response.is_success
+    assert response.transaction_id == fake_stripe_charge["id"]
+    assert isclose(response.amount, TRANSACTION_AMOUNT - TRANSACTION_REFUND_AMOUNT)
+    assert fake_stripe.requests == [
+        ("POST", "/v1/charges/{}/capture".format(fake_stripe_charge["id"]), "secret", {"amount": "1818"})]
+
+
+def test_refund_is_a_single_request(fake_stripe, fake_stripe_charge, stripe_authorized_payment, gateway_config):
+    payment_info = create_payment_information(
+        stripe_authorized_payment, fake_stripe_charge["id"],
+        amount=Money(TRANSACTION_REFUND_AMOUNT, TRANSACTION_CURRENCY))
+
+    response = refund(payment_info, gateway_config)
+
+    assert response.is_success
+    assert response.kind == TransactionKind.REFUND
+    assert isclose(response.amount, TRANSACTION_REFUND_AMOUNT)
+    assert fake_stripe.requests == [
+        ("POST", "/v1/refunds", "secret", {"charge": fake_stripe_charge["id"], "amount": "2424"})]
+
+
+def test_void_is_a_single_request(fake_stripe, fake_stripe_charge, stripe_authorized_payment, gateway_config):
+    payment_info = create_payment_information(stripe_authorized_payment, fake_stripe_charge["id"])
+
+    response = void(payment_info, gateway_config)
+
+    assert response.is_success
+    assert response.kind == TransactionKind.VOID
+    assert fake_stripe.requests == [("POST", "/v1/refunds", "secret", {"charge": fake_stripe_charge["id"]})]
+
+
+def test_capture_of_an_unknown_charge(fake_stripe, stripe_authorized_payment, gateway_config):
+    payment_info = create_payment_information(
+        stripe_authorized_payment, "ch_unknown", amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY))
+
+    response = capture(payment_info, gateway_config)
+
+    assert not response.is_success
+    assert response.error == "No such charge: ch_unknown"
+    assert response.transaction_id == "ch_unknown"
+    assert response.raw_response["error"]["code"] == "resource_missing"
+    assert len(fake_stripe.requests) == 1
+
+
+def test_http_options_from_connection_params():
+    assert HttpOptions.from_connection_params({"secret_key": "secret"}) == HttpOptions()
+    options = HttpOptions.from_connection_params({
+        "pool_size": "50", "keep_alive": False, "max_network_retries": 0, "timeout": 10,
+        "proxy": {"https": "http://proxy:3128"},
+    })
+    assert options == HttpOptions(pool_size=50, keep_alive=False, max_network_retries=0, timeout=10,
+                                  proxy=(("https", "http://proxy:3128"),))
+    http_client = get_http_client(options)
+    assert http_client._proxy == {"https": "http://proxy:3128"}
+    assert http_client._session.get_adapter("https://api.stripe.com")._pool_maxsize == 50
+
+
+def test_http_client_is_shared_by_the_configs_with_the_same_options(gateway_config):
+    client = _get_client(**gateway_config.connection_params)
+    other = _get_client(**{**gateway_config.connection_params, "secret_key": "other"})
+    assert other.http_client is client.http_client
+    assert _get_client(**{**gateway_config.connection_params, "pool_size": 3}).http_client is not client.http_client
+
+
+def test_requests_use_the_http_client_of_the_config_not_the_global_one(fake_stripe, gateway_config):
+    global_client = stripe.default_http_client
+    client = _get_client(**gateway_config.connection_params)
+    with patch.object(client.http_client, "request_with_retries",
+                      wraps=client.http_client.request_with_retries) as request:
+        client.Charge.create(amount=100, currency="usd", source=FAKE_TOKEN)
+    assert request.call_count == 1
+    assert stripe.default_http_client is global_client
+
+
+def test_http_client_retries_only_connection_errors():
+    http_client = get_http_client(HttpOptions(max_network_retries=2))
+    connection_error = stripe.error.APIConnectionError("error", should_retry=True)
+    assert http_client._should_retry(None, connection_error, 0)
+    assert http_client._should_retry(None, connection_error, 1)
+    assert not http_client._should_retry(None, connection_error, 2)
+    assert not http_client._should_retry((b"", 503, {}), None, 0)
+    assert not http_client._should_retry((b"", 409, {}), None, 0)
+
+
+@pytest.mark.parametrize("keep_alive, connections", [(True, 1), (False, 5)])
+def test_requests_reuse_the_connection_with_keep_alive(
+        fake_stripe, stripe_authorized_payment, gateway_config, keep_alive, connections):
+    config = dataclasses.replace(
+        gateway_config, connection_params={**gateway_config.connection_params, "keep_alive": keep_alive})
+    payment_info = create_payment_information(stripe_authorized_payment, FAKE_TOKEN)
+
+    for _ in range(5):
+        assert authorize(payment_info, config).is_success
+
+    assert len(fake_stripe.requests) == 5
+    assert len(fake_stripe.connections) == connections
+
+
 def test_get_client_token():
     assert get_client_token() is None
 
@@ -279,6 +442,49 @@ def test_get_stripe_charge_payload_without_shipping(stripe_payment):
     assert charge_payload == expected_payload
 
 
+def test_get_stripe_charge_payload_with_shipping(stripe_payment):
+    shipping = AddressData(
+        first_name="", last_name="", company_name="", street_address_1="Bahnhofstrasse 1", street_address_2="",
+        city="Zürich", city_area="", postal_code="8001", country="CH", country_area="ZH", phone="")
+    payment_info = create_payment_information(stripe_payment, FAKE_TOKEN, shipping_address=shipping)
+
+    charge_payload = _get_stripe_charge_payload(payment_info, True)
+
+    assert charge_payload["shipping"] == {
+        "name": get_payment_billing_fullname(payment_info),
+        "address": {
+            "line1": "Bahnhofstrasse 1", "line2": "", "city": "Zürich", "state": "ZH", "postal_code": "8001",
+            "country": "Switzerland",
+        },
+    }
+    # The country names are computed once per language
+    assert get_country_names("en") is get_country_names("en")
+
+
+def test_maybe_add_transfer_data(settings):
+    settings.STRIPE_CONNECT = {"transfer_destination": "acct_1", "transfer_percent": "90"}
+    charge_payload = {"amount": 1250}
+    connect.maybe_add_transfer_data(charge_payload)
+    assert charge_payload["transfer_data"] == {"destination": "acct_1", "amount": 1125}
+
+    settings.STRIPE_CONNECT = {"transfer_destination": "acct_2", "transfer_percent": 50}
+    charge_payload = {"amount": 1250}
+    connect.maybe_add_transfer_data(charge_payload)
+    assert charge_payload["transfer_data"] == {"destination": "acct_2", "amount": 625}
+
+
+def test_maybe_add_transfer_data_without_connect():
+    charge_payload = {"amount": 1250}
+    connect.maybe_add_transfer_data(charge_payload)
+    assert "transfer_data" not in charge_payload
+
+
+def test_maybe_add_transfer_data_with_invalid_percent(settings):
+    settings.STRIPE_CONNECT = {"transfer_destination": "acct_1", "transfer_percent": 101}
+    with pytest.raises(Exception, match="between 0 and 100"):
+        connect.maybe_add_transfer_data({"amount": 1250})
+
+
 def test_create_transaction_with_charge_success_response(
         stripe_payment, stripe_charge_success_response
 ):
@@ -352,7 +558,7 @@ def test_create_response_with_error_response(stripe_payment):
 
 
 @pytest.mark.integration
-@patch("stripe.Charge.create")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_authorize(
         mock_charge_create, stripe_payment, gateway_config, stripe_charge_success_response
 ):
@@ -373,7 +579,7 @@ def test_authorize(
 
 
 @pytest.mark.integration
-@patch("stripe.Charge.create")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_authorize_error_response(mock_charge_create, stripe_payment, gateway_config):
     payment = stripe_payment
     payment_info = create_payment_information(payment, FAKE_TOKEN)
@@ -392,9 +598,9 @@ def test_authorize_error_response(mock_charge_create, stripe_payment, gateway_co
 
 
 @pytest.mark.integration
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._ChargeResource.capture")
 def test_capture(
-        mock_charge_retrieve,
+        mock_charge_capture,
         stripe_authorized_payment,
         gateway_config,
         stripe_charge_success_response,
@@ -402,7 +608,7 @@ def test_capture(
     payment = stripe_authorized_payment
     payment_info = create_payment_information(payment, amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY))
     response = stripe_charge_success_response
-    mock_charge_retrieve.return_value = Mock(capture=Mock(return_value=response))
+    mock_charge_capture.return_value = response
 
     response = capture(payment_info, gateway_config)
 
@@ -416,9 +622,9 @@ def test_capture(
 
 
 @pytest.mark.integration
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._ChargeResource.capture")
 def test_partial_captureummy(
-        mock_charge_retrieve,
+        mock_charge_capture,
         stripe_authorized_payment,
         gateway_config,
         stripe_partial_charge_success_response,
@@ -426,7 +632,7 @@ def test_partial_captureummy(
     payment = stripe_authorized_payment
     payment_info = create_payment_information(payment, amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY))
     response = stripe_partial_charge_success_response
-    mock_charge_retrieve.return_value = Mock(capture=Mock(return_value=response))
+    mock_charge_capture.return_value = response
 
     response = capture(payment_info, gateway_config)
 
@@ -440,16 +646,16 @@ def test_partial_captureummy(
 
 
 @pytest.mark.integration
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._ChargeResource.capture")
 def test_capture_error_response(
-        mock_charge_retrieve, stripe_authorized_payment, gateway_config
+        mock_charge_capture, stripe_authorized_payment, gateway_config
 ):
     payment = stripe_authorized_payment
     payment_info = create_payment_information(
         payment, TRANSACTION_TOKEN, amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY)
     )
     stripe_error = stripe.error.InvalidRequestError(message=ERROR_MESSAGE, param=None)
-    mock_charge_retrieve.side_effect = stripe_error
+    mock_charge_capture.side_effect = stripe_error
 
     response = capture(payment_info, gateway_config)
 
@@ -463,10 +669,8 @@ def test_capture_error_response(
 
 
 @pytest.mark.integration
-@patch("stripe.Refund.create")
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_refund_charged(
-        mock_charge_retrieve,
         mock_refund_create,
         stripe_captured_payment,
         gateway_config,
@@ -477,7 +681,6 @@ def test_refund_charged(
         payment, TRANSACTION_TOKEN, amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY)
     )
     response = stripe_refund_success_response
-    mock_charge_retrieve.return_value = Mock(id="")
     mock_refund_create.return_value = response
 
     response = refund(payment_info, gateway_config)
@@ -492,10 +695,8 @@ def test_refund_charged(
 
 
 @pytest.mark.integration
-@patch("stripe.Refund.create")
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_refund_captured(
-        mock_charge_retrieve,
         mock_refund_create,
         stripe_captured_payment,
         gateway_config,
@@ -504,7 +705,6 @@ def test_refund_captured(
     payment = stripe_captured_payment
     payment_info = create_payment_information(payment, amount=Money(TRANSACTION_AMOUNT, 'USD'))
     response = stripe_refund_success_response
-    mock_charge_retrieve.return_value = Mock(id="")
     mock_refund_create.return_value = response
 
     response = refund(payment_info, gateway_config)
@@ -519,16 +719,14 @@ def test_refund_captured(
 
 
 @pytest.mark.integration
-@patch("stripe.Refund.create")
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_refund_error_response(
-        mock_charge_retrieve, mock_refund_create, stripe_captured_payment, gateway_config
+        mock_refund_create, stripe_captured_payment, gateway_config
 ):
     payment = stripe_captured_payment
     payment_info = create_payment_information(
         payment, TRANSACTION_TOKEN, amount=Money(TRANSACTION_AMOUNT, TRANSACTION_CURRENCY)
     )
-    mock_charge_retrieve.return_value = Mock(id="")
     stripe_error = stripe.error.InvalidRequestError(message=ERROR_MESSAGE, param=None)
     mock_refund_create.side_effect = stripe_error
 
@@ -544,10 +742,8 @@ def test_refund_error_response(
 
 
 @pytest.mark.integration
-@patch("stripe.Refund.create")
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_void(
-        mock_charge_retrieve,
         mock_refund_create,
         stripe_authorized_payment,
         gateway_config,
@@ -556,7 +752,6 @@ def test_void(
     payment = stripe_authorized_payment
     payment_info = create_payment_information(payment, TRANSACTION_TOKEN)
     response = stripe_refund_success_response
-    mock_charge_retrieve.return_value = Mock(id="")
     mock_refund_create.return_value = response
 
     response = void(payment_info, gateway_config)
@@ -571,14 +766,12 @@ def test_void(
 
 
 @pytest.mark.integration
-@patch("stripe.Refund.create")
-@patch("stripe.Charge.retrieve")
+@patch("payment.gateways.stripe.client._Resource.create")
 def test_void_error_response(
-        mock_charge_retrieve, mock_refund_create, stripe_authorized_payment, gateway_config
+        mock_refund_create, stripe_authorized_payment, gateway_config
 ):
     payment = stripe_authorized_payment
     payment_info = create_payment_information(payment, TRANSACTION_TOKEN)
-    mock_charge_retrieve.return_value = Mock(id="")
     stripe_error = stripe.error.InvalidRequestError(message=ERROR_MESSAGE, param=None)
     mock_refund_create.side_effect = stripe_error
 
@@ -0,0 +1,129 @@
+import dataclasses
+
+import pytest
+
+from payment.gateways.stripe import authorize, connect
+from payment.gateways.stripe.connect import TTLCache, Transfer, default_router, get_router
+from payment.interface import GatewayConfig
+from payment.models import StripeConnectRoute
+from payment.utils import create_payment_information
+
+
+@pytest.fixture(autouse=True)
+def empty_route_cache():
+    connect._get_routes().clear()
+    yield
+    connect._get_routes().clear()
+
+
+@pytest.fixture
+def payment_info(payment_dummy):
+    return create_payment_information(payment_dummy, 'tok_visa')
+
+
+def with_metadata(payment_info, **metadata):
+    return dataclasses.replace(payment_info, metadata=metadata)
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(connect.time, 'monotonic', lambda: now[0])
+    loads = []
+    cache = TTLCache(ttl=10, maxsize=10)
+
+    def load(key):
+        loads.append(key)
+        return key.upper()
+
+    assert cache.get('a', load) == 'A'
+    now[0] += 9
+    assert cache.get('a', load) == 'A'
+    now[0] += 2
+    assert cache.get('a', load) == 'A'
+    assert loads == ['a', 'a']
+
+
+def test_ttl_cache_evicts_the_least_recently_used():
+    cache = TTLCache(ttl=60, maxsize=2)
+    loads = []
+
+    def load(key):
+        loads.append(key)
+        return key
+
+    cache.get('a', load)
+    cache.get('b', load)
+    cache.get('a', load)
+    cache.get('c', load)  # Evicts b
+    cache.get('a', load)
+    cache.get('b', load)
+    assert loads == ['a', 'b', 'c', 'b']
+
+
+def test_metadata_route(payment_info):
+    assert default_router(with_metadata(payment_info, transfer_destination='acct_1', transfer_percent='80')) == \
+        Transfer('acct_1', 80)
+    with pytest.raises(Exception, match='between 0 and 100'):
+        default_router(with_metadata(payment_info, transfer_destination='acct_1', transfer_percent='120'))
+
+
+def test_metadata_route_without_percent(settings, payment_info):
+    # Not the whole charge
+    with pytest.raises(Exception, match='no transfer_percent'):
+        default_router(with_metadata(payment_info, transfer_destination='acct_1'))
+
+    settings.STRIPE_CONNECT = {'transfer_destination': 'acct_default', 'transfer_percent': 50}
+    assert default_router(with_metadata(payment_info, transfer_destination='acct_1')) == Transfer('acct_1', 50)
+
+
+def test_table_route_is_cached(payment_info, django_assert_num_queries):
+    StripeConnectRoute.objects.create(seller='seller-1', destination='acct_1', percent=90)
+    seller_1 = with_metadata(payment_info, seller='seller-1')
+    unknown_seller = with_metadata(payment_info, seller='seller-2')
+
+    with django_assert_num_queries(2):
+        assert default_router(seller_1) == Transfer('acct_1', 90)
+        assert default_router(unknown_seller) is None
+    with django_assert_num_queries(0):
+        for _ in range(10):
+            assert default_router(seller_1) == Transfer('acct_1', 90)
+            assert default_router(unknown_seller) is None
+
+
+def test_changed_route_is_reloaded(payment_info):
+    route = StripeConnectRoute.objects.create(seller='seller-1', destination='acct_1', percent=90)
+    seller_1 = with_metadata(payment_info, seller='seller-1')
+    assert default_router(seller_1) == Transfer('acct_1', 90)
+
+    route.destination = 'acct_2'
+    route.save()
+    assert default_router(seller_1) == Transfer('acct_2', 90)
+
+    route.delete()
+    assert default_router(seller_1) is None
+
+
+def test_settings_route_when_the_payment_has_no_route(settings, payment_info):
+    settings.STRIPE_CONNECT = {'transfer_destination': 'acct_default', 'transfer_percent': 50}
+    StripeConnectRoute.objects.create(seller='seller-1', destination='acct_1', percent=90)
+
+    assert default_router(payment_info) == Transfer('acct_default', 50)
+    assert default_router(with_metadata(payment_info, seller='seller-2')) == Transfer('acct_default', 50)
+    assert default_router(with_metadata(payment_info, seller='seller-1')) == Transfer('acct_1', 90)
+
+
+def test_router_setting(settings):
+    assert get_router() is default_router
+    settings.STRIPE_CONNECT_ROUTER = 'payment.gateways.stripe.connect.settings_router'
+    assert get_router() is connect.settings_router
+
+
+def test_authorize_transfers_to_the_seller(fake_stripe, payment_info):
+    StripeConnectRoute.objects.create(seller='seller-1', destination='acct_1', percent=90)
+    config = GatewayConfig(auto_capture=False, template_path='', connection_params={'secret_key': 'secret'})
+
+    response = authorize(with_metadata(payment_info, seller='seller-1'), config)
+
+    assert response.is_success
+    _method, _path, _api_key, params = fake_stripe.requests[0]
+    assert params['transfer_data'] == {'destination': 'acct_1', 'amount': '7200'}
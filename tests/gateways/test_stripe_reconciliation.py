@@ -0,0 +1,118 @@
+import copy
+import json
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from moneyed import Money
+
+from payment import TransactionKind
+from payment.gateways.stripe import reconciliation
+from payment.gateways.stripe.reconciliation import MISMATCH, MISSING, ORPHANED, Summary, reconcile, time_windows
+from payment.models import Payment
+
+
+@pytest.fixture(autouse=True)
+def secret_key(settings):
+    gateways = copy.deepcopy(settings.PAYMENT_GATEWAYS)
+    gateways[settings.STRIPE]['config']['connection_params']['secret_key'] = 'sk_test'
+    settings.PAYMENT_GATEWAYS = gateways
+
+
+@pytest.fixture
+def stripe_payment(db, settings):
+    return Payment.objects.create(gateway=settings.STRIPE, total=Money(80, 'USD'), captured_amount=Money(0, 'USD'),
+                                  customer_email='test@example.com')
+
+
+@pytest.fixture
+def day():
+    start = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
+
+def at(day, hours):
+    return int((day[0] + timedelta(hours=hours)).timestamp())
+
+
+def add_transaction(payment, kind, token, amount):
+    payment.transactions.create(kind=kind, token=token, amount=Money(amount, 'USD'), is_success=True,
+                                gateway_response={})
+
+
+def charge(fake_stripe, day, charge_id, hours, **fields):
+    return fake_stripe.add(fake_stripe.charges, **{
+        'id': charge_id, 'object': 'charge', 'amount': 8000, 'amount_captured': 8000, 'amount_refunded': 0,
+        'currency': 'usd', 'captured': True, 'status': 'succeeded', 'created': at(day, hours), **fields})
+
+
+def refund(fake_stripe, day, refund_id, charge_id, amount, hours):
+    return fake_stripe.add(fake_stripe.refunds, id=refund_id, object='refund', charge=charge_id, amount=amount,
+                           currency='usd', status='succeeded', created=at(day, hours))
+
+
+def test_time_windows(day):
+    windows = time_windows(day[0], day[1], timedelta(hours=10))
+    assert windows == [(at(day, 0), at(day, 10)), (at(day, 10), at(day, 20)), (at(day, 20), at(day, 24))]
+
+
+def test_reconcile(fake_stripe, stripe_payment, settings, day, monkeypatch):
+    monkeypatch.setattr(reconciliation, 'PAGE_SIZE', 2)
+    charge(fake_stripe, day, 'ch_ok', 1)
+    add_transaction(stripe_payment, TransactionKind.AUTH, 'ch_ok', 80)
+    add_transaction(stripe_payment, TransactionKind.CAPTURE, 'ch_ok', 80)
+    charge(fake_stripe, day, 'ch_auth', 2, amount=5000, amount_captured=0, captured=False)
+    add_transaction(stripe_payment, TransactionKind.AUTH, 'ch_auth', 50)
+    charge(fake_stripe, day, 'ch_mismatch', 3)
+    add_transaction(stripe_payment, TransactionKind.CAPTURE, 'ch_mismatch', 70)
+    charge(fake_stripe, day, 'ch_missing', 13)
+    add_transaction(stripe_payment, TransactionKind.AUTH, 'ch_missing', 80)
+    charge(fake_stripe, day, 'ch_orphan', 14)
+    charge(fake_stripe, day, 'ch_failed', 15, status='failed')
+    charge(fake_stripe, day, 'ch_before', -1)
+    refund(fake_stripe, day, 're_ok', 'ch_ok', 3000, 20)
+    add_transaction(stripe_payment, TransactionKind.REFUND, 're_ok', 30)
+    refund(fake_stripe, day, 're_missing', 'ch_ok', 1000, 21)
+    refund(fake_stripe, day, 're_orphan', 'ch_unknown', 1000, 22)
+    summary = Summary()
+
+    problems = list(reconcile(settings.STRIPE, day[0], day[1], window=timedelta(hours=12), workers=3,
+                              summary=summary))
+
+    assert sorted((p.problem, p.id, p.kind, p.amount, p.recorded_amount) for p in problems) == [
+        (MISMATCH, 'ch_mismatch', TransactionKind.CAPTURE, 8000, 7000),
+        (MISSING, 'ch_missing', TransactionKind.CAPTURE, 8000, None),
+        (MISSING, 're_missing', TransactionKind.REFUND, 1000, None),
+        (ORPHANED, 'ch_orphan', TransactionKind.CAPTURE, 8000, None),
+        (ORPHANED, 're_orphan', TransactionKind.REFUND, 1000, None),
+    ]
+    assert summary == Summary(transactions=6, charges=6, refunds=3, mismatch=1, missing=2, orphaned=2)
+    list_requests = [params for method, path, _key, params in fake_stripe.requests if method == 'GET']
+    assert len(list_requests) > 4  # Several pages of each window
+
+
+def test_reconcile_many_charges(fake_stripe, stripe_payment, settings, day):
+    for i in range(250):
+        charge(fake_stripe, day, 'ch_{}'.format(i), i / 11)
+        add_transaction(stripe_payment, TransactionKind.CAPTURE, 'ch_{}'.format(i), 80)
+    summary = Summary()
+
+    problems = list(reconcile(settings.STRIPE, day[0], day[1], window=timedelta(hours=1), summary=summary))
+
+    assert problems == []
+    assert summary.charges == 250
+
+
+def test_reconcile_stripe_command(fake_stripe, stripe_payment, settings, day, tmp_path):
+    charge(fake_stripe, day, 'ch_orphan', 1)
+    output = tmp_path / 'problems.jsonl'
+    stderr = StringIO()
+
+    call_command('reconcile_stripe', settings.STRIPE, '--created-from', day[0].date().isoformat(),
+                 '--created-until', day[1].date().isoformat(), '--output', str(output), stderr=stderr)
+
+    assert [json.loads(line)['id'] for line in output.read_text().splitlines()] == ['ch_orphan']
+    assert 'Checked 1 charges and 0 refunds against 0 transactions: 0 mismatches, 0 missing, 1 orphaned' in \
+        stderr.getvalue()
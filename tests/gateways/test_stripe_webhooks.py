@@ -0,0 +1,214 @@
+import copy
+import json
+import time
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from moneyed import Money
+from stripe import WebhookSignature
+
+from payment import ChargeStatus, TransactionKind
+from payment.gateways.stripe import webhooks
+from payment.gateways.stripe.webhooks import MAX_ATTEMPTS, process_events
+from payment.models import WebhookEvent
+
+SECRET = 'whsec_test'
+CHARGE_ID = 'ch_1'
+
+
+@pytest.fixture
+def webhook_secret(settings):
+    gateways = copy.deepcopy(settings.PAYMENT_GATEWAYS)
+    gateways[settings.STRIPE]['config']['connection_params']['webhook_secret'] = SECRET
+    settings.PAYMENT_GATEWAYS = gateways
+    return SECRET
+
+
+@pytest.fixture
+def webhook_url(settings):
+    return reverse('payment:stripe_webhook', args=[settings.STRIPE])
+
+
+def signature(payload: str, secret: str = SECRET) -> str:
+    timestamp = int(time.time())
+    return 't={},v1={}'.format(timestamp, WebhookSignature._compute_signature('{}.{}'.format(timestamp, payload),
+                                                                              secret))
+
+
+def charge(**fields):
+    return {'id': CHARGE_ID, 'object': 'charge', 'amount': 8000, 'amount_refunded': 0, 'currency': 'usd',
+            'captured': True, 'status': 'succeeded', **fields}
+
+
+def store_event(event_id, event_type, obj):
+    return WebhookEvent.objects.create(
+        gateway='stripe', event_id=event_id, type=event_type,
+        payload=json.dumps({'id': event_id, 'type': event_type, 'data': {'object': obj}}))
+
+
+@pytest.fixture
+def authorized_payment(payment_txn_preauth):
+    payment_txn_preauth.transactions.update(token=CHARGE_ID)
+    return payment_txn_preauth
+
+
+@pytest.fixture
+def captured_payment(payment_txn_captured):
+    payment_txn_captured.transactions.update(token=CHARGE_ID)
+    return payment_txn_captured
+
+
+def test_webhook_stores_each_event_once(client, db, webhook_secret, webhook_url):
+    payload = json.dumps({'id': 'evt_1', 'type': 'charge.captured', 'data': {'object': charge()}})
+
+    for _ in range(2):
+        response = client.post(webhook_url, payload, content_type='application/json',
+                               HTTP_STRIPE_SIGNATURE=signature(payload))
+        assert response.status_code == 200
+
+    event = WebhookEvent.objects.get()
+    assert (event.event_id, event.type, event.payload, event.processed) == ('evt_1', 'charge.captured', payload, None)
+
+
+def test_webhook_rejects_an_invalid_signature(client, db, webhook_secret, webhook_url):
+    payload = json.dumps({'id': 'evt_1', 'type': 'charge.captured', 'data': {'object': charge()}})
+
+    response = client.post(webhook_url, payload, content_type='application/json',
+                           HTTP_STRIPE_SIGNATURE=signature(payload, 'whsec_other'))
+
+    assert response.status_code == 400
+    assert not WebhookEvent.objects.exists()
+
+
+def test_webhook_of_a_gateway_without_secret(client, db, settings):
+    response = client.post(reverse('payment:stripe_webhook', args=[settings.DUMMY]), '{}',
+                           content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('secret', ['', None])
+def test_webhook_with_an_empty_secret(client, db, settings, webhook_url, secret):
+    gateways = copy.deepcopy(settings.PAYMENT_GATEWAYS)
+    gateways[settings.STRIPE]['config']['connection_params']['webhook_secret'] = secret
+    settings.PAYMENT_GATEWAYS = gateways
+    payload = json.dumps({'id': 'evt_1', 'type': 'charge.captured', 'data': {'object': charge()}})
+
+    # Signed with the empty secret, as anyone could
+    response = client.post(webhook_url, payload, content_type='application/json',
+                           HTTP_STRIPE_SIGNATURE=signature(payload, ''))
+
+    assert response.status_code == 400
+    assert not WebhookEvent.objects.exists()
+
+
+def test_charge_captured(authorized_payment):
+    store_event('evt_1', 'charge.captured', charge())
+    store_event('evt_2', 'charge.captured', charge())  # Another event for the same capture
+
+    assert process_events() == 2
+
+    authorized_payment.refresh_from_db()
+    assert authorized_payment.charge_status == ChargeStatus.FULLY_CHARGED
+    assert authorized_payment.captured_amount == Money(80, 'USD')
+    captures = authorized_payment.transactions.filter(kind=TransactionKind.CAPTURE)
+    assert [(t.token, t.amount, t.is_success) for t in captures] == [(CHARGE_ID, Money(80, 'USD'), True)]
+    assert not WebhookEvent.objects.filter(processed__isnull=True).exists()
+    assert process_events() == 0
+
+
+def test_charge_partially_refunded(captured_payment):
+    store_event('evt_1', 'charge.refunded', charge(amount_refunded=3000, refunds={'data': [{'id': 're_1'}]}))
+
+    process_events()
+
+    captured_payment.refresh_from_db()
+    assert captured_payment.charge_status == ChargeStatus.PARTIALLY_REFUNDED
+    assert captured_payment.captured_amount == Money(50, 'USD')
+    refund = captured_payment.transactions.get(kind=TransactionKind.REFUND)
+    assert (refund.token, refund.amount) == ('re_1', Money(30, 'USD'))
+
+    # The second refund event has the total refunded amount
+    store_event('evt_2', 'charge.refunded', charge(amount_refunded=8000, refunds={'data': [{'id': 're_2'}]}))
+    process_events()
+
+    captured_payment.refresh_from_db()
+    assert captured_payment.charge_status == ChargeStatus.FULLY_REFUNDED
+    assert not captured_payment.is_active
+    assert [t.amount for t in captured_payment.transactions.filter(kind=TransactionKind.REFUND)] == \
+        [Money(30, 'USD'), Money(50, 'USD')]
+
+
+def test_refund_recorded_by_the_gateway_is_not_recorded_again(captured_payment):
+    # gateway_refund recorded the refund with the id of the Stripe refund
+    captured_payment.transactions.create(kind=TransactionKind.REFUND, token='re_1', is_success=True,
+                                         amount=Money(30, 'USD'), gateway_response={})
+    # Its captured amount is not updated yet, as if the event was handled before gateway_refund postprocessed it
+    store_event('evt_1', 'charge.refunded', charge(amount_refunded=5000, refunds={'data': [{'id': 're_1'}]}))
+
+    process_events()
+
+    assert captured_payment.transactions.filter(kind=TransactionKind.REFUND).count() == 1
+    assert WebhookEvent.objects.get().processed is not None
+
+
+def test_uncaptured_charge_refunded(authorized_payment):
+    store_event('evt_1', 'charge.refunded', charge(captured=False, amount_refunded=8000))
+
+    process_events()
+
+    authorized_payment.refresh_from_db()
+    assert not authorized_payment.is_active
+    assert authorized_payment.transactions.filter(kind=TransactionKind.VOID, is_success=True).exists()
+
+
+def test_events_without_handler_are_only_marked_processed(authorized_payment):
+    store_event('evt_1', 'customer.created', {'id': 'cus_1', 'object': 'customer'})
+
+    assert process_events() == 1
+
+    assert WebhookEvent.objects.get().processed is not None
+    assert authorized_payment.transactions.count() == 1
+
+
+def test_events_without_payment_are_retried(authorized_payment):
+    store_event('evt_1', 'charge.captured', charge(id='ch_later'))
+
+    assert process_events() == 1
+
+    event = WebhookEvent.objects.get()
+    assert (event.processed, event.attempts, event.error) == (None, 1, webhooks.NO_PAYMENT_ERROR)
+
+    # The payment of the charge is recorded after the event arrived
+    authorized_payment.transactions.update(token='ch_later')
+    process_events()
+
+    event.refresh_from_db()
+    assert event.processed is not None
+    assert authorized_payment.transactions.filter(kind=TransactionKind.CAPTURE, token='ch_later').exists()
+
+
+def test_failed_event_is_retried_then_left_aside(authorized_payment):
+    store_event('evt_1', 'charge.captured', charge())
+
+    with patch.dict(webhooks.HANDLERS, {'charge.captured': Mock(side_effect=ValueError('boom'))}):
+        for _ in range(MAX_ATTEMPTS + 1):
+            process_events()
+
+    event = WebhookEvent.objects.get()
+    assert (event.processed, event.attempts, event.error) == (None, MAX_ATTEMPTS, 'boom')
+    authorized_payment.refresh_from_db()
+    assert authorized_payment.charge_status == ChargeStatus.NOT_CHARGED
+
+
+def test_process_webhook_events_command(authorized_payment):
+    for i in range(5):
+        store_event('evt_{}'.format(i), 'charge.captured', charge())
+    stderr = StringIO()
+
+    call_command('process_webhook_events', batch_size=2, stderr=stderr)
+
+    assert 'Processed 5 webhook events' in stderr.getvalue()
+    assert authorized_payment.transactions.filter(kind=TransactionKind.CAPTURE).count() == 1
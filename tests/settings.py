@@ -7,7 +7,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': 'test.db'
+        'NAME': 'test.db',
+        # A file, not the in-memory default: the processes of the sharded export connect to the test database too.
+        'TEST': {'NAME': 'test_payment.db'},
     },
 }
 
@@ -25,7 +27,9 @@ INSTALLED_APPS = [
     'django.contrib.auth',
     'django.contrib.messages',
     'django.contrib.contenttypes',
+    'django.contrib.sessions',
     'djmoney',
+    'import_export',
     'payment.apps.PaymentConfig',
 ]
 
@@ -84,6 +88,7 @@ PAYMENT_GATEWAYS = {
             'connection_params': {
                 'public_key': os.environ.get('STRIPE_PUBLIC_KEY'),
                 'secret_key': os.environ.get('STRIPE_SECRET_KEY'),
+                'webhook_secret': os.environ.get('STRIPE_WEBHOOK_SECRET'),
                 'store_name': os.environ.get('STRIPE_STORE_NAME', 'skioo shop'),
                 'store_image': os.environ.get('STRIPE_STORE_IMAGE', None),
                 'prefill': os.environ.get('STRIPE_PREFILL', True),
@@ -0,0 +1,95 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from payment import TransactionKind
+from .conftest import create_payments
+
+
+def count_queries(client, url):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(queries)
+
+
+def it_should_list_payments_with_a_constant_number_of_queries(admin_client, settings):
+    url = reverse('admin:payment_payment_changelist')
+    create_payments(10, settings.DUMMY)
+    queries_for_10 = count_queries(admin_client, url)
+
+    create_payments(90, settings.DUMMY)
+    queries_for_100 = count_queries(admin_client, url)
+
+    assert queries_for_100 == queries_for_10
+
+
+def it_should_list_transactions_with_a_constant_number_of_queries(admin_client, settings):
+    url = reverse('admin:payment_transaction_changelist')
+    create_payments(5, settings.DUMMY)
+    queries_for_10 = count_queries(admin_client, url)
+
+    create_payments(45, settings.DUMMY)
+    queries_for_100 = count_queries(admin_client, url)
+
+    assert queries_for_100 == queries_for_10
+
+
+def it_should_display_the_capabilities_of_payments(admin_client, payment_txn_preauth):
+    response = admin_client.get(reverse('admin:payment_payment_changelist'))
+    payment = response.context['cl'].result_list[0]
+    assert payment.transaction_count == 1
+    assert payment.is_authorized
+    assert payment.can_capture()
+    assert payment.can_void()
+    assert not payment.can_refund()
+
+
+@pytest.mark.parametrize('fixture_name', ['payment_txn_preauth', 'payment_txn_captured'])
+def it_should_display_the_payment_change_page(admin_client, request, fixture_name):
+    payment = request.getfixturevalue(fixture_name)
+    response = admin_client.get(reverse('admin:payment_payment_change', args=[payment.pk]))
+    assert response.status_code == 200
+
+
+def it_should_load_the_transactions_of_a_payment_in_windows(admin_client, payment_dummy):
+    for i in range(45):
+        payment_dummy.transactions.create(amount=payment_dummy.total, kind=TransactionKind.AUTH, is_success=False,
+                                          token='token-{}'.format(i), gateway_response='{"secret": "response"}')
+
+    response = admin_client.get(reverse('admin:payment_payment_change', args=[payment_dummy.pk]))
+    content = response.content.decode()
+    assert content.count('token-') == 20
+    assert 'token-44' in content
+    assert 'secret' not in content
+
+    tokens = []
+    url = reverse('admin:payment_transaction_timeline', args=[payment_dummy.pk])
+    while url:
+        response = admin_client.get(url)
+        tokens.extend(transaction.token for transaction in response.context['transactions'])
+        url = response.context['next_url']
+    assert tokens == ['token-{}'.format(i) for i in reversed(range(45))]
+
+
+def it_should_load_the_gateway_response_on_demand(admin_client, payment_dummy):
+    transaction = payment_dummy.transactions.create(amount=payment_dummy.total, kind=TransactionKind.AUTH,
+                                                    gateway_response='{"secret": "response"}')
+    response = admin_client.get(reverse('admin:payment_transaction_gateway_response', args=[transaction.pk]))
+    assert response.content == b'{"secret": "response"}'
+
+
+def it_should_reject_an_invalid_timeline_cursor(admin_client, payment_dummy):
+    url = reverse('admin:payment_transaction_timeline', args=[payment_dummy.pk])
+    assert admin_client.get(url, {'after': 'garbage'}).status_code == 400
+
+
+def it_should_need_the_view_permission_for_the_transactions(client, django_user_model, payment_dummy):
+    transaction = payment_dummy.transactions.create(amount=payment_dummy.total, kind=TransactionKind.AUTH,
+                                                    gateway_response='{"secret": "response"}')
+    user = django_user_model.objects.create_user('staff', password='password', is_staff=True)
+    client.force_login(user)
+    assert client.get(reverse('admin:payment_transaction_timeline', args=[payment_dummy.pk])).status_code == 403
+    assert client.get(reverse('admin:payment_transaction_gateway_response',
+                              args=[transaction.pk])).status_code == 403
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+from django.contrib.auth.models import Permission
+from django.urls import reverse
+
+from payment import ChargeStatus, bulk
+from payment.bulk import FAILED, REFUND, SKIPPED, SUCCEEDED, get_bulk_job, start_bulk_operation
+from payment.models import Payment, Transaction
+from .conftest import create_payments
+
+# The gateway calls run in other threads, they only see committed data.
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture(autouse=True)
+def single_worker(settings):
+    # The in-memory SQLite test database does not support concurrent writers.
+    settings.PAYMENT_BULK_MAX_WORKERS = 1
+
+
+def wait_for(job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_bulk_job(job_id)
+        if job['finished']:
+            return job
+        time.sleep(0.01)
+    raise AssertionError('Job {} did not finish'.format(job_id))
+
+
+def it_should_capture_the_selected_payments_in_the_background(admin_client, settings):
+    create_payments(10, settings.DUMMY)
+    ids = list(Payment.objects.values_list('pk', flat=True))
+    charged = list(Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED).values_list('pk', flat=True))
+
+    response = admin_client.post(reverse('admin:payment_payment_changelist'),
+                                 {'action': 'bulk_capture', '_selected_action': ids})
+    assert response.status_code == 302
+    job_id = response.url.rstrip('/').split('/')[-1]
+
+    job = wait_for(job_id)
+    assert job['total'] == job['processed'] == 10
+    assert job['counts'] == {SUCCEEDED: 5, SKIPPED: 5, FAILED: 0}
+    assert sorted(result['payment_id'] for result in job['unsuccessful']) == charged
+    assert {result['status'] for result in job['unsuccessful']} == {SKIPPED}
+    assert Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED).count() == 10
+
+    progress = admin_client.get(response.url)
+    assert progress.status_code == 200
+    assert progress.context['job']['finished']
+    assert b'Cannot capture this payment.' in progress.content
+
+
+def it_should_report_the_gateway_errors_of_each_payment(settings):
+    create_payments(2, settings.DUMMY)
+    Payment.objects.update(gateway='unknown')
+    refundable = Payment.objects.get(charge_status=ChargeStatus.FULLY_CHARGED)
+    job = wait_for(start_bulk_operation(REFUND, Payment.objects.values_list('pk', flat=True)))
+    assert job['counts'] == {SUCCEEDED: 0, SKIPPED: 1, FAILED: 1}
+    assert [result['payment_id'] for result in job['unsuccessful'] if result['status'] == FAILED] == [refundable.pk]
+
+
+def it_should_keep_the_failed_transactions(settings, monkeypatch):
+    create_payments(2, settings.DUMMY)
+    monkeypatch.setattr('payment.gateways.dummy.dummy_success', lambda: False)
+    payment = Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED).get()
+    job = wait_for(start_bulk_operation(REFUND, [payment.pk]))
+    assert job['counts'][FAILED] == 1
+    assert Transaction.objects.filter(payment=payment, kind='refund', is_success=False).exists()
+
+
+def it_should_need_the_change_permission(client, django_user_model, settings):
+    create_payments(2, settings.DUMMY)
+    user = django_user_model.objects.create_user('viewer', password='password', is_staff=True)
+    user.user_permissions.add(Permission.objects.get(codename='view_payment'))
+    client.force_login(user)
+    ids = list(Payment.objects.values_list('pk', flat=True))
+    captured = Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED).count()
+
+    response = client.post(reverse('admin:payment_payment_changelist'),
+                           {'action': 'bulk_capture', '_selected_action': ids})
+
+    assert response.status_code == 200  # The action is not available, no job is started
+    assert Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED).count() == captured
+
+
+def it_should_mark_the_jobs_without_progress_as_stale(admin_client, admin_user):
+    job = bulk.BulkJob(REFUND, [1, 2], admin_user.pk)
+    job.save()
+    assert not get_bulk_job(job.id)['stale']
+
+    # The process of the job was stopped long ago
+    state = dict(job.as_dict(), updated=time.time() - bulk.JOB_STALE_AFTER - 1)
+    bulk._get_cache().set(bulk._cache_key(job.id), state)
+    assert get_bulk_job(job.id)['stale']
+    response = admin_client.get(reverse('admin:payment_bulk_job', args=[job.id]))
+    assert b'http-equiv="refresh"' not in response.content
+    assert b'Interrupted' in response.content
+
+
+def it_should_show_a_job_only_to_its_user_with_the_change_permission(client, admin_user, django_user_model):
+    job_id = start_bulk_operation(REFUND, [], admin_user.pk)
+    url = reverse('admin:payment_bulk_job', args=[job_id])
+    user = django_user_model.objects.create_user('staff', password='password', is_staff=True)
+    user.user_permissions.add(Permission.objects.get(codename='view_payment'))
+    client.force_login(user)
+    assert client.get(url).status_code == 403
+
+    user.user_permissions.add(Permission.objects.get(codename='change_payment'))
+    assert client.get(url).status_code == 404
+
+    client.force_login(admin_user)
+    assert client.get(url).status_code == 200
+
+
+def it_should_not_find_unknown_jobs(admin_client):
+    assert get_bulk_job('0123abc') is None
+    assert admin_client.get(reverse('admin:payment_bulk_job', args=['0123abc'])).status_code == 404
+
+
+def it_should_refuse_unknown_operations():
+    with pytest.raises(ValueError):
+        start_bulk_operation('steal', [1])
+
+
+def it_should_bound_the_worker_pool(settings):
+    settings.PAYMENT_BULK_MAX_WORKERS = 3
+    assert bulk._get_executor()._max_workers == 3
@@ -0,0 +1,87 @@
+import io
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from payment import TransactionKind
+from payment.changes import Watermark, acknowledge_changes, get_changes, get_watermark, read_changes
+from payment.models import Payment
+from payment.utils import gateway_authorize
+from .conftest import create_payments
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def no_settle_delay(settings):
+    settings.PAYMENT_CHANGE_FEED_SETTLE_SECONDS = 0
+
+
+def it_should_page_through_the_changes_in_modified_order(settings):
+    create_payments(5, settings.DUMMY)
+    # Ties on the modified time are broken by the id
+    Payment.objects.update(modified=timezone.now() - timedelta(minutes=1))
+
+    ids = []
+    watermark = Watermark()
+    while True:
+        page = get_changes(watermark, limit=2)
+        ids.extend(payment.id for payment in page.payments)
+        watermark = page.watermark
+        if not page.has_more:
+            break
+    assert ids == sorted(Payment.objects.values_list('id', flat=True))
+    assert get_changes(watermark).payments == []
+    assert get_changes(watermark).watermark == watermark
+
+
+def it_should_feed_the_payments_with_new_transactions(payment_dummy):
+    page = get_changes(Watermark())
+    assert [p.id for p in page.payments] == [payment_dummy.id]
+    assert page.payments[0].new_transactions == []
+
+    transaction = gateway_authorize(payment_dummy, 'token')
+    next_page = get_changes(page.watermark)
+    assert [p.id for p in next_page.payments] == [payment_dummy.id]
+    assert next_page.payments[0].new_transactions == [transaction]
+
+
+def it_should_create_transactions_without_updating_their_payment(payment_dummy):
+    with CaptureQueriesContext(connection) as queries:
+        payment_dummy.transactions.create(amount=payment_dummy.total, kind=TransactionKind.AUTH,
+                                          is_success=True, gateway_response='{}')
+    assert len(queries) == 1
+
+
+def it_should_wait_for_the_changes_to_settle(settings, payment_dummy):
+    settings.PAYMENT_CHANGE_FEED_SETTLE_SECONDS = 60
+    assert get_changes(Watermark()).payments == []
+
+
+def it_should_persist_the_watermark_of_each_consumer(settings):
+    create_payments(3, settings.DUMMY)
+    assert get_watermark('warehouse') == Watermark()
+
+    page = read_changes('warehouse', limit=2)
+    acknowledge_changes('warehouse', page.watermark)
+    assert get_watermark('warehouse') == page.watermark
+    assert len(read_changes('warehouse').payments) == 1
+    assert len(read_changes('billing').payments) == 3
+
+
+def it_should_export_the_changes_from_the_command(settings):
+    create_payments(3, settings.DUMMY)
+    out = io.StringIO()
+    call_command('export_changes', 'warehouse', '--page-size', '2', stdout=out, stderr=io.StringIO())
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(rows) == 3
+    assert rows[0]['new_transactions'][0]['kind'] == TransactionKind.AUTH
+
+    out = io.StringIO()
+    call_command('export_changes', 'warehouse', stdout=out, stderr=io.StringIO())
+    assert out.getvalue() == ''
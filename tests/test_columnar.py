@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+import pytest
+from django.core.management import call_command
+
+from payment import ChargeStatus
+from payment.columnar import ARROW, write_payments, write_transactions
+from .conftest import create_payments
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+@pytest.mark.django_db
+def it_should_write_typed_payment_columns(settings, tmp_path):
+    create_payments(25, settings.DUMMY)
+    path = str(tmp_path / 'payments.parquet')
+    assert write_payments(path, row_group_size=10) == 25
+
+    parquet = pq.ParquetFile(path)
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    schema = table.schema
+    assert schema.field('total_amount').type == pa.decimal128(12, 2)
+    assert schema.field('created').type == pa.timestamp('us', tz='UTC')
+    assert pa.types.is_dictionary(schema.field('gateway').type)
+    assert pa.types.is_dictionary(schema.field('charge_status').type)
+
+    rows = table.to_pylist()
+    assert rows[0]['total_amount'] == Decimal('80.00')
+    assert rows[0]['total_currency'] == 'CHF'
+    assert rows[0]['created'].tzinfo is not None
+    assert sorted({row['charge_status'] for row in rows}) == [ChargeStatus.FULLY_CHARGED, ChargeStatus.NOT_CHARGED]
+
+
+@pytest.mark.django_db
+def it_should_write_transactions_to_arrow_files(settings, tmp_path):
+    create_payments(4, settings.DUMMY)
+    path = str(tmp_path / 'transactions.arrow')
+    assert write_transactions(path, file_format=ARROW, row_group_size=2) == 6
+
+    with pa.ipc.open_file(path) as reader:
+        assert reader.num_record_batches == 3
+        table = reader.read_all()
+    assert pa.types.is_dictionary(table.schema.field('kind').type)
+    assert table.column('amount').type == pa.decimal128(12, 2)
+    assert table.column('payment_gateway').to_pylist() == ['dummy'] * 6
+
+
+@pytest.mark.django_db
+def it_should_export_from_the_command(settings, tmp_path):
+    create_payments(3, settings.DUMMY)
+    path = str(tmp_path / 'payments.parquet')
+    call_command('export_columnar', 'payments', path, '--row-group-size', '2', stdout=None)
+    assert pq.ParquetFile(path).metadata.num_rows == 3
+
+    empty = str(tmp_path / 'empty.parquet')
+    call_command('export_columnar', 'transactions', empty, '--created-until', '2000-01-01')
+    assert pq.read_table(empty).num_rows == 0
@@ -0,0 +1,67 @@
+from decimal import Decimal
+
+import pytest
+
+from payment import currencies
+from payment.currencies import (
+    from_minor_units,
+    from_minor_units_batch,
+    get_exponent,
+    to_minor_units,
+    to_minor_units_batch,
+)
+
+
+@pytest.fixture(params=['numpy', 'pure-python'])
+def numpy_or_not(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(currencies, 'np', None)
+
+
+def it_should_return_iso_exponents():
+    assert get_exponent('CHF') == 2
+    assert get_exponent('chf') == 2
+    assert get_exponent('JPY') == 0
+    assert get_exponent('KWD') == 3
+    assert get_exponent('CLF') == 4
+
+
+def it_should_default_to_two_decimals_for_unknown_currencies():
+    assert get_exponent('XXX') == 2
+
+
+def it_should_convert_to_and_from_minor_units():
+    assert to_minor_units(Decimal('10.50'), 'CHF') == 1050
+    assert to_minor_units(Decimal('10'), 'JPY') == 10
+    assert to_minor_units(Decimal('1.234'), 'KWD') == 1234
+    assert to_minor_units(Decimal(24.24), 'USD') == 2424
+    assert from_minor_units(1050, 'CHF') == Decimal('10.50')
+    assert from_minor_units(10, 'JPY') == Decimal('10')
+    assert from_minor_units(1234, 'KWD') == Decimal('1.234')
+
+
+def it_should_convert_batches_in_a_single_currency(numpy_or_not):
+    amounts = [Decimal('10.50'), Decimal('0.01'), Decimal('-3'), Decimal('123456789.99')]
+    assert list(to_minor_units_batch(amounts, 'CHF')) == [1050, 1, -300, 12345678999]
+    assert from_minor_units_batch([1050, 1, -300, 12345678999], 'CHF') == amounts
+
+
+def it_should_convert_batches_in_mixed_currencies(numpy_or_not):
+    amounts = [Decimal('10.50'), Decimal('10'), Decimal('1.234'), Decimal('0.01')]
+    currency_codes = ['CHF', 'JPY', 'KWD', 'CHF']
+    assert list(to_minor_units_batch(amounts, currency_codes)) == [1050, 10, 1234, 1]
+    assert from_minor_units_batch([1050, 10, 1234, 1], currency_codes) == amounts
+
+
+def it_should_agree_with_the_scalar_conversion(numpy_or_not):
+    amounts = [Decimal(n).scaleb(-2) for n in range(-10000, 10000, 7)]
+    assert list(to_minor_units_batch(amounts, 'EUR')) == [to_minor_units(a, 'EUR') for a in amounts]
+
+
+def it_should_refuse_mismatched_currencies(numpy_or_not):
+    with pytest.raises(ValueError):
+        to_minor_units_batch([Decimal(1), Decimal(2)], ['CHF'])
+    with pytest.raises(ValueError):
+        from_minor_units_batch([1, 2], ['CHF'])
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.urls import reverse
+
+from payment import ChargeStatus
+from payment.export import PAYMENT_EXPORT_FIELDS, TRANSACTION_EXPORT_FIELDS, PaymentResource, TransactionResource, \
+    export_rows, stream_csv
+from payment.models import Payment, Transaction
+from .conftest import create_payments
+
+
+def streamed_content(response):
+    assert response.streaming
+    return b''.join(response.streaming_content).decode()
+
+
+def it_should_stream_the_same_columns_as_the_resource(payment_txn_captured):
+    exported = PaymentResource().export(Payment.objects.all()).csv
+    streamed = ''.join(stream_csv([name for name, _column in PAYMENT_EXPORT_FIELDS],
+                                  export_rows(Payment.objects.all(), PAYMENT_EXPORT_FIELDS)))
+    exported_rows = list(csv.reader(io.StringIO(exported)))
+    streamed_rows = list(csv.reader(io.StringIO(streamed)))
+    assert streamed_rows[0] == exported_rows[0]
+    assert streamed_rows[1][2:] == exported_rows[1][2:]  # The resource formats dates and booleans differently
+
+
+def it_should_stream_csv_with_the_changelist_filters(admin_client, settings):
+    create_payments(1200, settings.DUMMY)
+    url = reverse('admin:payment_payment_stream_export', args=['csv'])
+    response = admin_client.get(url, {'charge_status__exact': ChargeStatus.FULLY_CHARGED})
+    assert response['Content-Disposition'] == 'attachment; filename="payments.csv"'
+    rows = list(csv.DictReader(io.StringIO(streamed_content(response))))
+    assert len(rows) == 600
+    assert {row['charge_status'] for row in rows} == {ChargeStatus.FULLY_CHARGED}
+    assert rows[0]['total_amount'] == '81.00'
+    assert rows[0]['captured_currency'] == 'CHF'
+
+
+def it_should_stream_json_lines_with_the_changelist_search(admin_client, settings):
+    create_payments(20, settings.DUMMY)
+    url = reverse('admin:payment_payment_stream_export', args=['jsonl'])
+    response = admin_client.get(url, {'q': 'test7@example.com'})
+    lines = streamed_content(response).splitlines()
+    assert len(lines) == 1
+    row = json.loads(lines[0])
+    assert row['customer_email'] == 'test7@example.com'
+    assert row['total_amount'] == '87.00'
+    assert row['total_currency'] == 'CHF'
+    assert row['active'] is True
+
+
+def it_should_build_the_export_queryset_without_queries(rf, admin_user, django_assert_num_queries):
+    request = rf.get('/', {'charge_status__exact': ChargeStatus.FULLY_CHARGED, 'q': 'test7@example.com'})
+    request.user = admin_user
+    with django_assert_num_queries(0):
+        queryset = admin.site._registry[Payment].get_streaming_export_queryset(request)
+    assert 'charge_status' in str(queryset.query)
+
+
+def it_should_link_to_the_streaming_export(admin_client, payment_dummy):
+    response = admin_client.get(reverse('admin:payment_payment_changelist'), {'gateway': 'dummy'})
+    export_url = reverse('admin:payment_payment_stream_export', args=['jsonl']) + '?gateway=dummy'
+    assert export_url in response.content.decode()
+
+
+def it_should_export_transactions_with_their_payment_fields(payment_txn_captured):
+    dataset = TransactionResource().export(Transaction.objects.all())
+    assert 'gateway_response' not in dataset.headers
+    row = dataset.dict[0]
+    assert row['payment_id'] == str(payment_txn_captured.pk)
+    assert row['amount'] == Decimal('80.00')
+    assert row['currency'] == 'USD'
+    assert row['payment_gateway'] == 'dummy'
+    assert row['customer_email'] == 'test@example.com'
+
+    assert 'gateway_response' in TransactionResource(include_gateway_response=True).export().headers
+
+
+def it_should_stream_the_same_transaction_columns_as_the_resource(payment_txn_captured):
+    assert [name for name, _column in TRANSACTION_EXPORT_FIELDS] == TransactionResource().get_export_headers()
+
+
+def it_should_stream_transactions_in_one_query(admin_client, settings, django_assert_max_num_queries):
+    create_payments(20, settings.DUMMY)
+    url = reverse('admin:payment_transaction_stream_export', args=['csv'])
+    response = admin_client.get(url, {'kind__exact': 'capture'})
+    with django_assert_max_num_queries(1):
+        rows = list(csv.DictReader(io.StringIO(streamed_content(response))))
+    assert len(rows) == 10
+    assert {row['payment_gateway'] for row in rows} == {'dummy'}
+
+
+def it_should_export_transactions_from_the_command(payment_txn_captured, tmp_path):
+    out = io.StringIO()
+    call_command('export_transactions', '--format', 'jsonl', '--gateway-response', stdout=out)
+    row = json.loads(out.getvalue())
+    assert row['customer_email'] == 'test@example.com'
+    assert row['gateway_response'] == '{}'
+
+    output = tmp_path / 'transactions.csv'
+    call_command('export_transactions', '--created-until', '2000-01-01', '--output', str(output))
+    assert output.read_text().splitlines() == [','.join(name for name, _column in TRANSACTION_EXPORT_FIELDS)]
@@ -0,0 +1,176 @@
+from decimal import Decimal
+
+import pytest
+from hypothesis import given, strategies as st
+from moneyed import Money
+
+from payment import ChargeStatus, PaymentError, TransactionKind
+from payment.currencies import get_exponent
+from payment.models import Payment
+from payment.money import MinorMoney
+from payment.utils import _gateway_postprocess, clean_capture
+
+CURRENCIES = ['CHF', 'USD', 'JPY', 'KRW', 'KWD', 'BHD']
+
+currencies = st.sampled_from(CURRENCIES)
+
+
+@st.composite
+def money_pairs(draw):
+    """ Two Money objects in the same currency, with amounts representable in that currency. """
+    currency = draw(currencies)
+    exponent = get_exponent(currency)
+    a, b = draw(st.lists(st.integers(min_value=-10 ** 12, max_value=10 ** 12), min_size=2, max_size=2))
+    return Money(Decimal(a).scaleb(-exponent), currency), Money(Decimal(b).scaleb(-exponent), currency)
+
+
+@given(money_pairs())
+def it_should_round_trip_money(pair):
+    money, _ = pair
+    assert MinorMoney.from_money(money).to_money() == money
+
+
+@given(money_pairs())
+def it_should_add_and_subtract_like_money(pair):
+    a, b = pair
+    assert (MinorMoney.from_money(a) + MinorMoney.from_money(b)).to_money() == a + b
+    assert (MinorMoney.from_money(a) - MinorMoney.from_money(b)).to_money() == a - b
+
+
+@given(money_pairs())
+def it_should_compare_like_money(pair):
+    a, b = pair
+    minor_a, minor_b = MinorMoney.from_money(a), MinorMoney.from_money(b)
+    assert (minor_a < minor_b) == (a < b)
+    assert (minor_a <= minor_b) == (a <= b)
+    assert (minor_a > minor_b) == (a > b)
+    assert (minor_a >= minor_b) == (a >= b)
+    assert (minor_a == minor_b) == (a == b)
+
+
+def it_should_refuse_to_mix_currencies():
+    with pytest.raises(TypeError):
+        MinorMoney(1, 'CHF') + MinorMoney(1, 'EUR')
+    with pytest.raises(TypeError):
+        MinorMoney(1, 'CHF') < MinorMoney(1, 'EUR')
+
+
+def it_should_refuse_amounts_more_precise_than_the_currency():
+    with pytest.raises(ValueError):
+        MinorMoney.from_money(Money('10.5', 'JPY'))
+
+
+##############################################################################
+# The state machine computes the same results as the original Money based implementation
+
+def money_clean_capture_error(total, captured, amount):
+    if amount.amount <= 0:
+        return 'Amount should be a positive number.'
+    if amount > total or amount > (total - captured):
+        return 'Unable to charge more than un-captured amount.'
+
+
+def money_capture_status(total, captured, amount):
+    captured += amount
+    return captured, ChargeStatus.FULLY_CHARGED if (total - captured).amount <= 0 else ChargeStatus.PARTIALLY_CHARGED
+
+
+def money_refund_status(captured, amount):
+    captured -= amount
+    return captured, ChargeStatus.FULLY_REFUNDED if captured.amount <= 0 else ChargeStatus.PARTIALLY_REFUNDED
+
+
+@st.composite
+def capture_cases(draw):
+    currency = draw(currencies)
+    exponent = get_exponent(currency)
+    total = draw(st.integers(min_value=1, max_value=10 ** 10))
+    captured = draw(st.integers(min_value=0, max_value=total))
+    amount = draw(st.integers(min_value=-10, max_value=total + 10))
+    return tuple(Money(Decimal(x).scaleb(-exponent), currency) for x in (total, captured, amount))
+
+
+class _Payment:
+    """ Just enough of a payment for the validations and the post-processing. """
+
+    def __init__(self, total, captured_amount):
+        self.total = total
+        self.captured_amount = captured_amount
+        self.charge_status = ChargeStatus.NOT_CHARGED
+        self.is_active = True
+        self.needs_reconciliation = False
+
+    def can_capture(self):
+        return True
+
+    def save(self):
+        pass
+
+
+class _Transaction:
+    def __init__(self, kind, amount):
+        self.kind = kind
+        self.amount = amount
+
+
+@given(capture_cases())
+def it_should_validate_captures_like_money(case):
+    total, captured, amount = case
+    expected_error = money_clean_capture_error(total, captured, amount)
+    try:
+        clean_capture(_Payment(total, captured), amount)
+        error = None
+    except PaymentError as e:
+        error = e.message
+    assert error == expected_error
+
+
+@pytest.mark.django_db
+@given(capture_cases())
+def it_should_postprocess_captures_like_money(case):
+    total, captured, amount = case
+    expected_captured, expected_status = money_capture_status(total, captured, amount)
+
+    payment = _Payment(total, captured)
+    _gateway_postprocess(_Transaction(TransactionKind.CAPTURE, amount), payment)
+    assert payment.captured_amount == expected_captured
+    assert payment.charge_status == expected_status
+
+
+@pytest.mark.django_db
+@given(capture_cases())
+def it_should_postprocess_refunds_like_money(case):
+    total, captured, amount = case
+    expected_captured, expected_status = money_refund_status(captured, amount)
+
+    payment = _Payment(total, captured)
+    _gateway_postprocess(_Transaction(TransactionKind.REFUND, amount), payment)
+    assert payment.captured_amount == expected_captured
+    assert payment.charge_status == expected_status
+
+
+@pytest.mark.django_db
+def it_should_capture_the_existing_amounts_more_precise_than_the_currency():
+    payment = _Payment(Money('10.50', 'JPY'), None)
+    clean_capture(payment, Money('10.50', 'JPY'))
+    _gateway_postprocess(_Transaction(TransactionKind.CAPTURE, Money('10.50', 'JPY')), payment)
+    assert payment.captured_amount == Money('10.50', 'JPY')
+    assert payment.charge_status == ChargeStatus.FULLY_CHARGED
+
+
+@pytest.mark.django_db
+def it_should_sum_the_authorized_amounts_exactly(settings):
+    payment = Payment.objects.create(gateway=settings.DUMMY, total=Money('10.50', 'JPY'),
+                                     captured_amount=Money(0, 'JPY'), customer_email='test@example.com')
+    payment.transactions.create(kind=TransactionKind.AUTH, amount=Money('10.50', 'JPY'), is_success=True,
+                                gateway_response={})
+    assert payment.get_authorized_amount() == Money('10.50', 'JPY')
+
+
+@pytest.mark.django_db
+def it_should_flag_a_transaction_in_another_currency_for_reconciliation():
+    payment = _Payment(Money(80, 'CHF'), Money(80, 'CHF'))
+    _gateway_postprocess(_Transaction(TransactionKind.REFUND, Money(80, 'EUR')), payment)
+    assert payment.captured_amount == Money(80, 'CHF')
+    assert payment.charge_status == ChargeStatus.NOT_CHARGED
+    assert payment.needs_reconciliation
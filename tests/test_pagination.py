@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+
+from payment import ChargeStatus
+from payment.models import Payment
+from payment.pagination import estimate_count
+from .conftest import create_payments
+
+URL = 'admin:payment_payment_changelist'
+
+
+def page_ids(response):
+    return [payment.pk for payment in response.context['cl'].result_list]
+
+
+def it_should_walk_the_payments_with_keyset_pagination(admin_client, settings):
+    create_payments(250, settings.DUMMY)
+    expected = list(Payment.objects.order_by('-created', '-pk').values_list('pk', flat=True))
+    url = reverse(URL)
+
+    seen = []
+    response = admin_client.get(url)
+    while True:
+        cl = response.context['cl']
+        assert cl.keyset_pagination
+        seen.extend(page_ids(response))
+        if not cl.next_url:
+            break
+        response = admin_client.get(url + cl.next_url)
+    assert seen == expected
+
+    # And back
+    previous = admin_client.get(url + response.context['cl'].previous_url)
+    assert page_ids(previous) == expected[100:200]
+
+
+def it_should_keep_the_filters_when_paginating(admin_client, settings):
+    create_payments(250, settings.DUMMY)
+    url = reverse(URL)
+    response = admin_client.get(url, {'charge_status': ChargeStatus.FULLY_CHARGED})
+    next_url = response.context['cl'].next_url
+    assert 'charge_status=fully-charged' in next_url
+
+    response = admin_client.get(url + next_url)
+    assert response.context['cl'].result_count == 125
+    assert all(payment.charge_status == ChargeStatus.FULLY_CHARGED for payment in response.context['cl'].result_list)
+    # The cursor is not carried over to other filters
+    assert 'after' not in response.context['cl'].get_query_string({'is_active__exact': 1})
+
+
+def it_should_paginate_with_offsets_in_other_orders(admin_client, settings):
+    create_payments(150, settings.DUMMY)
+    response = admin_client.get(reverse(URL), {'o': '5'})
+    cl = response.context['cl']
+    assert not cl.keyset_pagination
+    assert cl.multi_page
+    assert len(cl.result_list) == 100
+
+
+def it_should_reject_invalid_cursors(admin_client):
+    response = admin_client.get(reverse(URL), {'after': 'garbage'})
+    assert response.status_code == 302
+
+
+def it_should_filter_on_bounded_creation_ranges(admin_client, settings):
+    create_payments(3, settings.DUMMY)
+    Payment.objects.filter(pk=Payment.objects.earliest('pk').pk).update(created=timezone.now() - timedelta(days=60))
+    response = admin_client.get(reverse(URL), {'created_range': '30d'})
+    assert response.context['cl'].result_count == 2
+    response = admin_client.get(reverse(URL), {'created_range': '365d'})
+    assert response.context['cl'].result_count == 3
+
+
+@pytest.mark.django_db
+def it_should_count_exactly_on_small_tables(settings):
+    create_payments(3, settings.DUMMY)
+    assert estimate_count(Payment.objects.all()) == 3
+    assert estimate_count(Payment.objects.filter(charge_status=ChargeStatus.FULLY_CHARGED)) == 1
@@ -0,0 +1,68 @@
+import pytest
+from moneyed import Money
+
+from payment import TransactionKind
+from payment.models import Payment, Transaction
+from payment.search import SearchShape, get_search_shape, payment_search_filter, transaction_search_filter
+
+
+@pytest.mark.parametrize('term, shape', [
+    ('123', SearchShape.ID),
+    ('9' * 18, SearchShape.ID),
+    ('9' * 19, SearchShape.TOKEN),
+    ('12.50', SearchShape.AMOUNT),
+    ('12.50 CHF', SearchShape.AMOUNT),
+    ('chf 12', SearchShape.AMOUNT),
+    ('john@example.com', SearchShape.EMAIL),
+    ('john@exa', SearchShape.PARTIAL_EMAIL),
+    ('ch_1Fk2', SearchShape.TOKEN),
+    ('7624b99699f344e3b6da9884d20f0b27', SearchShape.TOKEN),
+    ('john', SearchShape.TOKEN),
+])
+def it_should_recognize_the_shape_of_search_terms(term, shape):
+    assert get_search_shape(term) == shape
+
+
+@pytest.fixture
+def payments(db, settings):
+    return [
+        Payment.objects.create(gateway=settings.DUMMY, total=Money('12.50', 'CHF'), captured_amount=Money(0, 'CHF'),
+                               customer_email='john@example.com', token='ch_1Fk2abc'),
+        Payment.objects.create(gateway=settings.DUMMY, total=Money('12.50', 'EUR'), captured_amount=Money(0, 'EUR'),
+                               customer_email='jane@example.com', token='7624b99699f344e3'),
+    ]
+
+
+def search_payments(term):
+    return list(Payment.objects.filter(payment_search_filter(term)))
+
+
+def it_should_search_payments(payments):
+    john, jane = payments
+    assert search_payments(str(john.pk)) == [john]
+    assert search_payments('12.50') == [john, jane]
+    assert search_payments('12.50 EUR') == [jane]
+    assert search_payments('John@Example.com') == [john]
+    assert search_payments('jane@ex') == [jane]
+    assert search_payments('ch_1Fk') == [john]
+    assert search_payments('7624b') == [jane]
+    assert search_payments('jan') == [jane]
+    assert search_payments('nobody') == []
+    assert search_payments('1' * 40) == []
+
+
+def it_should_search_transactions(payments):
+    john, jane = payments
+    txn = Transaction.objects.create(payment=john, kind=TransactionKind.AUTH, token='ch_1Fk2abc',
+                                     amount=john.total, gateway_response={})
+    assert list(Transaction.objects.filter(transaction_search_filter(str(john.pk)))) == [txn]
+    assert list(Transaction.objects.filter(transaction_search_filter('ch_1F'))) == [txn]
+    assert list(Transaction.objects.filter(transaction_search_filter(str(jane.pk)))) == []
+    assert list(Transaction.objects.filter(transaction_search_filter('1' * 40))) == []
+
+
+def it_should_search_from_the_admin(admin_client, payments):
+    response = admin_client.get('/admin/payment/payment/', {'q': 'jane@example.com'})
+    assert list(response.context['cl'].result_list) == [payments[1]]
+    response = admin_client.get('/admin/payment/transaction/', {'q': '12.50'})
+    assert response.status_code == 200
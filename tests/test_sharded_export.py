@@ -0,0 +1,76 @@
+import csv
+import io
+import os
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from payment.models import Payment
+from payment.sharded_export import Manifest
+from .conftest import create_payments
+
+pytestmark = pytest.mark.django_db
+
+
+def export(*args, workers=1):
+    out = io.StringIO()
+    call_command('export_payments', *args, '--workers', str(workers), stdout=out)
+    return out.getvalue()
+
+
+def read_csv_rows(directory, manifest):
+    rows = []
+    for shard in manifest.shards:
+        with open(os.path.join(directory, shard.file), newline='', encoding='utf-8') as f:
+            rows.extend(csv.DictReader(f))
+    return rows
+
+
+def it_should_export_one_file_per_shard_with_a_manifest(settings, tmp_path):
+    create_payments(50, settings.DUMMY)
+    output = export(str(tmp_path), '--shards', '4')
+    assert 'Exported 50 payments' in output
+
+    manifest = Manifest.load(str(tmp_path))
+    assert [shard.done for shard in manifest.shards] == [True] * 4
+    assert sum(shard.rows for shard in manifest.shards) == 50
+    assert len(read_csv_rows(str(tmp_path), manifest)) == 50
+
+
+@pytest.mark.django_db(transaction=True)  # The worker processes only see committed data
+def it_should_export_in_worker_processes(settings, tmp_path):
+    create_payments(30, settings.DUMMY)
+    output = export(str(tmp_path), '--shards', '3', workers=2)
+    assert 'Exported 30 payments' in output
+
+    manifest = Manifest.load(str(tmp_path))
+    assert [shard.done for shard in manifest.shards] == [True] * 3
+    assert sorted(row['customer_email'] for row in read_csv_rows(str(tmp_path), manifest)) == \
+        sorted(Payment.objects.values_list('customer_email', flat=True))
+
+
+def it_should_resume_an_interrupted_export(settings, tmp_path):
+    create_payments(20, settings.DUMMY)
+    export(str(tmp_path), '--shards', '4', '--model', 'transactions', '--format', 'jsonl')
+
+    # As if the export had crashed while writing the last shard
+    manifest = Manifest.load(str(tmp_path))
+    last = manifest.shards[-1]
+    last.done = False
+    manifest.save(str(tmp_path))
+    os.remove(os.path.join(str(tmp_path), last.file))
+
+    with pytest.raises(CommandError):
+        export(str(tmp_path))
+    output = export(str(tmp_path), '--resume')
+    assert 'Shard {}:'.format(last.index) in output
+    assert 'Shard 0:' not in output
+
+    manifest = Manifest.load(str(tmp_path))
+    assert all(shard.done for shard in manifest.shards)
+    assert sum(len((tmp_path / shard.file).read_text().splitlines()) for shard in manifest.shards) == 30
+
+
+def it_should_export_nothing_from_an_empty_table(tmp_path):
+    assert 'Exported 0 payments' in export(str(tmp_path))
+    assert Manifest.load(str(tmp_path)).shards == []